@@ -0,0 +1,77 @@
+"""
+Benchmark the cold start of `python -m mirtoolkit.ytdb --help` and `import mirtoolkit`.
+
+Each command runs in a fresh interpreter several times and the median wall time is compared with
+the interpreter's own startup (`python -c pass`). The script exits with a non-zero status if the
+overhead exceeds the budget, so it can guard the startup time in CI or cron hosts.
+
+    python scripts/bench_import_time.py --budget_ms 50
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "python -c pass": [sys.executable, "-c", "pass"],
+    "import mirtoolkit": [sys.executable, "-c", "import mirtoolkit"],
+    "ytdb --help": [sys.executable, "-m", "mirtoolkit.ytdb", "--help"],
+}
+
+# modules that must not be imported by the commands above
+HEAVY_MODULES = ["torch", "torchaudio", "numpy", "tqdm", "sqlite3", "concurrent.futures"]
+
+
+def time_command(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def imported_modules(code):
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\nimport sys\nprint('\\n'.join(sys.modules))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import time benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per command")
+    parser.add_argument(
+        "--budget_ms", type=float, default=50.0, help="Allowed overhead over `python -c pass`"
+    )
+    args = parser.parse_args()
+
+    baseline = time_command(COMMANDS["python -c pass"], args.repeat)
+    over_budget = False
+    print(f"{'command':<24}{'median (ms)':>14}{'overhead (ms)':>16}")
+    for name, command in COMMANDS.items():
+        elapsed = time_command(command, args.repeat)
+        overhead = (elapsed - baseline) * 1000
+        over_budget |= overhead > args.budget_ms
+        print(f"{name:<24}{elapsed * 1000:>14.1f}{overhead:>16.1f}")
+
+    code = "import sys; sys.argv = ['ytdb']\nimport mirtoolkit.ytdb"
+    heavy = sorted(set(HEAVY_MODULES) & imported_modules(code))
+    if heavy:
+        print(f"Heavy modules imported by mirtoolkit.ytdb: {', '.join(heavy)}")
+
+    if over_budget or heavy:
+        print(f"FAILED: budget is {args.budget_ms:g} ms over the interpreter startup")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark peak RSS and wall time of `mirtoolkit.utils.load_audio` on a long file.
+
+Each case runs in a fresh interpreter, so the peak RSS of one case doesn't leak into the next.
+
+    python scripts/bench_load_audio.py --minutes 30
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CASES = {
+    # the implementation before the zero-copy path, kept here for comparison
+    "legacy": """
+import torch, torchaudio
+waveform, sr = torchaudio.load(PATH, channels_first=False)
+waveform = waveform.mean(-1, keepdim=False)
+waveform = waveform.to(dtype=torch.float64)
+waveform = waveform.squeeze().numpy()
+""",
+    "float64 mono": """
+from mirtoolkit.utils import load_audio
+waveform, sr = load_audio(PATH, dtype="float64", mono=True)
+""",
+    "float32 mono": """
+from mirtoolkit.utils import load_audio
+waveform, sr = load_audio(PATH, mono=True)
+""",
+    "float32 mono, pooled x3": """
+from mirtoolkit.utils import AudioBufferPool, load_audio
+pool = AudioBufferPool()
+for _ in range(3):
+    waveform, sr = load_audio(PATH, mono=True, out=pool)
+""",
+}
+
+RUNNER = """
+import json, resource, time
+import numpy, torch, torchaudio, soundfile
+PATH = {path!r}
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": elapsed, "peak_mib": (rss_after - rss_before) / 1024}}))
+"""
+
+
+def run_case(path, code):
+    result = subprocess.run(
+        [sys.executable, "-c", RUNNER.format(path=str(path), code=code)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="load_audio benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--minutes", type=float, default=30.0, help="Length of the test file")
+    parser.add_argument("--sr", type=int, default=44100, help="Sample rate of the test file")
+    args = parser.parse_args()
+
+    import numpy as np
+    import soundfile as sf
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "long.wav"
+        num_frames = int(args.minutes * 60 * args.sr)
+        with sf.SoundFile(path, "w", args.sr, 2, subtype="PCM_16") as f:
+            rng = np.random.default_rng(0)
+            for start in range(0, num_frames, args.sr * 60):
+                frames = min(args.sr * 60, num_frames - start)
+                f.write(0.1 * rng.standard_normal((frames, 2)).astype(np.float32))
+
+        print(f"{args.minutes:g} min stereo, {args.sr} Hz, PCM_16")
+        print(f"{'case':<28}{'seconds':>10}{'peak RSS (MiB)':>18}")
+        for name, code in CASES.items():
+            stats = run_case(path, code)
+            print(f"{name:<28}{stats['seconds']:>10.2f}{stats['peak_mib']:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,40 @@
+import importlib
+
 from .version import VERSION, VERSION_SHORT
+
+# Submodules, model wrappers and the model registry are imported on first access (PEP 562), so `import mirtoolkit`
+# doesn't load torch or the model packages.
+_SUBMODULES = {
+    "beat_this",
+    "bytedance_piano_transcription",
+    "cache",
+    "config",
+    "demucs",
+    "lead_sheet",
+    "models",
+    "runner",
+    "sheetsage",
+    "utils",
+    "ytdb",
+}
+_ATTRIBUTES = {
+    "BeatThis": "beat_this",
+    "ByteDancePianoTranscription": "bytedance_piano_transcription",
+    "Demucs": "demucs",
+    "LeadSheet": "lead_sheet",
+    "SheetSage": "sheetsage",
+    "get_model": "models",
+    "release_model": "models",
+}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _ATTRIBUTES:
+        return getattr(importlib.import_module(f".{_ATTRIBUTES[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES) + list(_ATTRIBUTES))
@@ -0,0 +1,20 @@
+import argparse
+
+from .runner import add_run_parser
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="mirtoolkit",
+        description="MIR Toolkit",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_run_parser(subparsers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,27 +3,57 @@ CPJKU's beat_this
 - reference: https://github.com/CPJKU/beat_this
 """
 
+import functools
 import sys
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 
 import torch
 
-from .utils import load_audio
+from . import config
+from .cache import get_result_cache
+from .utils import load_mono, prefetch, read_stream
 
-if not sys.version_info < (3, 10):
-    from beat_this.inference import Audio2Beats
+# checkpoint loaded by `beat_this.inference.Audio2Beats` by default
+_CHECKPOINT = "final0"
+
+# chunking parameters used by `beat_this.inference.Spect2Frames`
+_SAMPLE_RATE = 22050
+_CHUNK_SIZE = 1500
+_BORDER_SIZE = 6
+
+# maximum number of DBN processors kept by `_build_dbn`
+DBN_CACHE_SIZE = 8
 
 
 class BeatThis:
-    def __init__(self, cuda=None, dbn=True):
+    def __init__(self, cuda=None, dbn=True, cache=None):
         if cuda is None:
             cuda = torch.cuda.is_available()
 
+        # beat_this requires Python 3.10 or higher, `__call__` and `batch` check the version
+        from beat_this.inference import Audio2Beats
+
+        config.init()
         self.audio2beats = Audio2Beats(
+            checkpoint_path=_CHECKPOINT,
             device="cuda" if cuda else "cpu",
             dbn=dbn,
         )
         self.use_dbn = dbn
+        self.cache = get_result_cache(cache)
+
+    @staticmethod
+    def dbn_cache_info():
+        """
+        Statistics of the DBN processor cache shared by all instances.
+
+        Returns:
+            CacheInfo: Named tuple of (hits, misses, maxsize, currsize).
+        """
+        return _build_dbn_cached.cache_info()
 
     @torch.no_grad()
     def __call__(
@@ -40,7 +70,7 @@ class BeatThis:
         Function for extracting beat and downbeat positions (in seconds) from a file or a data array.
 
         Args:
-            file_or_array (str or Path or ndarray): Path to the audio file or numpy array containing the audio data.
+            file_or_array (str or Path or ndarray or generator): Path to the audio file, numpy array containing the audio data or blocks from `utils.stream_audio`.
             sr (int, optional): Sample rate of the audio file. Required if `file_or_array` is a numpy array. Defaults to None.
             if dbn is True:
                 beats_per_bar (list, optional): List of possible beats per bar. Defaults to [3, 4].
@@ -55,24 +85,192 @@ class BeatThis:
         if sys.version_info < (3, 10):
             raise ImportError("Python 3.10 or higher is required to use this function.")
 
+        if isinstance(file_or_array, Iterator):
+            file_or_array, sr = read_stream(file_or_array)
+
+        cache_key = None
+        if self.cache is not None:
+            params = {"dbn": self.use_dbn}
+            if self.use_dbn:
+                params.update(
+                    beats_per_bar=beats_per_bar,
+                    min_bpm=min_bpm,
+                    max_bpm=max_bpm,
+                    fps=fps,
+                    transition_lambda=transition_lambda,
+                )
+            cache_key = self.cache.make_key(file_or_array, self, _CHECKPOINT, params, sr=sr)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                return entry["arrays"]["beats"], entry["arrays"]["downbeats"]
+
         if isinstance(file_or_array, (str, Path)):
-            audio, sr = load_audio(file_or_array, dtype="float64")
+            audio, sr = load_mono(file_or_array, _SAMPLE_RATE), _SAMPLE_RATE
         else:
             audio = file_or_array
 
         if self.use_dbn:
-            from madmom.features.downbeats import DBNDownBeatTrackingProcessor
-
             # WARN: This is a hacky way to set the DBN parameters
-            dbn = DBNDownBeatTrackingProcessor(
+            self.audio2beats.frames2beats.dbn = _build_dbn(
                 beats_per_bar=beats_per_bar,
                 min_bpm=min_bpm,
                 max_bpm=max_bpm,
                 fps=fps,
                 transition_lambda=transition_lambda,
             )
-            self.audio2beats.frames2beats.dbn = dbn
 
         beats, downbeats = self.audio2beats(audio, sr)
 
+        if cache_key is not None:
+            self.cache.put(cache_key, arrays={"beats": beats, "downbeats": downbeats})
+
         return beats, downbeats
+
+    @torch.no_grad()
+    def batch(
+        self,
+        files,
+        batch_size=16,
+        num_workers=4,
+        beats_per_bar=[3, 4],
+        min_bpm=55.0,
+        max_bpm=215.0,
+        fps=50,
+        transition_lambda=100,
+    ):
+        """
+        Function for extracting beat and downbeat positions (in seconds) from multiple files.
+
+        Audio files are decoded and resampled by background threads, the spectrogram chunks of
+        several files are stacked into one forward pass, and the DBN decoding runs in a process
+        pool while the network handles the next batch.
+
+        Args:
+            files (list of str or Path): Paths to the audio files.
+            batch_size (int, optional): Number of spectrogram chunks per forward pass. Defaults to 16.
+            num_workers (int, optional): Number of loader threads and DBN processes. Defaults to 4.
+            if dbn is True:
+                beats_per_bar (list, optional): List of possible beats per bar. Defaults to [3, 4].
+                min_bpm (float, optional): Minimum tempo in BPM. Defaults to 55.0.
+                max_bpm (float, optional): Maximum tempo in BPM. Defaults to 215.0.
+                fps (int, optional): Frames per second. Defaults to 50.
+
+        Returns:
+            list: (beats, downbeats) of each file, in the order of `files`.
+        """
+        if sys.version_info < (3, 10):
+            raise ImportError("Python 3.10 or higher is required to use this function.")
+
+        from beat_this.inference import split_piece
+
+        dbn_params = {
+            "beats_per_bar": beats_per_bar,
+            "min_bpm": min_bpm,
+            "max_bpm": max_bpm,
+            "fps": fps,
+            "transition_lambda": transition_lambda,
+        }
+        dbn_pool = (
+            ProcessPoolExecutor(num_workers, initializer=_init_dbn_worker, initargs=(dbn_params,))
+            if self.use_dbn
+            else nullcontext()
+        )
+
+        results = []
+        with ThreadPoolExecutor(num_workers) as loader, dbn_pool:
+            pieces = []
+            load = functools.partial(load_mono, sr=_SAMPLE_RATE)
+            for signal in prefetch(loader, load, files, 2 * num_workers):
+                spect = self.audio2beats.signal2spect(signal, _SAMPLE_RATE)
+                chunks, starts = split_piece(
+                    spect, _CHUNK_SIZE, border_size=_BORDER_SIZE, avoid_short_end=True
+                )
+                pieces.append((spect.shape[0], chunks, starts))
+                if sum(len(piece[1]) for piece in pieces) >= batch_size:
+                    results += self._predict_pieces(pieces, batch_size, dbn_pool)
+                    pieces = []
+            results += self._predict_pieces(pieces, batch_size, dbn_pool)
+
+            return [r.result() if self.use_dbn else r for r in results]
+
+    def _predict_pieces(self, pieces, batch_size, dbn_pool):
+        from beat_this.inference import aggregate_prediction
+
+        audio2beats = self.audio2beats
+
+        # group the chunks of all pieces by length, so each group stacks into one batch
+        groups = {}
+        for piece_idx, (_, chunks, _) in enumerate(pieces):
+            for chunk_idx, chunk in enumerate(chunks):
+                groups.setdefault(chunk.shape[0], []).append((piece_idx, chunk_idx, chunk))
+
+        pred_chunks = [[None] * len(chunks) for _, chunks, _ in pieces]
+        with torch.inference_mode(), torch.autocast(
+            enabled=audio2beats.float16, device_type=audio2beats.device.type
+        ):
+            for group in groups.values():
+                for i in range(0, len(group), batch_size):
+                    items = group[i : i + batch_size]
+                    pred = audio2beats.model(torch.stack([chunk for _, _, chunk in items]))
+                    for j, (piece_idx, chunk_idx, _) in enumerate(items):
+                        pred_chunks[piece_idx][chunk_idx] = {
+                            "beat": pred["beat"][j],
+                            "downbeat": pred["downbeat"][j],
+                        }
+
+        results = []
+        for (full_size, _, starts), piece_pred_chunks in zip(pieces, pred_chunks):
+            beat_logits, downbeat_logits = aggregate_prediction(
+                piece_pred_chunks,
+                starts,
+                full_size,
+                _CHUNK_SIZE,
+                _BORDER_SIZE,
+                "keep_first",
+                audio2beats.device,
+            )
+            beat_logits, downbeat_logits = beat_logits.float(), downbeat_logits.float()
+            if self.use_dbn:
+                results.append(
+                    dbn_pool.submit(_dbn_worker, beat_logits.cpu(), downbeat_logits.cpu())
+                )
+            else:
+                results.append(audio2beats.frames2beats(beat_logits, downbeat_logits))
+        return results
+
+
+def _build_dbn(beats_per_bar, min_bpm, max_bpm, fps, transition_lambda):
+    # building the state space and transition model is expensive, so processors are cached
+    return _build_dbn_cached(tuple(beats_per_bar), min_bpm, max_bpm, fps, transition_lambda)
+
+
+@functools.lru_cache(maxsize=DBN_CACHE_SIZE)
+def _build_dbn_cached(beats_per_bar, min_bpm, max_bpm, fps, transition_lambda):
+    from madmom.features.downbeats import DBNDownBeatTrackingProcessor
+
+    return DBNDownBeatTrackingProcessor(
+        beats_per_bar=list(beats_per_bar),
+        min_bpm=min_bpm,
+        max_bpm=max_bpm,
+        fps=fps,
+        transition_lambda=transition_lambda,
+    )
+
+
+_dbn_postprocessor = None
+
+
+def _init_dbn_worker(dbn_params):
+    global _dbn_postprocessor
+
+    from beat_this.model.postprocessor import Postprocessor
+
+    torch.set_num_threads(1)
+    # WARN: the same hack as `BeatThis.__call__` to set the DBN parameters
+    _dbn_postprocessor = Postprocessor(type="minimal", fps=dbn_params["fps"])
+    _dbn_postprocessor.type = "dbn"
+    _dbn_postprocessor.dbn = _build_dbn(**dbn_params)
+
+
+def _dbn_worker(beat_logits, downbeat_logits):
+    return _dbn_postprocessor(beat_logits, downbeat_logits)
@@ -3,23 +3,45 @@ ByteDance Piano Transcription
 - reference: https://github.com/qiuqiangkong/piano_transcription_inference
 """
 
+import functools
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from pathlib import Path
 
 import numpy as np
 import torch
-import torchaudio
-from piano_transcription_inference import PianoTranscription, load_audio, sample_rate
+
+from . import config
+from .cache import get_result_cache
+from .utils import load_mono, prefetch, read_stream, resample
+
+# checkpoint loaded by `PianoTranscription` when `checkpoint_path` is None
+_CHECKPOINT = "note_F1=0.9677_pedal_F1=0.9186"
 
 
 class ByteDancePianoTranscription:
-    def __init__(self, cuda=None):
+    def __init__(self, cuda=None, cache=None):
         if cuda is None:
             cuda = torch.cuda.is_available()
 
+        from piano_transcription_inference import PianoTranscription
+
+        config.init()
         self.model = PianoTranscription(
             device="cuda" if cuda else "cpu",  # device: 'cuda' | 'cpu'
             checkpoint_path=None,
         )
+        self.cuda = cuda
+        self.cache = get_result_cache(cache)
 
     @torch.no_grad()
     def __call__(self, file_or_array, output_midi_file=None, sr=None, stream=False):
@@ -27,16 +49,125 @@ class ByteDancePianoTranscription:
         Function for transcribing piano notes from an audio file or audio array.
 
         Args:
-            file_or_array (str or Path or numpy.ndarray): Path to the audio file or audio array.
+            file_or_array (str or Path or numpy.ndarray or generator): Path to the audio file, audio array or blocks from `utils.stream_audio`.
             output_midi_file (str, optional): Path to save the transcribed MIDI file. Defaults to None.
 
         Returns:
             dict: A dictionary containing the transcribed piano notes.
         """
+        if isinstance(file_or_array, Iterator):
+            file_or_array, sr = read_stream(file_or_array)
+
+        if self.cache is None:
+            return self._transcribe(file_or_array, output_midi_file, sr=sr, stream=stream)
+
+        cache_key = self.cache.make_key(file_or_array, self, _CHECKPOINT, {"stream": stream}, sr=sr)
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            if output_midi_file is not None:
+                shutil.copyfile(entry["files"]["output.mid"], output_midi_file)
+            return {"output_dict": entry["arrays"], **entry["data"]}
+
+        # always write a MIDI file, so later calls can restore it from the cache
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            midi_file = Path(tmp_dir) / "output.mid"
+            transcribed_dict = self._transcribe(file_or_array, str(midi_file), sr=sr, stream=stream)
+            self.cache.put(
+                cache_key,
+                arrays=transcribed_dict["output_dict"],
+                data={
+                    "est_note_events": transcribed_dict["est_note_events"],
+                    "est_pedal_events": transcribed_dict["est_pedal_events"],
+                },
+                files={"output.mid": midi_file},
+            )
+            if output_midi_file is not None:
+                shutil.copyfile(midi_file, output_midi_file)
+
+        return transcribed_dict
+
+    def transcribe_many(self, paths, out_dir, workers=None, torch_threads=None, num_loaders=4):
+        """
+        Function for transcribing piano notes from multiple audio files to `<out_dir>/<stem>.mid`.
+
+        On CPU, `PianoTranscription.transcribe` runs the segments of a file one by one and keeps
+        few cores busy, so the files are spread over `workers` processes running `torch_threads`
+        intra-op threads each. The workers inherit the loaded weights (see `models`), loader
+        threads decode and resample the audio ahead of them, and each MIDI file is written as
+        soon as its transcription finishes. On GPU the files are transcribed in this process,
+        with the same prefetching.
+
+        Args:
+            paths (list of str or Path): Paths to the audio files, with unique file names.
+            out_dir (str or Path): Directory of the MIDI files.
+            workers (int, optional): Number of worker processes. Defaults to None (CPU count / torch_threads).
+            torch_threads (int, optional): Intra-op threads of each worker. Defaults to None (CPU count / workers, or 1).
+            num_loaders (int, optional): Number of audio loader threads. Defaults to 4.
+
+        Returns:
+            list: Paths of the MIDI files, in the order of `paths`.
+        """
+        from piano_transcription_inference import sample_rate
+
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        names = [Path(path).stem for path in paths]
+        assert len(set(names)) == len(names), "File names of the audio files must be unique."
+        midi_files = [out_dir / f"{name}.mid" for name in names]
+
+        load = functools.partial(load_mono, sr=sample_rate)
+        if self.cuda:
+            with ThreadPoolExecutor(num_loaders) as loader, torch.no_grad():
+                audios = prefetch(loader, load, paths, 2 * num_loaders)
+                for audio, midi_file in zip(audios, midi_files):
+                    self.model.transcribe(audio, str(midi_file))
+            return midi_files
+
+        cpu_count = os.cpu_count() or 1
+        if torch_threads is None:
+            torch_threads = max(1, cpu_count // workers) if workers is not None else 1
+        if workers is None:
+            workers = max(1, cpu_count // torch_threads)
+
+        # with "fork" the workers share the weights copy-on-write instead of unpickling a copy
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        # all the workers wait for each other at start-up, see below
+        barrier = mp_context.Barrier(workers)
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(self.model, torch_threads, barrier),
+        ) as pool:
+            # start the workers before the loader threads, forking while other threads run
+            # torch ops can deadlock the children. Depending on the Python version and start
+            # method the pool may start a worker only when none is idle, so no worker gets idle
+            # until all of them have started.
+            for future in [pool.submit(int) for _ in range(workers)]:
+                future.result()
+            with ThreadPoolExecutor(num_loaders) as loader:
+                pending = set()
+                audios = prefetch(loader, load, paths, 2 * num_loaders)
+                for audio, midi_file in zip(audios, midi_files):
+                    # bound the decoded audio waiting for a worker
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(pool.submit(_transcribe_worker, audio, str(midi_file)))
+                for future in pending:
+                    future.result()
+
+        return midi_files
+
+    def _transcribe(self, file_or_array, output_midi_file, sr=None, stream=False):
+        from piano_transcription_inference import sample_rate
+
         if isinstance(file_or_array, (str, Path)):
             audio_path = file_or_array
-            # Load audio
-            (audio_array, _) = load_audio(audio_path, sr=sample_rate, mono=True)
+            # Load audio block by block, so only the mono signal at the model rate is resident
+            audio_array = load_mono(audio_path, sample_rate)
             if stream:
                 # Transcribe and write out to MIDI file
                 transcribed_dict = self.model.transcribe_stream(audio_array, output_midi_file)
@@ -49,8 +180,25 @@ class ByteDancePianoTranscription:
             audio_array = file_or_array
             if isinstance(audio_array, np.ndarray):
                 audio_array = torch.from_numpy(audio_array)
-            audio_array = torchaudio.transforms.Resample(sr, sample_rate)(audio_array)
+            audio_array = resample(audio_array, sr, sample_rate)
             audio_array = audio_array.numpy()
             transcribed_dict = self.model.transcribe(audio_array, output_midi_file)
 
         return transcribed_dict
+
+
+_worker_model = None
+
+
+def _init_worker(model, torch_threads, barrier):
+    global _worker_model
+
+    torch.set_num_threads(torch_threads)
+    _worker_model = model
+    barrier.wait()
+
+
+@torch.no_grad()
+def _transcribe_worker(audio, midi_file):
+    _worker_model.transcribe(audio, midi_file)
+    return midi_file
@@ -0,0 +1,419 @@
+"""
+Content-addressed result cache for the model wrappers
+
+Results are keyed by the audio content hash, the wrapper class, the model identity and the call
+parameters, and saved under `config.CACHE_DIR` with size-based LRU eviction.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from . import config
+
+DEFAULT_CACHE_DIR = config.CACHE_DIR.joinpath("results")
+DEFAULT_MAX_SIZE = 10 * 1024**3  # 10 GiB
+DEFAULT_FEATURE_DIR = config.CACHE_DIR.joinpath("features")
+DEFAULT_FEATURE_MAX_SIZE = 50 * 1024**3  # 50 GiB
+# a full cache is pruned to this fraction of its maximum size, so not every write walks it
+PRUNE_TARGET = 0.9
+
+_ARRAYS_FILE = "arrays.npz"
+_ARRAYS_DIR = "arrays"
+_DATA_FILE = "data.json"
+_OBJECTS_FILE = "objects.pkl"
+_FILES_DIR = "files"
+
+logger = logging.getLogger(__name__)
+
+_default_cache = None
+_default_feature_store = None
+_file_hash_memo = {}
+
+
+class ResultCache:
+    """
+    On-disk cache of model results.
+
+    Each entry is a directory that holds numpy arrays (`.npz`), JSON data, pickled objects and
+    plain files (e.g. MIDI). Reading an entry marks it as recently used, and the least recently
+    used entries are evicted once the cache grows beyond `max_size` bytes.
+
+    Args:
+        cache_dir (str or Path, optional): Directory of the cache. Defaults to `DEFAULT_CACHE_DIR`.
+        max_size (int, optional): Maximum size of the cache in bytes. Defaults to 10 GiB.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self._total_size = None
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, file_or_array, wrapper, model, params, sr=None):
+        """
+        Build the key of a result.
+
+        Args:
+            file_or_array (str or Path or ndarray or Tensor): Input audio file or array.
+            wrapper (object): The model wrapper, only its class name is used.
+            model (str): Identity of the model or checkpoint.
+            params (dict): Call parameters that affect the result. Must be JSON serializable, up
+                to numpy arrays and tensors, which are keyed by their content hash.
+            sr (int, optional): Sample rate of an array input. Defaults to None.
+
+        Returns:
+            str: The hex digest of the key.
+        """
+        key = {
+            "audio": audio_hash(file_or_array, sr=sr),
+            "wrapper": type(wrapper).__name__,
+            "model": model,
+            "params": params,
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=_key_json).encode()
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Read an entry.
+
+        Returns:
+            dict or None: Dictionary with keys "arrays", "data", "objects" and "files", or None if
+            the entry doesn't exist.
+        """
+        entry_dir = self._entry_dir(key)
+        if not entry_dir.exists():
+            return None
+
+        try:
+            entry = {"arrays": None, "data": None, "objects": None, "files": {}}
+            entry["arrays"] = self._load_arrays(entry_dir)
+            if (entry_dir / _DATA_FILE).exists():
+                entry["data"] = json.loads((entry_dir / _DATA_FILE).read_text())
+            if (entry_dir / _OBJECTS_FILE).exists():
+                entry["objects"] = pickle.loads((entry_dir / _OBJECTS_FILE).read_bytes())
+            if (entry_dir / _FILES_DIR).exists():
+                entry["files"] = {file.name: file for file in (entry_dir / _FILES_DIR).iterdir()}
+        except FileNotFoundError:  # evicted by another process while reading
+            return None
+
+        # the mtime of the entry directory is its last access time
+        os.utime(entry_dir)
+        return entry
+
+    def put(self, key, arrays=None, data=None, objects=None, files=None):
+        """
+        Write an entry.
+
+        Args:
+            key (str): Key returned by `make_key`.
+            arrays (dict, optional): Numpy arrays saved in a `.npz` file. Defaults to None.
+            data (object, optional): JSON serializable data. Defaults to None.
+            objects (object, optional): Picklable objects. Defaults to None.
+            files (dict, optional): Files to copy into the entry, {name: path}. Defaults to None.
+        """
+        entry_dir = self._entry_dir(key)
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+
+        # write into a temporary directory and rename it, so readers never see partial entries
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=entry_dir.parent))
+        try:
+            if arrays is not None:
+                self._save_arrays(tmp_dir, arrays)
+            if data is not None:
+                (tmp_dir / _DATA_FILE).write_text(json.dumps(data, default=_to_json))
+            if objects is not None:
+                (tmp_dir / _OBJECTS_FILE).write_bytes(pickle.dumps(objects))
+            if files:
+                (tmp_dir / _FILES_DIR).mkdir()
+                for name, file in files.items():
+                    shutil.copyfile(file, tmp_dir / _FILES_DIR / name)
+            entry_size = _dir_size(tmp_dir)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # otherwise the entry has been written by another process
+            if not entry_dir.exists():
+                logger.warning("Failed to write cache entry %s: %s", key, e)
+            return
+
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = self.size()
+            else:
+                self._total_size += entry_size
+            if self._total_size > self.max_size:
+                self._prune(int(self.max_size * PRUNE_TARGET))
+
+    def entries(self):
+        """
+        List the entries of the cache.
+
+        Returns:
+            list: (key, size in bytes, last access time) of each entry, least recently used first.
+        """
+        entries = []
+        for shard_dir in self.cache_dir.iterdir():
+            if not shard_dir.is_dir():
+                continue
+            for entry_dir in shard_dir.iterdir():
+                if entry_dir.name.startswith("."):  # entries being written
+                    continue
+                try:
+                    entries.append(
+                        (entry_dir.name, _dir_size(entry_dir), entry_dir.stat().st_mtime)
+                    )
+                except FileNotFoundError:
+                    continue
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def prune(self, max_size=None):
+        """
+        Evict the least recently used entries until the cache is not larger than `max_size`.
+
+        Returns:
+            int: Number of evicted entries.
+        """
+        with self._lock:
+            return self._prune(self.max_size if max_size is None else max_size)
+
+    def _prune(self, max_size):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for key, size, _ in entries:
+            if total_size <= max_size:
+                break
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_size -= size
+            num_evicted += 1
+        self._total_size = total_size
+        return num_evicted
+
+    def clear(self):
+        return self.prune(0)
+
+    def _entry_dir(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def _save_arrays(self, entry_dir, arrays):
+        np.savez(entry_dir / _ARRAYS_FILE, **arrays)
+
+    def _load_arrays(self, entry_dir):
+        if not (entry_dir / _ARRAYS_FILE).exists():
+            return None
+        with np.load(entry_dir / _ARRAYS_FILE) as arrays:
+            return dict(arrays)
+
+
+class FeatureStore(ResultCache):
+    """
+    On-disk store of intermediate model features, e.g. the Jukebox representation of SheetSage.
+
+    The same as `ResultCache`, except that each array is saved as its own `.npy` file and read
+    back memory-mapped, so large features are paged in on demand instead of loaded as a whole.
+
+    Args:
+        cache_dir (str or Path, optional): Directory of the store. Defaults to `DEFAULT_FEATURE_DIR`.
+        max_size (int, optional): Maximum size of the store in bytes. Defaults to 50 GiB.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_FEATURE_DIR, max_size=DEFAULT_FEATURE_MAX_SIZE):
+        super().__init__(cache_dir, max_size)
+
+    def _save_arrays(self, entry_dir, arrays):
+        (entry_dir / _ARRAYS_DIR).mkdir()
+        for name, array in arrays.items():
+            np.save(entry_dir / _ARRAYS_DIR / f"{name}.npy", np.asarray(array))
+
+    def _load_arrays(self, entry_dir):
+        if not (entry_dir / _ARRAYS_DIR).exists():
+            return None
+        return {
+            file.stem: np.load(file, mmap_mode="r")
+            for file in sorted((entry_dir / _ARRAYS_DIR).iterdir())
+        }
+
+
+def get_result_cache(cache):
+    """
+    Resolve the `cache` argument of the model wrappers.
+
+    Args:
+        cache (None or bool or str or Path or ResultCache): None or False disables caching, True
+            uses the default cache, a path uses a cache in that directory.
+
+    Returns:
+        ResultCache or None: The cache to use.
+    """
+    global _default_cache
+
+    if cache is None or cache is False:
+        return None
+    if cache is True:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
+    if isinstance(cache, ResultCache):
+        return cache
+    return ResultCache(cache)
+
+
+def get_feature_store(store):
+    """
+    Resolve the `feature_store` argument of the model wrappers, like `get_result_cache`.
+
+    Returns:
+        FeatureStore or None: The store to use.
+    """
+    global _default_feature_store
+
+    if store is None or store is False:
+        return None
+    if store is True:
+        if _default_feature_store is None:
+            _default_feature_store = FeatureStore()
+        return _default_feature_store
+    if isinstance(store, FeatureStore):
+        return store
+    return FeatureStore(store)
+
+
+def audio_hash(file_or_array, sr=None):
+    """
+    Hash the content of an audio file or array.
+
+    File hashes are memoized by path, size and mtime, so a file is only read once per process.
+    """
+    if isinstance(file_or_array, (str, Path)):
+        stat = os.stat(file_or_array)
+        memo_key = (os.path.abspath(file_or_array), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in _file_hash_memo:
+            digest = hashlib.sha256()
+            with open(file_or_array, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            _file_hash_memo[memo_key] = digest.hexdigest()
+        return _file_hash_memo[memo_key]
+
+    if hasattr(file_or_array, "detach"):  # torch.Tensor
+        file_or_array = file_or_array.detach().cpu().numpy()
+    array = np.ascontiguousarray(file_or_array)
+    digest = hashlib.sha256()
+    digest.update(f"{array.dtype.str}{array.shape}{sr}".encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def _to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _key_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray) or hasattr(obj, "detach"):
+        # str() of large arrays is abbreviated with "...", so different arrays would collide
+        return {"array": audio_hash(obj)}
+    return str(obj)
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+def _parse_size(text):
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _format_size(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def cmd_info(args):
+    cache = ResultCache(args.cache_dir)
+    entries = cache.entries()
+    print(f"Cache directory: {cache.cache_dir}")
+    print(f"Entries: {len(entries)}")
+    print(f"Size: {_format_size(sum(size for _, size, _ in entries))}")
+
+
+def cmd_prune(args):
+    cache = ResultCache(args.cache_dir)
+    num_evicted = cache.prune(_parse_size(args.max_size))
+    print(f"Evicted {num_evicted} entries.")
+
+
+def cmd_clear(args):
+    cache = ResultCache(args.cache_dir)
+    num_evicted = cache.clear()
+    print(f"Evicted {num_evicted} entries.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Result Cache Utility",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--cache_dir", type=Path, default=DEFAULT_CACHE_DIR, help="Directory of the cache"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info_parser = subparsers.add_parser(
+        "info", help="Show the cache usage", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    info_parser.set_defaults(func=cmd_info)
+
+    prune_parser = subparsers.add_parser(
+        "prune",
+        help="Evict least recently used entries",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    prune_parser.set_defaults(func=cmd_prune)
+    prune_parser.add_argument(
+        "--max_size", type=str, default="10G", help="Maximum size of the cache, e.g. 500M or 10G"
+    )
+
+    clear_parser = subparsers.add_parser(
+        "clear", help="Remove all entries", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    clear_parser.set_defaults(func=cmd_clear)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import functools
 import sys
 
 import platformdirs
@@ -9,9 +10,19 @@ _appauthor = "mirtoolkit"
 CACHE_DIR = platformdirs.user_cache_path(_appname, _appauthor)
 SYS_PATH_DIR = CACHE_DIR.joinpath("sys_path")
 
-if not CACHE_DIR.exists():
-    CACHE_DIR.mkdir()
-if not SYS_PATH_DIR.exists():
-    SYS_PATH_DIR.mkdir()
-if str(SYS_PATH_DIR) not in sys.path:
-    sys.path.append(str(SYS_PATH_DIR))
+
+@functools.lru_cache(maxsize=None)
+def init():
+    """
+    Create the cache directories and add `SYS_PATH_DIR` to `sys.path`.
+
+    This used to run at import time. It's now called by the modules that need it (the model
+    wrappers), so importing `mirtoolkit` or `mirtoolkit.ytdb` has no side effects. Only the first
+    call does anything.
+    """
+    if not CACHE_DIR.exists():
+        CACHE_DIR.mkdir(parents=True)
+    if not SYS_PATH_DIR.exists():
+        SYS_PATH_DIR.mkdir()
+    if str(SYS_PATH_DIR) not in sys.path:
+        sys.path.append(str(SYS_PATH_DIR))
@@ -3,35 +3,187 @@ Demus: Demixing model from Meta
 - reference: https://github.com/facebookresearch/demucs/tree/main
 """
 
+from collections.abc import Iterator
 from pathlib import Path
 
-import demucs.api
+import numpy as np
 import torch
 
+from . import config
+from .cache import get_result_cache
+from .utils import read_stream, stream_audio
+
 
 class Demucs:
-    def __init__(self, cuda=None):
+    def __init__(self, cuda=None, model="htdemucs", cache=None):
         if cuda is None:
             cuda = torch.cuda.is_available()
 
+        import demucs.api
+
+        config.init()
         self.separator = demucs.api.Separator(
+            model=model,
             device="cuda" if cuda else "cpu",
         )
+        self.model_name = model
+        self.cache = get_result_cache(cache)
 
     @torch.no_grad()
-    def __call__(self, file_or_array):
+    def __call__(self, file_or_array, sr=None):
+        """
+        Function for separating the stems of an audio file or audio array.
+
+        Args:
+            file_or_array (str or Path or ndarray or Tensor or generator): Path to the audio file, audio array of shape (channels, samples) or (samples,), or blocks from `utils.stream_audio`.
+            sr (int, optional): Sample rate of the audio array. Required if `file_or_array` is an array. Defaults to None.
+
+        Returns:
+            dict: "origin" (the resampled input), "separated" (stems by name) and "sr".
+        """
+        if isinstance(file_or_array, Iterator):
+            audio, sr = read_stream(file_or_array)
+            file_or_array = audio.T  # stream blocks are channels last
         if not isinstance(file_or_array, (str, Path)):
-            raise NotImplementedError("Array input is not supported yet.")
+            assert sr is not None, "Sample rate must be provided if audio array is given."
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(file_or_array, self, self.model_name, {}, sr=sr)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                return _from_arrays(entry["arrays"])
+
+        if isinstance(file_or_array, (str, Path)):
+            origin, separated = self.separator.separate_audio_file(file_or_array)
         else:
-            audio_path = file_or_array
-        origin, separated = self.separator.separate_audio_file(audio_path)
-        return {
+            origin, separated = self.separator.separate_tensor(self._convert(file_or_array, sr))
+        out = {
             "origin": origin,
             "separated": separated,
             "sr": self.separator.samplerate,
         }
 
+        if cache_key is not None:
+            self.cache.put(cache_key, arrays=_to_arrays(out))
+
+        return out
+
+    @torch.no_grad()
+    def stream(self, file_or_array, sr=None, chunk_seconds=30.0, overlap_seconds=2.0):
+        """
+        Separate an audio file or audio array chunk by chunk in bounded memory.
+
+        The input is read in windows of `chunk_seconds + overlap_seconds`, and the overlapping
+        parts of consecutive windows are cross-faded (overlap-add), so only one window is resident
+        at a time.
+
+        Args:
+            file_or_array (str or Path or ndarray or Tensor): Path to the audio file or audio array of shape (channels, samples) or (samples,).
+            sr (int, optional): Sample rate of the audio array. Required if `file_or_array` is an array. Defaults to None.
+            chunk_seconds (float, optional): Length of each yielded chunk in seconds. Defaults to 30.0.
+            overlap_seconds (float, optional): Length of the cross-fade between chunks in seconds. Defaults to 2.0.
+
+        Yields:
+            dict: "origin", "separated" and "sr" of consecutive chunks, like `__call__`.
+        """
+        if isinstance(file_or_array, (str, Path)):
+            # decode the windows one by one, the file is never loaded at once
+            windows = (
+                (block.T, sr)
+                for block, sr in stream_audio(
+                    file_or_array,
+                    block_seconds=chunk_seconds + overlap_seconds,
+                    hop=chunk_seconds,
+                )
+            )
+        else:
+            assert sr is not None, "Sample rate must be provided if audio array is given."
+            windows = _iter_windows(file_or_array, sr, chunk_seconds, overlap_seconds)
+
+        model_sr = self.separator.samplerate
+        tail = None  # (origin, separated) of the previous window after its yielded part
+        for i, (wav, sr) in enumerate(windows):
+            chunk_frames = int(chunk_seconds * sr)
+            origin, separated = self.separator.separate_tensor(self._convert(wav, sr))
+
+            if tail is not None:
+                # the previous window ends `len(tail)` samples after the start of this window
+                prev_origin, prev_separated = tail
+                origin = _crossfade(prev_origin, origin)
+                separated = {k: _crossfade(prev_separated[k], v) for k, v in separated.items()}
+
+            # position of the next window in the model sample rate
+            next_start = round((i + 1) * chunk_frames * model_sr / sr) - round(
+                i * chunk_frames * model_sr / sr
+            )
+            if origin.shape[-1] > next_start:
+                tail = (
+                    origin[..., next_start:],
+                    {k: v[..., next_start:] for k, v in separated.items()},
+                )
+                origin = origin[..., :next_start]
+                separated = {k: v[..., :next_start] for k, v in separated.items()}
+            else:
+                tail = None
+
+            yield {"origin": origin, "separated": separated, "sr": model_sr}
+
+        if tail is not None:
+            # the last window ran past its chunk and no window follows to cross-fade with
+            origin, separated = tail
+            yield {"origin": origin, "separated": separated, "sr": model_sr}
+
+    def _convert(self, audio, sr):
+        if isinstance(audio, np.ndarray):
+            audio = torch.from_numpy(audio)
+        audio = audio.float()
+        if audio.ndim == 1:
+            audio = audio.unsqueeze(0)
+        from demucs.audio import convert_audio
+
+        return convert_audio(audio, sr, self.separator.samplerate, self.separator.audio_channels)
+
     def save_audio(self, audio, file, samplerate=None):
         if samplerate is None:
             samplerate = self.separator.samplerate
+        import demucs.api
+
         demucs.api.save_audio(audio, file, samplerate=samplerate)
+
+
+def _crossfade(prev, cur):
+    n = min(prev.shape[-1], cur.shape[-1])
+    fade_in = torch.linspace(0.0, 1.0, n + 2, device=cur.device)[1:-1]
+    head = cur[..., :n] * fade_in + prev[..., :n] * (1 - fade_in)
+    return torch.cat([head, cur[..., n:]], dim=-1)
+
+
+def _iter_windows(audio, sr, chunk_seconds, overlap_seconds):
+    """Yield windows of `chunk_seconds + overlap_seconds` starting every `chunk_seconds`."""
+    chunk_frames = int(chunk_seconds * sr)
+    length = chunk_frames + int(overlap_seconds * sr)
+    num_frames = audio.shape[-1]
+    for start in range(0, max(num_frames, 1), chunk_frames):
+        yield audio[..., start : start + length], sr
+        if start + length >= num_frames:
+            break
+
+
+def _to_arrays(out):
+    arrays = {"origin": out["origin"].cpu().numpy(), "sr": out["sr"]}
+    for name, stem in out["separated"].items():
+        arrays[f"stem_{name}"] = stem.cpu().numpy()
+    return arrays
+
+
+def _from_arrays(arrays):
+    return {
+        "origin": torch.from_numpy(arrays["origin"]),
+        "separated": {
+            key[len("stem_") :]: torch.from_numpy(value)
+            for key, value in arrays.items()
+            if key.startswith("stem_")
+        },
+        "sr": int(arrays["sr"]),
+    }
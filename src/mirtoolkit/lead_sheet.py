@@ -0,0 +1,138 @@
+"""
+Lead sheet pipeline: BeatThis beats fed into SheetSage
+
+SheetSage detects beats with its own tracker unless `beat_information` is given. This pipeline
+runs `BeatThis` once per track, keeps the beats, and passes them to `SheetSage`, so re-running
+the melody/harmony transcription with different thresholds skips beat detection.
+"""
+
+from collections import Counter, OrderedDict
+
+from .cache import audio_hash
+
+# maximum number of tracks whose beats are kept in memory
+BEAT_CACHE_SIZE = 1024
+
+
+class LeadSheet:
+    """
+    Args:
+        cuda (bool, optional): Whether to run BeatThis on the GPU. Defaults to None (if available).
+        cache (None or bool or str or Path or ResultCache, optional): Result cache of both models,
+            see `cache.get_result_cache`. With a cache the beats also persist across processes.
+            Defaults to None.
+    """
+
+    def __init__(self, cuda=None, cache=None):
+        self.cuda = cuda
+        self.cache = cache
+        self._beat_tracker = None
+        self._sheetsage = None
+        self._beats = OrderedDict()
+
+    @property
+    def beat_tracker(self):
+        if self._beat_tracker is None:
+            from .beat_this import BeatThis
+
+            self._beat_tracker = BeatThis(cuda=self.cuda, cache=self.cache)
+        return self._beat_tracker
+
+    @property
+    def sheetsage(self):
+        if self._sheetsage is None:
+            from .sheetsage import SheetSage
+
+            self._sheetsage = SheetSage(cache=self.cache)
+        return self._sheetsage
+
+    def beats(self, file_or_array, sr=None, **beat_kwargs):
+        """
+        Track the beats of an audio file or array, in SheetSage's `beat_information` format.
+
+        Args:
+            file_or_array (str or Path or ndarray): Path to the audio file, or audio of shape
+                (samples,) or (samples, channels).
+            sr (int, optional): Sample rate of the audio array. Defaults to None.
+            **beat_kwargs: Arguments of `BeatThis.__call__`, e.g. `min_bpm`.
+
+        Returns:
+            tuple: (first_downbeat_idx, beats_per_measure, beats), see `to_beat_information`.
+        """
+        key = (audio_hash(file_or_array, sr=sr), tuple(sorted(_freeze(beat_kwargs).items())))
+        if key in self._beats:
+            self._beats.move_to_end(key)
+            return self._beats[key]
+
+        beats, downbeats = self.beat_tracker(file_or_array, sr=sr, **beat_kwargs)
+        beat_information = to_beat_information(beats, downbeats)
+        self._beats[key] = beat_information
+        if len(self._beats) > BEAT_CACHE_SIZE:
+            self._beats.popitem(last=False)
+        return beat_information
+
+    def __call__(self, audio_path=None, audio_array=None, sr=None, beat_kwargs=None, **kwargs):
+        """
+        Transcribe the lead sheet of an audio file or array with BeatThis beats.
+
+        Args:
+            audio_path (str or Path, optional): Path to the audio file.
+            audio_array (ndarray, optional): Audio of shape (samples,) or (samples, channels).
+            sr (int, optional): Sample rate of `audio_array`.
+            beat_kwargs (dict, optional): Arguments of `BeatThis.__call__`. Defaults to None.
+            **kwargs: Arguments of `SheetSage.__call__`, e.g. `melody_threshold`.
+
+        Returns:
+            dict or tuple: The output of `SheetSage.__call__`.
+        """
+        assert (audio_path is None) != (
+            audio_array is None
+        ), "One of audio_path or audio_array should be provided but not both."
+        assert "beat_information" not in kwargs, "Beats are tracked by BeatThis."
+
+        if audio_path is not None:
+            beat_information = self.beats(audio_path, **(beat_kwargs or {}))
+            return self.sheetsage(
+                audio_path=audio_path, beat_information=beat_information, **kwargs
+            )
+
+        beat_information = self.beats(audio_array, sr=sr, **(beat_kwargs or {}))
+        return self.sheetsage(
+            audio_array=audio_array, sr=sr, beat_information=beat_information, **kwargs
+        )
+
+
+def to_beat_information(beats, downbeats):
+    """
+    Convert the output of `BeatThis` to SheetSage's `beat_information`.
+
+    `sheetsage.infer.sheetsage` unpacks it in place of the output of its own tracker,
+    `_beat_tracking_with_hints`: the index of the first downbeat in `beats`, the number of beats
+    per measure (the most common spacing of the downbeats, 4 with fewer than two downbeats) and
+    the beat times in seconds.
+
+    Returns:
+        tuple: (first_downbeat_idx, beats_per_measure, beats).
+    """
+    import numpy as np
+
+    beats = [float(t) for t in beats]
+    if len(beats) == 0:
+        return 0, 4, beats
+
+    # downbeats are a subset of the beats, up to rounding
+    downbeat_idxs = []
+    for t in downbeats:
+        idx = int(np.argmin(np.abs(np.asarray(beats) - t)))
+        if not downbeat_idxs or idx > downbeat_idxs[-1]:
+            downbeat_idxs.append(idx)
+    if not downbeat_idxs:
+        return 0, 4, beats
+
+    spacings = Counter(np.diff(downbeat_idxs).tolist())
+    beats_per_measure = spacings.most_common(1)[0][0] if spacings else 4
+    return downbeat_idxs[0], int(beats_per_measure), beats
+
+
+def _freeze(kwargs):
+    return {k: tuple(v) if isinstance(v, list) else v for k, v in kwargs.items()}
@@ -0,0 +1,258 @@
+"""
+Model registry
+
+Loads each model wrapper once per process and hands out the same instance to every caller, with
+reference counting and eviction of models that have been idle for a while.
+
+Weights are shared across worker processes by loading the models before the workers start: with
+the "fork" start method the workers inherit the loaded CPU weights copy-on-write, and the weights
+are never written during inference. `ModelRegistry.share_memory` moves the weights to shared memory,
+so they are also shared with workers started by `torch.multiprocessing`.
+"""
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_IDLE_TIMEOUT = 300.0  # seconds
+
+_default_registry = None
+
+
+def _load_beat_this(device, **kwargs):
+    from .beat_this import BeatThis
+
+    return BeatThis(cuda=_device_to_cuda(device), **kwargs)
+
+
+def _load_demucs(device, **kwargs):
+    from .demucs import Demucs
+
+    return Demucs(cuda=_device_to_cuda(device), **kwargs)
+
+
+def _load_bytedance_piano_transcription(device, **kwargs):
+    from .bytedance_piano_transcription import ByteDancePianoTranscription
+
+    return ByteDancePianoTranscription(cuda=_device_to_cuda(device), **kwargs)
+
+
+LOADERS = {
+    "beat_this": _load_beat_this,
+    "demucs": _load_demucs,
+    "bytedance_piano_transcription": _load_bytedance_piano_transcription,
+}
+
+
+class _Entry:
+    def __init__(self, model):
+        self.model = model
+        self.refcount = 0
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    """
+    Process-wide pool of loaded models.
+
+    Models are keyed by name, device and constructor arguments. `get` loads a model on first use
+    and increases its reference count, `release` decreases it. Models that are not referenced and
+    have been idle for longer than `idle_timeout` seconds are evicted on the next `get` or
+    `release`, or by `evict_idle`.
+
+    Args:
+        idle_timeout (float, optional): Seconds before an unreferenced model is evicted. None
+            keeps the models until `clear`. Defaults to 300.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.loaders = dict(LOADERS)
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader):
+        """
+        Register a loader, called as `loader(device, **kwargs)`, for the model `name`.
+        """
+        self.loaders[name] = loader
+
+    def get(self, name, device=None, **kwargs):
+        """
+        Get a model, loading it if it isn't loaded yet.
+
+        Args:
+            name (str): Name of the model, one of `ModelRegistry.loaders`.
+            device (str, optional): "cpu" or "cuda". Defaults to None (cuda if available).
+            **kwargs: Hashable constructor arguments of the model wrapper, e.g. `model="htdemucs"`.
+
+        Returns:
+            object: The model wrapper, shared by all callers with the same arguments.
+        """
+        if name not in self.loaders:
+            raise KeyError(f"Unknown model: {name}. Available: {', '.join(sorted(self.loaders))}")
+
+        key = _make_key(name, device, kwargs)
+        with self._lock:
+            self._evict_idle(self.idle_timeout)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(self.loaders[name](key[1], **kwargs))
+                self._entries[key] = entry
+            entry.refcount += 1
+            entry.last_used = time.monotonic()
+            return entry.model
+
+    def release(self, model):
+        """
+        Release a model returned by `get`. The model stays loaded until it's been idle for
+        `idle_timeout` seconds.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.model is model:
+                    assert entry.refcount > 0, "Model released more times than acquired."
+                    entry.refcount -= 1
+                    entry.last_used = time.monotonic()
+                    break
+            else:
+                raise ValueError("Model is not in the registry.")
+            self._evict_idle(self.idle_timeout)
+
+    @contextmanager
+    def use(self, name, device=None, **kwargs):
+        """
+        Context manager version of `get` and `release`.
+        """
+        model = self.get(name, device, **kwargs)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def preload(self, name, device=None, **kwargs):
+        """
+        Load a model without holding a reference, e.g. before forking worker processes.
+        """
+        self.release(self.get(name, device, **kwargs))
+
+    def share_memory(self):
+        """
+        Move the weights of the loaded CPU models to shared memory.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                for module in _torch_modules(entry.model):
+                    module.share_memory()
+
+    def evict_idle(self, idle_timeout=None):
+        """
+        Evict the unreferenced models idle for longer than `idle_timeout` seconds.
+
+        Returns:
+            int: Number of evicted models.
+        """
+        with self._lock:
+            return self._evict_idle(self.idle_timeout if idle_timeout is None else idle_timeout)
+
+    def clear(self):
+        """
+        Evict all unreferenced models.
+
+        Returns:
+            int: Number of evicted models.
+        """
+        return self.evict_idle(0)
+
+    def info(self):
+        """
+        List the loaded models.
+
+        Returns:
+            list: (name, device, kwargs, refcount, idle seconds) of each model.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (name, device, dict(kwargs), entry.refcount, now - entry.last_used)
+                for (name, device, kwargs), entry in self._entries.items()
+            ]
+
+    def _evict_idle(self, idle_timeout):
+        if idle_timeout is None:
+            return 0
+        now = time.monotonic()
+        evicted = [
+            key
+            for key, entry in self._entries.items()
+            if entry.refcount == 0 and now - entry.last_used >= idle_timeout
+        ]
+        for key in evicted:
+            del self._entries[key]
+        if evicted:
+            _empty_cuda_cache()
+        return len(evicted)
+
+
+def get_registry():
+    """
+    Get the registry shared by `get_model` and `release_model`.
+    """
+    global _default_registry
+
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    return _default_registry
+
+
+def get_model(name, device=None, **kwargs):
+    """
+    Get a shared model from the default registry, see `ModelRegistry.get`.
+    """
+    return get_registry().get(name, device, **kwargs)
+
+
+def release_model(model):
+    """
+    Release a model returned by `get_model`, see `ModelRegistry.release`.
+    """
+    get_registry().release(model)
+
+
+def _make_key(name, device, kwargs):
+    if device is None:
+        device = "cuda" if _device_to_cuda(None) else "cpu"
+    return (name, device, tuple(sorted(kwargs.items())))
+
+
+def _device_to_cuda(device):
+    if device is None:
+        import torch
+
+        return torch.cuda.is_available()
+    assert device in ["cpu", "cuda"], f"Device must be 'cpu' or 'cuda': {device}"
+    return device == "cuda"
+
+
+def _torch_modules(obj, depth=3):
+    """Find the `torch.nn.Module`s held by a model wrapper, e.g. `BeatThis.audio2beats.model`."""
+    import torch
+
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    if depth == 0 or not hasattr(obj, "__dict__"):
+        return []
+    modules = []
+    for value in vars(obj).values():
+        for module in _torch_modules(value, depth - 1):
+            if all(module is not m for m in modules):
+                modules.append(module)
+    return modules
+
+
+def _empty_cuda_cache():
+    # don't import torch just to find out there's nothing to free
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_initialized():
+        torch.cuda.empty_cache()
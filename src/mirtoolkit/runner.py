@@ -0,0 +1,232 @@
+"""
+Dataset runner: apply a model wrapper to every item of a ytdb store
+
+    python -m mirtoolkit run --task beats --store <ytdb root> --workers 4
+
+The downloaded audio of each item is decoded by a pool of loader threads, up to `2 * workers`
+items ahead of inference, or read from the mono copy at the task's sample rate saved by
+`ytdb ingest`. The results are saved next to the audio and recorded in the item's `manifest.json`
+(and the store index, if any), the `<task>_info` entry last, so an interrupted run resumes with
+the items that don't have it.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+from . import ytdb
+
+
+class _Task:
+    name = None
+    model = None
+    sr = None
+    mono = False
+
+    def __call__(self, model, audio, sr, item_dir):
+        """Process one item and write the outputs. Returns ({name: file}, info)."""
+        raise NotImplementedError
+
+
+class _BeatsTask(_Task):
+    name = "beats"
+    model = "beat_this"
+    sr = 22050
+    mono = True
+
+    def __call__(self, model, audio, sr, item_dir):
+        beats, downbeats = model(audio, sr)
+        return {}, {"beats": beats.tolist(), "downbeats": downbeats.tolist()}
+
+
+class _StemsTask(_Task):
+    name = "stems"
+    model = "demucs"
+    sr = 44100
+
+    def __call__(self, model, audio, sr, item_dir):
+        import soundfile as sf
+
+        out = model(audio.T, sr)
+        files = {}
+        for stem, wav in out["separated"].items():
+            file = item_dir / f"{self.name}_{stem}.flac"
+            sf.write(_tmp_path(file), wav.T.cpu().numpy(), out["sr"], format="FLAC")
+            files[f"{self.name}_{stem}"] = file
+        return files, {"sr": out["sr"], "stems": list(out["separated"])}
+
+
+class _PianoTask(_Task):
+    name = "piano"
+    model = "bytedance_piano_transcription"
+    sr = 16000
+    mono = True
+
+    def __call__(self, model, audio, sr, item_dir):
+        file = item_dir / f"{self.name}.mid"
+        out = model(audio, output_midi_file=str(_tmp_path(file)), sr=sr)
+        info = {
+            "est_note_events": out["est_note_events"],
+            "est_pedal_events": out["est_pedal_events"],
+        }
+        return {self.name: file}, info
+
+
+TASKS = {task.name: task for task in [_BeatsTask(), _StemsTask(), _PianoTask()]}
+
+
+def run(store, task, workers=4, device=None, audio_type="audio", limit=None):
+    """
+    Apply a task to every item of a ytdb store that has `audio_type` downloaded and hasn't been
+    processed yet.
+
+    Args:
+        store (Path): Root of the ytdb store.
+        task (str): One of "beats", "stems" and "piano".
+        workers (int, optional): Number of audio loader threads. Defaults to 4.
+        device (str, optional): "cpu" or "cuda". Defaults to None (cuda if available).
+        audio_type (str, optional): Manifest entry of the input audio. Defaults to "audio".
+        limit (int, optional): Maximum number of items to process. Defaults to None.
+
+    Returns:
+        tuple: Number of processed and failed items.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    from .models import get_model, release_model
+    from .utils import prefetch, read_stream, stream_audio
+
+    task = TASKS[task]
+    store = Path(store)
+
+    def load(item):
+        item_dir, manifest = item
+        try:
+            # audio saved at the task's sample rate by `ytdb ingest` needs no decoding
+            ingested = f"{audio_type}_{task.sr}"
+            if task.mono and ingested in manifest.get("ingest", {}):
+                audio, sr = ytdb.load_ingested_audio(item_dir, ingested, manifest)
+                return item_dir, np.asarray(audio, dtype=np.float32), sr, None
+            path = item_dir / manifest["files"][audio_type]
+            audio, sr = read_stream(stream_audio(path, sr=task.sr, mono=task.mono))
+            return item_dir, audio, sr, None
+        except Exception as e:
+            return item_dir, None, None, e
+
+    items = _iter_pending(store, task.name, audio_type)
+    if limit is not None:
+        items = (item for _, item in zip(range(limit), items))
+
+    num_done = num_failed = 0
+    index = ytdb.StoreIndex.open(store)
+    model = get_model(task.model, device)
+    try:
+        with ThreadPoolExecutor(workers) as loader:
+            for item_dir, audio, sr, error in prefetch(loader, load, items, 2 * workers):
+                if error is None:
+                    try:
+                        _process(task, model, audio, sr, item_dir, index)
+                        num_done += 1
+                        continue
+                    except Exception as e:
+                        error = e
+                _clean_task_files(item_dir, task.name)
+                num_failed += 1
+                print(f"[{item_dir.name}] {type(error).__name__}: {error}", file=sys.stderr)
+    finally:
+        release_model(model)
+        if index is not None:
+            index.close()
+
+    return num_done, num_failed
+
+
+def _process(task, model, audio, sr, item_dir, index):
+    files, info = task(model, audio, sr, item_dir)
+    info_file = item_dir / f"{task.name}_info.json"
+    _tmp_path(info_file).write_text(json.dumps(info, default=_to_json))
+    files[f"{task.name}_info"] = info_file
+
+    # move the outputs in place, then record them, the info entry last
+    for file in files.values():
+        os.replace(_tmp_path(file), file)
+    manifest_file = item_dir / "manifest.json"
+    manifest = json.loads(manifest_file.read_text())
+    for name, file in files.items():
+        manifest["files"][name] = file.name
+    ytdb._safely_write_manifest(manifest_file, manifest)
+    if index is not None:
+        index.update_item(item_dir.name, manifest, item_dir)
+
+
+def _iter_pending(store, task_name, audio_type):
+    for item_dir in ytdb._iter_item_dirs(store):
+        try:
+            manifest = json.loads((item_dir / "manifest.json").read_text())
+        except (OSError, ValueError):
+            continue
+        files = manifest.get("files", {})
+        if audio_type in files and f"{task_name}_info" not in files:
+            # outputs of an interrupted run that were moved in place but not recorded
+            _clean_task_files(item_dir, task_name, manifest)
+            yield item_dir, manifest
+
+
+def _clean_task_files(item_dir, task_name, manifest=None):
+    if manifest is None:
+        manifest = json.loads((item_dir / "manifest.json").read_text())
+    recorded_files = set(manifest["files"].values())
+    for file in item_dir.iterdir():
+        is_task_file = file.name.startswith((task_name, f".{task_name}"))
+        if is_task_file and file.name not in recorded_files:
+            file.unlink()
+
+
+def _tmp_path(file):
+    return file.parent / f".{file.name}.tmp{file.suffix}"
+
+
+def _to_json(obj):
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def cmd_run(args):
+    num_done, num_failed = run(
+        args.store,
+        args.task,
+        workers=args.workers,
+        device=args.device,
+        audio_type=args.audio_type,
+        limit=args.limit,
+    )
+    print(f"Processed {num_done} items, {num_failed} failed.")
+
+
+def add_run_parser(subparsers):
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Apply a model to every item of a ytdb store",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    run_parser.set_defaults(func=cmd_run)
+    run_parser.add_argument("--task", choices=list(TASKS), required=True, help="Task to run")
+    run_parser.add_argument("--store", type=Path, required=True, help="Root of the ytdb store")
+    run_parser.add_argument(
+        "-j", "--workers", type=int, default=4, help="Number of audio loader threads"
+    )
+    run_parser.add_argument(
+        "--device",
+        choices=["cpu", "cuda"],
+        help="Device of the model. Defaults to cuda if available",
+    )
+    run_parser.add_argument(
+        "--audio_type", type=str, default="audio", help="Manifest entry of the input audio"
+    )
+    run_parser.add_argument("--limit", type=int, help="Maximum number of items to process")
+    return run_parser
@@ -3,6 +3,9 @@ SheetSage: lead sheet transcription model
 - reference: https://github.com/chrisdonahue/sheetsage
 """
 
+import contextlib
+import inspect
+import io
 import logging
 import shutil
 import subprocess
@@ -10,13 +13,53 @@ import tempfile
 from pathlib import Path
 from typing import Union
 
-from sheetsage.infer import sheetsage as sheetsage_infer
-from tqdm import tqdm as tqdm_fn
+import numpy as np
+
+from . import config
+from .cache import get_feature_store, get_result_cache
+from .utils import read_stream, stream_audio
+
+# fields of the sheetsage output that don't depend on the melody/harmony thresholds
+_FEATURE_FIELDS = [
+    "segment_beats",
+    "segment_beats_times",
+    "chunks_tertiaries",
+    "melody_logits",
+    "harmony_logits",
+    "melody_last_hidden_state",
+    "harmony_last_hidden_state",
+]
+
+# arguments of sheetsage that change the features, i.e. all but the thresholds and callbacks
+_FEATURE_PARAMS = [
+    "segment_start_hint",
+    "segment_end_hint",
+    "use_jukebox",
+    "measures_per_chunk",
+    "dynamic_chunking",
+    "segment_hints_are_downbeats",
+    "beat_information",
+    "beats_per_measure_hint",
+    "beats_per_minute_hint",
+    "detect_melody",
+    "detect_harmony",
+    "beat_detection_padding",
+    "avoid_chunking_if_possible",
+    "legacy_behavior",
+]
+
+# feature fields that sheetsage only returns with `return_intermediaries`
+_INTERMEDIARY_FIELDS = _FEATURE_FIELDS[3:]
+
+# sheetsage transcribes on a grid of sixteenth notes, "tertiaries", 4 per beat
+_TERTIARIES_PER_BEAT = 4
 
 
 class SheetSage:
-    def __init__(self):
-        pass
+    def __init__(self, cache=None, feature_store=None):
+        config.init()
+        self.cache = get_result_cache(cache)
+        self.feature_store = get_feature_store(feature_store)
 
     def __call__(
         self,
@@ -40,87 +83,369 @@ class SheetSage:
         legacy_behavior=False,
         status_change_callback=lambda s: logging.info(s.name),
         return_intermediaries=False,
-        tqdm=tqdm_fn,
+        tqdm=None,
         return_dict=True,
+        audio_array=None,
+        sr=None,
+        in_memory=True,
     ):
-        # assert audio_path or audio_url should be provided but not both
+        """
+        Transcribe the lead sheet of an audio file, URL or array.
+
+        By default the audio is decoded once into memory (a single ffmpeg process for files
+        soundfile can't read, yt-dlp piped into ffmpeg for URLs) and passed to sheetsage as an
+        in-memory WAV. With `in_memory=False` the input is transcoded to a temporary FLAC file
+        first, as in earlier versions. Temporary files are removed before returning.
+
+        With a feature store and `use_jukebox`, the threshold-independent features are stored the
+        first time and the lead sheet is decoded from the stored logits with `decode_lead_sheet`,
+        so calls with other thresholds don't run Jukebox again. The lead sheet is then a dict of
+        melody and harmony events instead of sheetsage's own, in every call, whether the features
+        were stored or not.
+
+        Args:
+            audio_path (str or Path, optional): Path to the audio file.
+            audio_url (str, optional): URL of the audio, downloaded with yt-dlp.
+            audio_array (ndarray or Tensor, optional): Audio of shape (samples,) or (samples, channels).
+            sr (int, optional): Sample rate of `audio_array`.
+            in_memory (bool, optional): Decode into memory instead of a temporary file. Defaults to True.
+            The other arguments are passed to `sheetsage.infer.sheetsage`.
+
+        Returns:
+            dict or tuple: The output of sheetsage, or its main fields if `return_dict` is False.
+                The intermediaries are None unless `return_intermediaries` is set.
+        """
+        # exactly one of audio_path, audio_url and audio_array should be provided
+        num_inputs = bool(audio_path) + bool(audio_url) + (audio_array is not None)
         assert (
-            (audio_path and not audio_url) or (audio_url and not audio_path)
-        ), f"One of audio_path or audio_url should be provided but not both: {audio_path}, {audio_url}"
-
-        assert shutil.which("ffmpeg") is not None, "ffmpeg not found. Please install ffmpeg."
-
-        if audio_path:  # if audio_path is provided
-            ext = "flac"
-            tmp_audio_file = tempfile.NamedTemporaryFile(suffix=f".{ext}")
-            subprocess.run(
-                [
-                    "ffmpeg",
-                    "-i",
-                    str(audio_path),
-                    "-vn",
-                    "-f",
-                    ext,
-                    "-y",
-                    tmp_audio_file.name,
-                ]
+            num_inputs == 1
+        ), f"One of audio_path, audio_url or audio_array should be provided: {audio_path}, {audio_url}"
+        if audio_array is not None:
+            assert sr is not None, "Sample rate must be provided if audio array is given."
+
+        infer_kwargs = {
+            "segment_start_hint": segment_start_hint,
+            "segment_end_hint": segment_end_hint,
+            "use_jukebox": use_jukebox,
+            "measures_per_chunk": measures_per_chunk,
+            "dynamic_chunking": dynamic_chunking,
+            "segment_hints_are_downbeats": segment_hints_are_downbeats,
+            "beat_information": beat_information,
+            "beats_per_measure_hint": beats_per_measure_hint,
+            "beats_per_minute_hint": beats_per_minute_hint,
+            "detect_melody": detect_melody,
+            "detect_harmony": detect_harmony,
+            "melody_threshold": melody_threshold,
+            "harmony_threshold": harmony_threshold,
+            "beat_detection_padding": beat_detection_padding,
+            "avoid_chunking_if_possible": avoid_chunking_if_possible,
+            "legacy_behavior": legacy_behavior,
+            "return_intermediaries": return_intermediaries,
+        }
+
+        # only local files and arrays are cached, the content behind a URL may change
+        audio = audio_path if audio_array is None else audio_array
+        cache_key = None
+        if self.cache is not None and not audio_url:
+            cache_key = self.cache.make_key(audio, self, "sheetsage", infer_kwargs, sr=sr)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                return _format_output(entry["objects"], return_dict)
+
+        if self.feature_store is not None and use_jukebox and not audio_url:
+            features = self._features(
+                audio_path, audio_array, sr, in_memory, infer_kwargs, status_change_callback, tqdm
             )
-            audio_path = Path(tmp_audio_file.name)
-
-            assert audio_path.exists(), f"File not found: {audio_path}"
-        else:  # if audio_url is provided
-            ext = "flac"
-            tmp_dir = tempfile.TemporaryDirectory()
-            tmp_audio_file = tmp_dir.name + f"/audio.{ext}"
-            subprocess.run(
-                [
-                    "yt-dlp",
-                    "-x",
-                    "--audio-format",
-                    ext,
-                    "--audio-quality",
-                    "0",
-                    "-o",
-                    tmp_dir.name + "/audio.%(ext)s",
-                    audio_url,
-                ],
-                check=True,
+            sheetsage_output = {field: features.get(field) for field in _FEATURE_FIELDS}
+            if not return_intermediaries:
+                sheetsage_output.update(dict.fromkeys(_INTERMEDIARY_FIELDS))
+            sheetsage_output["lead_sheet"] = decode_lead_sheet(
+                features, melody_threshold, harmony_threshold
             )
-            audio_path = Path(tmp_audio_file)
-
-        sheetsage_output = sheetsage_infer(
-            audio_path_bytes_or_url=audio_path,
-            segment_start_hint=segment_start_hint,
-            segment_end_hint=segment_end_hint,
-            use_jukebox=use_jukebox,
-            measures_per_chunk=measures_per_chunk,
-            dynamic_chunking=dynamic_chunking,
-            segment_hints_are_downbeats=segment_hints_are_downbeats,
-            beat_information=beat_information,
-            beats_per_measure_hint=beats_per_measure_hint,
-            beats_per_minute_hint=beats_per_minute_hint,
-            detect_melody=detect_melody,
-            detect_harmony=detect_harmony,
-            melody_threshold=melody_threshold,
-            harmony_threshold=harmony_threshold,
-            beat_detection_padding=beat_detection_padding,
-            avoid_chunking_if_possible=avoid_chunking_if_possible,
-            legacy_behavior=legacy_behavior,
-            status_change_callback=status_change_callback,
-            return_intermediaries=return_intermediaries,
-            tqdm=tqdm,
+        else:
+            sheetsage_output = self._infer(
+                audio_path,
+                audio_url,
+                audio_array,
+                sr,
+                in_memory,
+                infer_kwargs,
+                status_change_callback,
+                tqdm,
+            )
+
+        if cache_key is not None:
+            # the lead sheet is not an array, so the whole output is pickled
+            self.cache.put(cache_key, objects=sheetsage_output)
+
+        return _format_output(sheetsage_output, return_dict)
+
+    def features(self, audio_path=None, audio_array=None, sr=None, **kwargs):
+        """
+        Get the Jukebox features of an audio file or array from the feature store.
+
+        The features are the outputs of sheetsage that don't depend on the melody/harmony
+        thresholds: the segment beats, the chunk tertiaries, and the per-chunk logits and last
+        hidden states of the melody and harmony heads. They're computed by sheetsage the first
+        time, regardless of the result cache, and read back memory-mapped afterwards, so
+        threshold sweeps on the logits don't run Jukebox again.
+
+        Args:
+            audio_path (str or Path, optional): Path to the audio file.
+            audio_array (ndarray, optional): Audio of shape (samples,) or (samples, channels).
+            sr (int, optional): Sample rate of `audio_array`.
+            **kwargs: Arguments of `__call__` that change the features, e.g. `measures_per_chunk`.
+
+        Returns:
+            dict: The features, per-chunk fields are lists with one array per chunk.
+        """
+        assert self.feature_store is not None, "SheetSage was created without a feature store."
+        assert (audio_path is None) != (
+            audio_array is None
+        ), "One of audio_path or audio_array should be provided but not both."
+        assert kwargs.get("use_jukebox", True), "Only the Jukebox features are stored."
+
+        defaults = inspect.signature(self.__call__).parameters
+        infer_kwargs = {
+            name: kwargs.get(name, defaults[name].default)
+            for name in _FEATURE_PARAMS + ["melody_threshold", "harmony_threshold"]
+        }
+        return self._features(
+            audio_path,
+            audio_array,
+            sr,
+            kwargs.get("in_memory", True),
+            infer_kwargs,
+            kwargs.get("status_change_callback", defaults["status_change_callback"].default),
+            kwargs.get("tqdm"),
         )
 
-        if return_dict:
-            return sheetsage_output
-        else:
-            return (
-                sheetsage_output["lead_sheet"],
-                sheetsage_output["segment_beats"],
-                sheetsage_output["segment_beats_times"],
-                sheetsage_output["chunks_tertiaries"],
-                sheetsage_output["melody_logits"],
-                sheetsage_output["harmony_logits"],
-                sheetsage_output["melody_last_hidden_state"],
-                sheetsage_output["harmony_last_hidden_state"],
+    def _features(
+        self, audio_path, audio_array, sr, in_memory, infer_kwargs, status_change_callback, tqdm
+    ):
+        """Read the features from the store, running sheetsage on a miss."""
+        feature_params = {name: infer_kwargs[name] for name in _FEATURE_PARAMS}
+        audio = audio_path if audio_array is None else audio_array
+        feature_key = self.feature_store.make_key(audio, self, "sheetsage", feature_params, sr=sr)
+        entry = self.feature_store.get(feature_key)
+        if entry is None:
+            # the result cache is skipped, its entries don't hold the intermediaries
+            sheetsage_output = self._infer(
+                audio_path,
+                None,
+                audio_array,
+                sr,
+                in_memory,
+                dict(infer_kwargs, return_intermediaries=True),
+                status_change_callback,
+                tqdm,
             )
+            arrays, objects = _split_features(sheetsage_output)
+            self.feature_store.put(feature_key, arrays=arrays, objects=objects)
+            entry = self.feature_store.get(feature_key)
+        return _join_features(entry["arrays"], entry["objects"])
+
+    def _infer(
+        self,
+        audio_path,
+        audio_url,
+        audio_array,
+        sr,
+        in_memory,
+        infer_kwargs,
+        status_change_callback,
+        tqdm,
+    ):
+        from sheetsage.infer import sheetsage as sheetsage_infer
+
+        if tqdm is None:
+            from tqdm import tqdm
+
+        infer_kwargs = dict(infer_kwargs, status_change_callback=status_change_callback, tqdm=tqdm)
+
+        with contextlib.ExitStack() as stack:
+            if audio_array is not None:
+                audio_input = _to_wav_bytes(audio_array, sr)
+            elif in_memory:
+                if audio_path:
+                    audio_array, sr = read_stream(stream_audio(audio_path))
+                else:
+                    audio_array, sr = _decode_url(audio_url)
+                audio_input = _to_wav_bytes(audio_array, sr)
+                del audio_array
+            else:
+                tmp_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+                if audio_path:
+                    audio_input = _transcode_file(audio_path, tmp_dir)
+                else:
+                    audio_input = _download_url(audio_url, tmp_dir)
+
+            return sheetsage_infer(audio_path_bytes_or_url=audio_input, **infer_kwargs)
+
+
+def decode_lead_sheet(features, melody_threshold=None, harmony_threshold=None):
+    """
+    Decode the melody and harmony of a lead sheet from the logits of `SheetSage.features`.
+
+    Class 0 of each head means no onset. Without a threshold each tertiary takes the most likely
+    class, as sheetsage does; with one, the most likely onset is kept only if its probability is
+    at least the threshold.
+
+    Args:
+        features (dict): The output of `SheetSage.features`.
+        melody_threshold (float, optional): Minimum probability of a note onset. Defaults to None.
+        harmony_threshold (float, optional): Minimum probability of a chord onset. Defaults to None.
+
+    Returns:
+        dict: "melody" and "harmony", lists of (time, tertiary, class) onsets sorted by time, or
+            None if the head was not run.
+    """
+    beat_times = np.asarray(features["segment_beats_times"], dtype=float)
+    chunks_tertiaries = features["chunks_tertiaries"]
+    lead_sheet = {}
+    for head, threshold in [("melody", melody_threshold), ("harmony", harmony_threshold)]:
+        logits = features.get(f"{head}_logits")
+        if logits is None:
+            lead_sheet[head] = None
+            continue
+        events = {}
+        for chunk_tertiaries, chunk_logits in zip(chunks_tertiaries, logits):
+            # the first tertiary of the chunk on the segment grid
+            start = int(np.ravel(chunk_tertiaries)[0])
+            for i, label in enumerate(_decode_logits(chunk_logits, threshold)):
+                if label != 0:
+                    events[start + i] = int(label)
+        tertiaries = sorted(events)
+        beats = np.asarray(tertiaries, dtype=float) / _TERTIARIES_PER_BEAT
+        times = np.interp(beats, np.arange(len(beat_times)), beat_times) if tertiaries else []
+        lead_sheet[head] = [(float(t), i, events[i]) for t, i in zip(times, tertiaries)]
+    return lead_sheet
+
+
+def _decode_logits(logits, threshold):
+    logits = np.asarray(logits, dtype=float)
+    logits = logits.reshape(-1, logits.shape[-1])
+    if threshold is None:
+        return logits.argmax(axis=-1)
+    probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    probs /= probs.sum(axis=-1, keepdims=True)
+    labels = probs[:, 1:].argmax(axis=-1) + 1
+    labels[probs[np.arange(len(labels)), labels] < threshold] = 0
+    return labels
+
+
+def _split_features(sheetsage_output):
+    """Split the feature fields into numeric arrays, one per chunk if needed, and others."""
+    arrays, objects = {}, {}
+    for field in _FEATURE_FIELDS:
+        value = sheetsage_output.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)) and all(hasattr(v, "shape") for v in value):
+            chunks = {f"{field}.{i:04d}": np.asarray(v) for i, v in enumerate(value)}
+        else:
+            chunks = {field: np.asarray(value)} if _is_numeric(value) else {}
+        if chunks and all(_is_numeric(v) for v in chunks.values()):
+            arrays.update(chunks)
+        else:
+            objects[field] = value
+    return arrays, objects
+
+
+def _join_features(arrays, objects):
+    features = dict(objects or {})
+    for name in sorted(arrays or {}):
+        field, _, chunk = name.partition(".")
+        if chunk:
+            features.setdefault(field, []).append(arrays[name])
+        else:
+            features[field] = arrays[name]
+    return features
+
+
+def _is_numeric(value):
+    try:
+        return np.asarray(value).dtype.kind in "biuf"
+    except ValueError:  # ragged sequences
+        return False
+
+
+def _to_wav_bytes(audio_array, sr):
+    import soundfile as sf
+
+    if hasattr(audio_array, "detach"):  # torch.Tensor
+        audio_array = audio_array.detach().cpu().numpy()
+    buffer = io.BytesIO()
+    sf.write(buffer, audio_array, sr, format="WAV", subtype="FLOAT")
+    return buffer.getvalue()
+
+
+def _decode_url(audio_url, sr=44100, channels=2):
+    """Download the audio with yt-dlp and decode it with ffmpeg, piping it through memory."""
+    assert shutil.which("ffmpeg") is not None, "ffmpeg not found. Please install ffmpeg."
+
+    ytdlp_cmd = ["yt-dlp", "-q", "-f", "bestaudio/best", "-o", "-", audio_url]
+    ffmpeg_cmd = ["ffmpeg", "-v", "error", "-i", "pipe:0", "-vn", "-f", "f32le"]
+    ffmpeg_cmd += ["-ac", str(channels), "-ar", str(sr), "pipe:1"]
+    with subprocess.Popen(ytdlp_cmd, stdout=subprocess.PIPE) as ytdlp:
+        with subprocess.Popen(ffmpeg_cmd, stdin=ytdlp.stdout, stdout=subprocess.PIPE) as ffmpeg:
+            # close our copy of the pipe, so yt-dlp stops if ffmpeg exits
+            ytdlp.stdout.close()
+            try:
+                data = ffmpeg.stdout.read()
+            except BaseException:
+                ffmpeg.kill()
+                ytdlp.kill()
+                raise
+
+    for proc, cmd in [(ytdlp, ytdlp_cmd), (ffmpeg, ffmpeg_cmd)]:
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    audio_array = np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+    return audio_array, sr
+
+
+def _transcode_file(audio_path, tmp_dir, ext="flac"):
+    assert shutil.which("ffmpeg") is not None, "ffmpeg not found. Please install ffmpeg."
+
+    tmp_audio_file = tmp_dir / f"audio.{ext}"
+    subprocess.run(
+        ["ffmpeg", "-i", str(audio_path), "-vn", "-f", ext, "-y", str(tmp_audio_file)],
+        check=True,
+    )
+    return tmp_audio_file
+
+
+def _download_url(audio_url, tmp_dir, ext="flac"):
+    subprocess.run(
+        [
+            "yt-dlp",
+            "-x",
+            "--audio-format",
+            ext,
+            "--audio-quality",
+            "0",
+            "-o",
+            str(tmp_dir / "audio.%(ext)s"),
+            audio_url,
+        ],
+        check=True,
+    )
+    return tmp_dir / f"audio.{ext}"
+
+
+def _format_output(sheetsage_output, return_dict):
+    if return_dict:
+        return sheetsage_output
+    else:
+        return (
+            sheetsage_output["lead_sheet"],
+            sheetsage_output["segment_beats"],
+            sheetsage_output["segment_beats_times"],
+            sheetsage_output["chunks_tertiaries"],
+            sheetsage_output["melody_logits"],
+            sheetsage_output["harmony_logits"],
+            sheetsage_output["melody_last_hidden_state"],
+            sheetsage_output["harmony_last_hidden_state"],
+        )
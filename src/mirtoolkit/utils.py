@@ -1,11 +1,23 @@
+import functools
+import json
+import math
 import shutil
 import subprocess
 import tempfile
+from collections import deque
 from pathlib import Path
 
+import numpy as np
 import torch
 import torchaudio
 
+# maximum number of resamplers kept by `get_resampler`
+RESAMPLER_CACHE_SIZE = 16
+
+# default parameters of `torchaudio.transforms.Resample`
+_LOWPASS_FILTER_WIDTH = 6
+_ROLLOFF = 0.99
+
 
 def download(url, file):
     assert isinstance(url, str)
@@ -37,44 +49,375 @@ def download(url, file):
 
 
 def load_audio(
-    path, dtype="float32", return_tensor=False, channels_first=False, mono=False, sr=None
+    path,
+    dtype="float32",
+    return_tensor=False,
+    channels_first=False,
+    mono=False,
+    sr=None,
+    out=None,
 ):
     """
     Load an audio file from the given path.
+
+    Files readable by soundfile are decoded straight into one buffer (down-mixed block by block if
+    `mono`), and the returned waveform is a view of that buffer. Resampling allocates the resampled
+    output.
     Args:
         path (str): The path to the audio file.
-        dtype (str, optional): The desired data type of the audio waveform. Defaults to "float64".
+        dtype (str, optional): The desired data type of the audio waveform. Defaults to "float32".
         return_tensor (bool, optional): Whether to return the audio waveform as a tensor. Defaults to False.
         channels_first (bool, optional): Whether to return the audio waveform with channels as the first dimension. Defaults to False.
+        mono (bool, optional): Whether to down-mix to mono. Defaults to False.
+        sr (int, optional): The sample rate to resample to. Defaults to None.
+        out (ndarray or AudioBufferPool, optional): Buffer of shape (frames,) if `mono` else (frames, channels) to decode into, or a pool to take it from. Defaults to None.
     Returns:
         tuple or ndarray: If `return_tensor` is False, returns a tuple containing the audio waveform as a numpy ndarray and the sample rate as an integer. If `return_tensor` is True, returns a tuple containing the audio waveform as a PyTorch tensor and the sample rate as an integer.
     """
     assert dtype in ["float32", "float64"]
 
     try:
-        waveform, sample_rate = torchaudio.load(path, channels_first=channels_first)
-        if mono and waveform.shape[0] > 1:
-            if channels_first:
-                waveform = waveform.mean(0)
-            else:
-                waveform = waveform.mean(-1)
-
+        waveform, sample_rate = _read_soundfile(path, dtype, mono, out)
+    except Exception:
+        # in case soundfile fails, e.g. for webm and m4a, try torchaudio
+        waveform, sample_rate = torchaudio.load(path, channels_first=False)
+        if mono:
+            waveform = waveform.mean(-1)
         if dtype == "float64":
             waveform = waveform.to(dtype=torch.float64)
+        waveform = waveform.numpy()
 
-    except Exception:
-        # in case torchaudio fails, try soundfile
-        import soundfile as sf
-
-        waveform, sample_rate = sf.read(path, dtype=dtype)
-        waveform = torch.from_numpy(waveform)
+    # the waveform is channels last here, and torch.from_numpy doesn't copy
+    waveform = torch.from_numpy(waveform)
 
     if sr is not None:
-        # resample the audio to the given sample rate
-        waveform = torchaudio.transforms.Resample(sample_rate, sr)(waveform)
+        # resample the audio to the given sample rate along the time axis
+        if waveform.ndim == 1:
+            waveform = resample(waveform, sample_rate, sr)
+        else:
+            waveform = resample(waveform.T, sample_rate, sr).T
         sample_rate = sr
 
+    if channels_first and waveform.ndim == 2:
+        waveform = waveform.T
+
     if not return_tensor:
         waveform = waveform.squeeze().numpy()
 
     return waveform, sample_rate
+
+
+class AudioBufferPool:
+    """
+    Reusable decoding buffers for `load_audio(out=pool)`.
+
+    The pool keeps one buffer per dtype and number of channels and grows it on demand, so the
+    waveforms returned from a pooled buffer are only valid until the next load from the same pool.
+    The pool is not thread-safe; use one pool per thread.
+    """
+
+    def __init__(self, growth=1.25):
+        self.growth = growth
+        self._buffers = {}
+
+    def get(self, shape, dtype="float32"):
+        key = (np.dtype(dtype).str, shape[1:])
+        buffer = self._buffers.get(key)
+        if buffer is None or len(buffer) < shape[0]:
+            buffer = np.empty((int(shape[0] * self.growth),) + shape[1:], dtype=dtype)
+            self._buffers[key] = buffer
+        return buffer[: shape[0]]
+
+
+def _read_soundfile(path, dtype, mono, out, block_frames=65536):
+    import soundfile as sf
+
+    with sf.SoundFile(str(path)) as f:
+        frames, channels = f.frames, f.channels
+        shape = (frames,) if mono else (frames, channels)
+        if out is None:
+            buffer = np.empty(shape, dtype=dtype)
+        elif isinstance(out, AudioBufferPool):
+            buffer = out.get(shape, dtype=dtype)
+        else:
+            assert out.dtype == np.dtype(dtype), f"Buffer dtype must be {dtype}: {out.dtype}"
+            assert (
+                out.shape[1:] == shape[1:] and len(out) >= frames and out.flags.c_contiguous
+            ), f"Contiguous buffer of shape {out.shape} can't hold audio of shape {shape}."
+            buffer = out[:frames]
+
+        if not mono or channels == 1:
+            # a view of the buffer is returned if fewer frames are decoded than reported
+            waveform = f.read(out=buffer.reshape(frames, channels))
+        else:
+            # down-mix block by block, so only the mono waveform is resident
+            scratch = np.empty((min(block_frames, frames), channels), dtype=dtype)
+            num_read = 0
+            while num_read < frames:
+                block = f.read(out=scratch)
+                if len(block) == 0:
+                    break
+                mixed = buffer[num_read : num_read + len(block)]
+                np.add(block[:, 0], block[:, 1], out=mixed)
+                for c in range(2, channels):
+                    mixed += block[:, c]
+                mixed *= 1.0 / channels
+                num_read += len(block)
+            waveform = buffer[:num_read]
+        sample_rate = f.samplerate
+
+    if mono:
+        waveform = waveform.reshape(-1)
+    return waveform, sample_rate
+
+
+def resample(waveform, orig_sr, new_sr):
+    """
+    Resample a waveform along its last dimension with a shared resampler.
+
+    Args:
+        waveform (Tensor): The audio waveform.
+        orig_sr (int): The sample rate of the waveform.
+        new_sr (int): The sample rate to resample to.
+    Returns:
+        Tensor: The resampled waveform, or `waveform` itself if the sample rates match.
+    """
+    if orig_sr == new_sr:
+        return waveform
+    return get_resampler(orig_sr, new_sr, waveform.dtype, waveform.device)(waveform)
+
+
+def get_resampler(orig_sr, new_sr, dtype=torch.float32, device="cpu"):
+    """
+    Get a `torchaudio.transforms.Resample` shared by all callers.
+
+    Building a resampler computes its sinc kernel, so the resamplers are kept in a bounded LRU
+    cache keyed by the sample rates, dtype and device.
+    """
+    return _get_resampler_cached(int(orig_sr), int(new_sr), dtype, torch.device(device))
+
+
+@functools.lru_cache(maxsize=RESAMPLER_CACHE_SIZE)
+def _get_resampler_cached(orig_sr, new_sr, dtype, device):
+    return torchaudio.transforms.Resample(orig_sr, new_sr, dtype=dtype).to(device)
+
+
+def stream_audio(path, block_seconds=30.0, hop=None, sr=None, mono=False, dtype="float32"):
+    """
+    Decode an audio file block by block in bounded memory.
+
+    The file is decoded incrementally and resampled by a stateful resampler that keeps its
+    context across blocks, so the concatenated blocks match `load_audio` up to float precision.
+
+    Args:
+        path (str or Path): The path to the audio file.
+        block_seconds (float, optional): Length of each block in seconds. Defaults to 30.0.
+        hop (float, optional): Time between the starts of consecutive blocks in seconds. Defaults to `block_seconds`.
+        sr (int, optional): The sample rate to resample to. Defaults to the sample rate of the file.
+        mono (bool, optional): Whether to down-mix to mono. Defaults to False.
+        dtype (str, optional): The desired data type of the audio waveform. Defaults to "float32".
+    Yields:
+        tuple: The block as a numpy ndarray of shape (samples, channels), or (samples,) if `mono` is True, and the sample rate as an integer.
+    """
+    assert dtype in ["float32", "float64"]
+    if hop is None:
+        hop = block_seconds
+    assert 0 < hop <= block_seconds, "hop must be positive and not larger than block_seconds"
+
+    chunks, sample_rate = _decode_chunks(path, dtype)
+    if sr is None:
+        sr = sample_rate
+    resampler = _StreamResampler(sample_rate, sr) if sr != sample_rate else None
+
+    block_frames = max(int(block_seconds * sr), 1)
+    hop_frames = max(int(hop * sr), 1)
+    buffer = []
+    buffered = 0
+    num_yielded = 0
+
+    def resampled():
+        for chunk, last in _mark_last(chunks):
+            if mono:
+                chunk = chunk.mean(axis=1, keepdims=True)
+            if resampler is not None:
+                chunk = resampler(torch.from_numpy(chunk.T), last=last).T.numpy()
+            yield chunk
+
+    for chunk in resampled():
+        buffer.append(chunk)
+        buffered += len(chunk)
+        while buffered >= block_frames:
+            block = np.concatenate(buffer)
+            yield _format_block(block[:block_frames], mono), sr
+            num_yielded += 1
+            block = block[hop_frames:]
+            buffer, buffered = [block], len(block)
+
+    # the last block is shorter, unless it is fully covered by the previous one
+    if buffered > 0 and (num_yielded == 0 or buffered > block_frames - hop_frames):
+        yield _format_block(np.concatenate(buffer), mono), sr
+
+
+def read_stream(stream):
+    """
+    Concatenate the blocks of `stream_audio` with `hop` equal to `block_seconds`.
+
+    Returns:
+        tuple: The audio waveform as a numpy ndarray and the sample rate as an integer.
+    """
+    blocks, sample_rate = [], None
+    for block, sample_rate in stream:
+        blocks.append(block)
+    assert sample_rate is not None, "The stream is empty."
+    return np.concatenate(blocks), sample_rate
+
+
+def load_mono(path, sr):
+    """
+    Decode an audio file to mono at the sample rate `sr`, block by block, so only the mono signal
+    at the target rate is resident.
+
+    Returns:
+        numpy.ndarray: The audio waveform of shape (samples,).
+    """
+    audio, _ = read_stream(stream_audio(path, sr=sr, mono=True))
+    return audio
+
+
+def prefetch(executor, fn, items, max_pending):
+    """Yield `fn(item)` for each item in order, computing up to `max_pending` items ahead."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _format_block(block, mono):
+    block = np.ascontiguousarray(block)
+    return block[:, 0] if mono else block
+
+
+def _mark_last(iterable):
+    it = iter(iterable)
+    try:
+        prev = next(it)
+    except StopIteration:
+        return
+    for item in it:
+        yield prev, False
+        prev = item
+    yield prev, True
+
+
+def _decode_chunks(path, dtype, chunk_frames=1 << 16):
+    """Return a generator of decoded chunks of shape (frames, channels) and the sample rate."""
+    import soundfile as sf
+
+    try:
+        info = sf.info(str(path))
+    except Exception:
+        # in case soundfile fails, decode with ffmpeg, e.g. for webm and m4a
+        return _decode_chunks_ffmpeg(path, dtype, chunk_frames)
+
+    def chunks():
+        with sf.SoundFile(str(path)) as f:
+            while True:
+                chunk = f.read(chunk_frames, dtype=dtype, always_2d=True)
+                if len(chunk) == 0:
+                    break
+                yield chunk
+
+    return chunks(), info.samplerate
+
+
+def _decode_chunks_ffmpeg(path, dtype, chunk_frames):
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        raise FileNotFoundError("ffmpeg not found. Please install ffmpeg.")
+
+    probe = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            "stream=sample_rate,channels",
+            "-of",
+            "json",
+            str(path),
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    stream_info = json.loads(probe.stdout)["streams"][0]
+    sample_rate, channels = int(stream_info["sample_rate"]), int(stream_info["channels"])
+
+    def chunks():
+        cmd = ["ffmpeg", "-v", "error", "-i", str(path), "-vn", "-f", "f32le", "-"]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            try:
+                frame_bytes = 4 * channels
+                while True:
+                    data = proc.stdout.read(chunk_frames * frame_bytes)
+                    if len(data) == 0:
+                        break
+                    data = data[: len(data) // frame_bytes * frame_bytes]
+                    chunk = np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+                    yield chunk.astype(dtype, copy=False)
+            finally:
+                proc.kill()
+
+    return chunks(), sample_rate
+
+
+class _StreamResampler:
+    """
+    Stateful version of `torchaudio.transforms.Resample` for consecutive chunks.
+
+    The sinc kernel maps every `orig` input samples to `new` output samples (the rates reduced by
+    their gcd), and each group of outputs reads `width` samples around its inputs. The resampler
+    keeps the not yet consumed input plus `width` samples of left context, and only emits the
+    outputs whose kernel support is complete, so the outputs equal those of resampling at once.
+    """
+
+    def __init__(self, orig_sr, new_sr):
+        gcd = math.gcd(orig_sr, new_sr)
+        self.orig = orig_sr // gcd
+        self.new = new_sr // gcd
+        self.width = math.ceil(
+            _LOWPASS_FILTER_WIDTH * self.orig / (min(self.orig, self.new) * _ROLLOFF)
+        )
+        self.context_groups = math.ceil(self.width / self.orig)
+        self.resample = get_resampler(orig_sr, new_sr)
+        self.buffer = None
+        self.buffer_group = 0  # index of the input group at the start of the buffer
+        self.next_group = 0  # index of the next output group to emit
+
+    def __call__(self, chunk, last=False):
+        buffer = chunk if self.buffer is None else torch.cat([self.buffer, chunk], dim=-1)
+        length = buffer.shape[-1]
+
+        if last:
+            end_group = math.ceil(length / self.orig)
+        else:
+            # group k reads the inputs [k * orig - width, (k + 1) * orig + width)
+            end_group = max((length - self.width) // self.orig, 0)
+        start_group = self.next_group - self.buffer_group
+
+        if end_group <= start_group:
+            out = buffer[..., :0]
+        else:
+            out = self.resample(buffer.to(self.resample.kernel.dtype))
+            out = out[..., start_group * self.new : None if last else end_group * self.new]
+            out = out.to(chunk.dtype)
+            self.next_group = self.buffer_group + end_group
+
+        # drop the consumed input but keep the left context of the next group
+        keep_group = max(self.buffer_group, self.next_group - self.context_groups)
+        self.buffer = buffer[..., (keep_group - self.buffer_group) * self.orig :]
+        self.buffer_group = keep_group
+        return out
@@ -1,15 +1,102 @@
 import argparse
+import functools
+import heapq
+import io
 import json
+import math
+import os
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
 
-from tqdm import tqdm as _tqdm
+# `ytdb` is launched once per shard, so modules that `--help` doesn't need (tqdm, sqlite3,
+# concurrent.futures) are imported on first use to keep the startup time low.
+
+
+# initial retry delays in seconds of the failures that may be transient
+RETRY_DELAYS = {"rate_limited": 60.0, "other": 30.0}
+
+# exit code of yt-dlp when an item doesn't pass `--break-match-filters`
+YT_DLP_FILTERED_EXIT_CODE = 101
+
+# fields of the info JSON kept by `--info_fields default`
+INFO_FIELDS = [
+    "id",
+    "title",
+    "fulltitle",
+    "description",
+    "channel",
+    "channel_id",
+    "uploader",
+    "uploader_id",
+    "duration",
+    "upload_date",
+    "timestamp",
+    "view_count",
+    "like_count",
+    "categories",
+    "tags",
+    "language",
+    "age_limit",
+    "availability",
+    "live_status",
+    "webpage_url",
+    "format_id",
+    "ext",
+    "acodec",
+    "vcodec",
+    "abr",
+    "asr",
+    "audio_channels",
+    "width",
+    "height",
+    "fps",
+    "filesize",
+]
+
+INFO_FIELDS_HELP = (
+    'Fields of the info JSON to keep, separated by comma(,). "default" keeps the common '
+    "metadata. Defaults to all fields"
+)
+
+# fields of the info JSON recorded in the store index
+METADATA_FIELDS = ["title", "channel", "channel_id", "duration", "upload_date", "view_count"]
+
+# zstd dictionaries of the info JSON are saved under the store root in this directory
+INFO_DICT_DIR = ".info_dicts"
+INFO_ZSTD_LEVEL = 19
+
+# `ytdb pack` starts a new shard after this many bytes
+DEFAULT_SHARD_SIZE = 1 << 30
+
+# formats of the ingest stage, see `_ingest_audio`
+INGEST_FORMATS = ["flac", "npy"]
+
+# yt-dlp messages of throttled requests
+_RATE_LIMIT_MESSAGES = [
+    "http error 429",
+    "too many requests",
+    "rate-limit",
+    "rate limit",
+    "try again later",
+    "not a bot",
+]
+
+# IDs of `ytdb download` are deduplicated with a Bloom filter of this capacity (12 MiB), and the
+# last `DEDUP_WINDOW` IDs are also compared exactly
+DEDUP_CAPACITY = 10_000_000
+DEDUP_WINDOW = 65536
 
 
 def tqdm(*args, dynamic_ncols=True, **kwargs):
+    from tqdm import tqdm as _tqdm
+
     return _tqdm(
         *args,
         dynamic_ncols=dynamic_ncols,
@@ -25,6 +112,14 @@ class DownloadFailedOther(Exception):
         super().__init__(f"Other error: {yt_id}")
 
 
+class DownloadFailedRateLimited(DownloadFailedOther):
+    keyword = "rate_limited"
+
+    def __init__(self, yt_id):
+        self.yt_id = yt_id
+        Exception.__init__(self, f"Rate limited: {yt_id}")
+
+
 class DownloadFailedInvalidId(Exception):
     keyword = "invalid_id"
 
@@ -73,6 +168,14 @@ class DownloadFailedUnsupported(Exception):
         super().__init__(f"Unsupported: {yt_id}")
 
 
+class DownloadFailedFiltered(Exception):
+    keyword = "filtered"
+
+    def __init__(self, yt_id):
+        self.yt_id = yt_id
+        super().__init__(f"Filtered: {yt_id}")
+
+
 class WeirdYtIdException(Exception):
     def __init__(self, yt_id):
         self.yt_id = yt_id
@@ -80,7 +183,7 @@ class WeirdYtIdException(Exception):
 
 
 def cmd_download(args):
-    _check_download_dependencies()
+    _check_download_dependencies(args.backend, args.compress_info)
 
     yt_ids = _parse_ids(args)
     failed_skip_types = set(args.failed_skip_type.split(","))
@@ -95,6 +198,15 @@ def cmd_download(args):
         cookies_file=args.cookies_file,
         request_interval=args.request_interval,
         download_interval=args.download_interval,
+        jobs=args.jobs,
+        queue_file=args.queue,
+        max_rate=args.max_rate,
+        max_retries=args.max_retries,
+        backend=args.backend,
+        ingest=(args.ingest, args.ingest_sr) if args.ingest else None,
+        info_fields=_parse_info_fields(args.info_fields),
+        compress_info=args.compress_info,
+        match_filter=_get_match_filter(args.min_duration, args.max_duration, args.filter),
     )
 
 
@@ -110,30 +222,57 @@ def _parse_ids(args):
 
 
 def _parse_ids_file(id_file):
-    yt_ids = []
     if id_file.suffix == ".json":
-        for entry in json.loads(id_file.read_text()):
-            yt_ids.append(_input_to_id(entry))
+        for entry in _iter_json_array(id_file):
+            yield _input_to_id(entry)
     else:
-        for line in id_file.read_text().strip().splitlines():
-            for entry in line.strip().split():
-                yt_ids.append(_input_to_id(entry))
-    return yt_ids
+        with open(id_file) as f:
+            for line in f:
+                for entry in line.split():
+                    yield _input_to_id(entry)
 
 
 def _parse_ids_args(args):
-    yt_ids = []
     for entry in args.args:
-        yt_ids.append(_input_to_id(entry))
-    return yt_ids
+        yield _input_to_id(entry)
 
 
 def _parse_ids_stdin():
-    yt_ids = []
     for line in sys.stdin:
-        for entry in line.strip().split():
-            yt_ids.append(_input_to_id(entry))
-    return yt_ids
+        for entry in line.split():
+            yield _input_to_id(entry)
+
+
+_JSON_SEPARATOR = re.compile(r"[\s,]*")
+
+
+def _iter_json_array(file, chunk_size=1 << 20):
+    """Yield the elements of the JSON array in `file`, reading it chunk by chunk."""
+    decoder = json.JSONDecoder()
+    with open(file) as f:
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{file} is not a JSON array.")
+        pos = 1
+        eof = False
+        while True:
+            pos = _JSON_SEPARATOR.match(buf, pos).end()
+            if buf.startswith("]", pos):
+                return
+            try:
+                entry, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                end = None
+            # the element may continue in the next chunk
+            if (end is None or end == len(buf)) and not eof:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            if end is None:
+                raise ValueError(f"{file} is not a valid JSON array.")
+            yield entry
+            pos = end
 
 
 def _input_to_id(text):
@@ -153,35 +292,111 @@ def _download_wrapper(
     cookies_file=None,
     request_interval=1,
     download_interval=1,
+    jobs=1,
+    queue_file=None,
+    max_rate=None,
+    max_retries=3,
+    backend="subprocess",
+    ingest=None,
+    info_fields=None,
+    compress_info=False,
+    match_filter=None,
 ):
     assert output_dir_root.exists(), f"Directory {output_dir_root} does not exist."
-    failed_file.touch(exist_ok=True)
-    failed_type = {}
-
-    for line in failed_file.read_text().strip().splitlines():
-        yt_id, ftype = line.split()
-        failed_type[yt_id] = ftype
+    assert jobs >= 1, f"Number of jobs must be positive: {jobs}"
+    failure_log = FailureLog(failed_file)
+    failed_lock = threading.Lock()
+
+    # use the store index if it has been built
+    index = StoreIndex.open(output_dir_root)
+    # items moved into shards by `ytdb pack` are not downloaded again
+    packed = PackedStore.open(output_dir_root)
+
+    def is_packed(yt_id):
+        manifest = packed.get_manifest(yt_id) if packed is not None else None
+        return manifest is not None and tgt_type in manifest["files"]
+
+    def is_downloaded(yt_id):
+        manifest = index.get_manifest(yt_id) if index is not None else None
+        if manifest is None and len(yt_id) >= 4:
+            try:
+                manifest_file = _get_save_dir(yt_id, output_dir_root) / "manifest.json"
+                manifest = json.loads(manifest_file.read_text())
+            except (OSError, ValueError):
+                return False  # `_download` replaces broken items
+        return manifest is not None and tgt_type in manifest["files"]
+
+    queue = None
+    if queue_file is not None:
+        # the queue deduplicates the IDs and remembers the finished ones across runs
+        queue = DownloadQueue(queue_file)
+        queue.add(yt_ids, tgt_type)
+        queue.reset(tgt_type, failed_skip_type)
+        total = queue.counts(tgt_type).get(DownloadQueue.PENDING, 0)
+        yt_ids = queue.iter_pending(tgt_type)
+    else:
 
-    # remove duplicates
-    yt_ids = list(dict.fromkeys(yt_ids))
+        def is_known(yt_id):
+            # IDs that failed with a retryable keyword are downloaded again
+            if failure_log.get(yt_id) in failed_skip_type:
+                return True
+            return is_packed(yt_id) or is_downloaded(yt_id)
 
-    for yt_id in tqdm(yt_ids, dynamic_ncols=True):
-        if failed_type.get(yt_id) in failed_skip_type:
-            continue
+        total = len(yt_ids) if hasattr(yt_ids, "__len__") else None
+        yt_ids = _dedup_ids(yt_ids, is_known=is_known)
 
+    # downloads are paced in process, so yt-dlp doesn't sleep between them
+    limiter = RateLimiter(
+        rate=jobs / download_interval if download_interval > 0 else None, max_rate=max_rate
+    )
+    retries = RetryQueue(max_retries=max_retries)
+    if backend == "embedded":
+        backend = YtDlpBackend(
+            cookies_file=cookies_file,
+            request_interval=request_interval,
+            verbose=verbose,
+            match_filter=match_filter,
+        )
+    else:
+        assert backend == "subprocess", f"Invalid backend: {backend}"
+        backend = None
+
+    def download_task(yt_id):
+        """Returns False if the download failed and will be retried."""
+        # items already downloaded don't touch the network, so they don't pass the rate limiter
+        if is_packed(yt_id) or is_downloaded(yt_id):
+            if queue is not None:
+                queue.finish(yt_id, tgt_type)
+            return True
+        keyword = failure_log.get(yt_id)
+        if keyword in failed_skip_type:
+            if queue is not None:
+                queue.finish(yt_id, tgt_type, keyword)
+            return True
+
+        keyword = None
+        limiter.acquire()
         try:
-            yt_id = _download(
+            _download(
                 yt_id,
                 tgt_type,
                 output_dir_root,
                 verbose,
                 cookies_file=cookies_file,
                 request_interval=request_interval,
-                download_interval=download_interval,
+                download_interval=0,
+                index=index,
+                backend=backend,
+                ingest=ingest,
+                info_fields=info_fields,
+                compress_info=compress_info,
+                match_filter=match_filter,
             )
         except DownloadFailedInvalidId as e:
             print(f"[{e.yt_id}] Invalid ID.")
+            keyword = DownloadFailedInvalidId.keyword
         except (
+            DownloadFailedFiltered,
             DownloadFailedPrivate,
             DownloadFailedRemoved,
             DownloadFailedUnavailable,
@@ -189,25 +404,578 @@ def _download_wrapper(
             DownloadFailedCopyright,
             DownloadFailedOther,
         ) as e:
-            if yt_id not in failed_type:
-                failed_type[yt_id] = e.keyword
-                with open(failed_file, "a") as f:
-                    f.write(f"{yt_id} {e.keyword}\n")
+            keyword = e.keyword
+        limiter.record(keyword)
+
+        if keyword is None:
+            retries.forget(yt_id)
+        elif retries.push(yt_id, keyword):
+            return False
+        elif keyword != DownloadFailedInvalidId.keyword:
+            # workers share one failed file, so updates must not interleave
+            with failed_lock:
+                failure_log.record(yt_id, keyword)
+                if index is not None:
+                    index.set_failure(yt_id, keyword)
+        if queue is not None:
+            queue.finish(yt_id, tgt_type, keyword)
+        return True
+
+    try:
+        _run_download_tasks(
+            download_task, retries.merge(yt_ids), jobs, total=total, retries=retries
+        )
+    finally:
+        if index is not None:
+            index.close()
+        if packed is not None:
+            packed.close()
+        if queue is not None:
+            queue.close()
+
+
+def _run_download_tasks(download_task, yt_ids, jobs, total=None, retries=None):
+    """
+    Run `download_task` on each ID with `jobs` threads. Then run it on the IDs in `retries` as
+    their backoff expires, until none are left.
+    """
+    with tqdm(total=total) as pbar:
+        while True:
+            if jobs == 1:
+                for yt_id in yt_ids:
+                    if download_task(yt_id):
+                        pbar.update(1)
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    for future in _iter_completed(
+                        executor, download_task, yt_ids, max_pending=2 * jobs
+                    ):
+                        # re-raise exceptions from workers
+                        if future.result():
+                            pbar.update(1)
+
+            if not retries:
+                return
+            yt_ids = retries.iter_waiting()
+
+
+class RateLimiter:
+    """
+    Token bucket that paces download starts across all workers and adapts its rate to throttling.
+
+    The rate grows by `increase` times itself after each download that isn't throttled, and by a
+    tenth of that above 90% of the rate it was last throttled at, so it settles just below the
+    throttle threshold. An HTTP 429 (`DownloadFailedRateLimited`), or "other" failures in half of
+    the last `window` downloads, multiply the rate by `decrease` and pause all workers for
+    `cooldown` seconds.
+
+    Args:
+        rate (float, optional): Initial downloads per second. None starts unlimited, and the first
+            throttling sets the rate from the observed throughput. Defaults to None.
+        max_rate (float, optional): Upper bound of the rate. Defaults to None.
+        min_rate (float, optional): Lower bound of the rate. Defaults to one per 10 minutes.
+        increase (float, optional): Relative increase per download. Defaults to 0.05.
+        decrease (float, optional): Factor applied when throttled. Defaults to 0.5.
+        cooldown (float, optional): Pause in seconds when throttled. Defaults to 60.
+        window (int, optional): Number of recent downloads to look for "other" failures in.
+            Defaults to 10.
+    """
+
+    def __init__(
+        self,
+        rate=None,
+        max_rate=None,
+        min_rate=1 / 600,
+        increase=0.05,
+        decrease=0.5,
+        cooldown=60.0,
+        window=10,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        if rate is not None and max_rate is not None:
+            rate = min(rate, max_rate)
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = 1.0
+        self._last = clock()
+        self._paused_until = self._last
+        self._throttled_rate = None
+        self._outcomes = deque(maxlen=window)
+        self._starts = deque(maxlen=window)
+
+    def acquire(self):
+        """
+        Wait until a download may start.
+        """
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                # tolerate rounding errors of the refill
+                if now >= self._paused_until and (self.rate is None or self._tokens > 1 - 1e-9):
+                    self._tokens = max(self._tokens - 1, 0.0)
+                    self._starts.append(now)
+                    return
+                wait = self._paused_until - now
+                if self.rate is not None:
+                    wait = max(wait, (1 - self._tokens) / self.rate)
+            self._sleep(wait)
+
+    def _refill(self, now):
+        start = max(self._last, self._paused_until)
+        if self.rate is not None and now > start:
+            self._tokens = min(1.0, self._tokens + (now - start) * self.rate)
+        self._last = now
+
+    def record(self, keyword=None):
+        """
+        Adapt the rate to the outcome of a download, given as its failure keyword (None for
+        success).
+        """
+        with self._lock:
+            if keyword == DownloadFailedRateLimited.keyword:
+                self._throttle()
+                return
+
+            self._outcomes.append(keyword)
+            num_other = sum(k == DownloadFailedOther.keyword for k in self._outcomes)
+            if num_other * 2 >= self._outcomes.maxlen:
+                self._throttle()
+            elif keyword != DownloadFailedOther.keyword and self.rate is not None:
+                step = self.increase * self.rate
+                if self._throttled_rate is not None and self.rate > 0.9 * self._throttled_rate:
+                    step /= 10
+                self.rate += step
+                if self.max_rate is not None:
+                    self.rate = min(self.rate, self.max_rate)
+
+    def _throttle(self):
+        now = self._clock()
+        rate = self.rate
+        if rate is None:
+            # unlimited so far, start from the observed throughput
+            elapsed = self._starts[-1] - self._starts[0] if self._starts else 0
+            rate = (len(self._starts) - 1) / elapsed if elapsed > 0 else 1.0
+        self._throttled_rate = rate
+        self.rate = max(self.min_rate, rate * self.decrease)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, now + self.cooldown)
+        self._outcomes.clear()
+
+
+class RetryQueue:
+    """
+    Failed downloads waiting for a retry, with an exponential backoff for each failure keyword.
+
+    The n-th retry of an ID waits `delays[keyword] * 2 ** n` seconds, jittered by +-50% so that a
+    burst of failures isn't retried at once. Keywords without a delay aren't retried.
+
+    Args:
+        delays (dict, optional): {keyword: initial delay in seconds}. Defaults to `RETRY_DELAYS`.
+        max_retries (int, optional): Maximum number of retries of an ID. Defaults to 3.
+    """
+
+    def __init__(self, delays=None, max_retries=3, clock=time.monotonic, sleep=time.sleep):
+        import random
+
+        self.delays = RETRY_DELAYS if delays is None else delays
+        self.max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = 0
+        self._attempts = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def push(self, yt_id, keyword):
+        """
+        Schedule a retry of a failed download.
+
+        Returns:
+            bool: False if the failure isn't retried.
+        """
+        delay = self.delays.get(keyword)
+        with self._lock:
+            attempt = self._attempts.get(yt_id, 0)
+            if delay is None or attempt >= self.max_retries:
+                self._attempts.pop(yt_id, None)
+                return False
+            self._attempts[yt_id] = attempt + 1
+            due = self._clock() + delay * 2**attempt * (0.5 + self._random.random())
+            heapq.heappush(self._heap, (due, self._seq, yt_id))
+            self._seq += 1
+            return True
+
+    def forget(self, yt_id):
+        """
+        Forget the retries of a download that succeeded.
+        """
+        with self._lock:
+            self._attempts.pop(yt_id, None)
+
+    def _pop(self, wait):
+        with self._lock:
+            if not self._heap:
+                return None, None
+            delay = self._heap[0][0] - self._clock()
+            if delay <= 0:
+                return heapq.heappop(self._heap)[2], None
+        return None, delay if wait else None
+
+    def merge(self, yt_ids):
+        """
+        Yield the IDs, each preceded by the retries that are due.
+        """
+        for yt_id in yt_ids:
+            while True:
+                retry_id, _ = self._pop(wait=False)
+                if retry_id is None:
+                    break
+                yield retry_id
+            yield yt_id
+
+    def iter_waiting(self):
+        """
+        Yield the scheduled retries as they become due, until none are left.
+        """
+        while True:
+            yt_id, delay = self._pop(wait=True)
+            if yt_id is not None:
+                yield yt_id
+            elif delay is not None:
+                self._sleep(delay)
             else:
-                if failed_type[yt_id] != e.keyword:
-                    failed_type[yt_id] = e.keyword
-                    buf = []
-                    for k, v in failed_type.items():
-                        buf.append(f"{k} {v}\n")
-                    failed_file.write_text("".join(buf))
+                return
+
+
+def _iter_completed(executor, fn, args_iter, max_pending):
+    """
+    Submit `fn(arg)` for each arg of `args_iter` to `executor`, keeping at most `max_pending`
+    tasks queued, and yield the futures as they complete.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    pending = set()
+    try:
+        for arg in args_iter:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from done
+            pending.add(executor.submit(fn, arg))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _dedup_ids(
+    yt_ids, is_known=None, capacity=DEDUP_CAPACITY, error_rate=0.01, window=DEDUP_WINDOW
+):
+    """
+    Drop repeated IDs from a stream in bounded memory.
+
+    An ID the Bloom filter hasn't seen is new. Otherwise it is dropped if it is one of the last
+    `window` IDs or `is_known(yt_id)` confirms it has been processed. Unconfirmed IDs may be false
+    positives and are kept, since downloading a stored ID again is a no-op.
+    """
+    seen = BloomFilter(capacity, error_rate)
+    recent = OrderedDict()
+    for yt_id in yt_ids:
+        if seen.add(yt_id):
+            if yt_id in recent:
+                continue
+            if is_known is not None and is_known(yt_id):
+                continue
+        recent[yt_id] = None
+        if len(recent) > window:
+            recent.popitem(last=False)
+        yield yt_id
+
+
+class BloomFilter:
+    """
+    Approximate set of strings in a fixed-size bit array.
+
+    Membership tests have no false negatives, and false positives at about `error_rate` once
+    `capacity` items have been added. The default capacity takes 12 MiB.
+
+    Args:
+        capacity (int, optional): Expected number of items. Defaults to 10M.
+        error_rate (float, optional): False positive rate at capacity. Defaults to 0.01.
+    """
+
+    def __init__(self, capacity=DEDUP_CAPACITY, error_rate=0.01):
+        from hashlib import blake2b
+
+        self._blake2b = blake2b
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: the i-th position is h1 + i * h2
+        digest = self._blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """
+        Add an item.
+
+        Returns:
+            bool: Whether the item may have been added before.
+        """
+        present = True
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self._bits[pos >> 3] & mask:
+                self._bits[pos >> 3] |= mask
+                present = False
+        return present
+
+    def __contains__(self, item):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class FailureLog:
+    """
+    Append-only log of failed downloads, one `<yt_id> <keyword>` line per failure.
+
+    A changed keyword is appended as a new line and the last line of an ID wins, so each failure
+    is an O(1) append. The file is compacted to one line per ID when superseded lines make up
+    more than half of it.
+
+    Args:
+        file (Path): The failed file.
+        min_compact_lines (int, optional): Don't compact files shorter than this. Defaults to 10000.
+    """
+
+    def __init__(self, file, min_compact_lines=10000):
+        self.file = Path(file)
+        self.min_compact_lines = min_compact_lines
+        self.file.touch(exist_ok=True)
+        self._types = {}
+        self._num_lines = 0
+        for line in self.file.read_text().strip().splitlines():
+            yt_id, keyword = line.split()
+            self._types[yt_id] = keyword
+            self._num_lines += 1
+
+    def get(self, yt_id):
+        return self._types.get(yt_id)
+
+    def record(self, yt_id, keyword):
+        if self._types.get(yt_id) == keyword:
+            return
+        self._types[yt_id] = keyword
+        with open(self.file, "a") as f:
+            f.write(f"{yt_id} {keyword}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._num_lines += 1
+
+        if self._num_lines > max(self.min_compact_lines, 2 * len(self._types)):
+            self.compact()
+
+    def compact(self):
+        _safely_write_text(self.file, "".join(f"{k} {v}\n" for k, v in self._types.items()))
+        self._num_lines = len(self._types)
+
+
+class DownloadQueue:
+    """
+    SQLite queue of download states, so a killed download job resumes where it stopped.
+
+    Each (ID, type) pair is pending, in progress, done or failed. IDs are claimed in batches in
+    the order they were added, and every state change is a single-row update appended to the
+    write-ahead log, which SQLite checkpoints into the database periodically.
+
+    Args:
+        file (Path): Path of the queue database.
+    """
+
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, file):
+        import sqlite3
+
+        self.file = Path(file)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS queue (
+                seq INTEGER PRIMARY KEY,
+                yt_id TEXT NOT NULL,
+                tgt_type TEXT NOT NULL,
+                state TEXT NOT NULL,
+                keyword TEXT,
+                UNIQUE (yt_id, tgt_type)
+            );
+            CREATE INDEX IF NOT EXISTS queue_state ON queue (tgt_type, state, seq);
+            """
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, yt_ids, tgt_type, batch_size=10000):
+        """
+        Add IDs to the queue as pending, ignoring the ones already queued.
+
+        Returns:
+            int: Number of added IDs.
+        """
+        num_added = 0
+        batch = []
+        for yt_id in yt_ids:
+            batch.append((yt_id, tgt_type, self.PENDING))
+            if len(batch) >= batch_size:
+                num_added += self._insert(batch)
+                batch = []
+        if batch:
+            num_added += self._insert(batch)
+        return num_added
+
+    def _insert(self, batch):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO queue (yt_id, tgt_type, state) VALUES (?, ?, ?)", batch
+            )
+            return self._conn.total_changes - before
+
+    def reset(self, tgt_type, failed_skip_type=()):
+        """
+        Requeue the IDs left in progress by a killed run and the failed IDs worth retrying.
+        """
+        skip_types = sorted({*failed_skip_type, DownloadFailedInvalidId.keyword})
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE queue SET state = ? WHERE tgt_type = ? AND state = ?",
+                (self.PENDING, tgt_type, self.IN_PROGRESS),
+            )
+            self._conn.execute(
+                "UPDATE queue SET state = ?, keyword = NULL WHERE tgt_type = ? AND state = ?"
+                f" AND keyword NOT IN ({','.join('?' * len(skip_types))})",
+                (self.PENDING, tgt_type, self.FAILED, *skip_types),
+            )
+
+    def iter_pending(self, tgt_type, batch_size=256):
+        """
+        Yield pending IDs, marking them in progress batch by batch.
+        """
+        last_seq = -1
+        while True:
+            with self._lock, self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                rows = self._conn.execute(
+                    "SELECT seq, yt_id FROM queue WHERE tgt_type = ? AND state = ? AND seq > ?"
+                    " ORDER BY seq LIMIT ?",
+                    (tgt_type, self.PENDING, last_seq, batch_size),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE queue SET state = ? WHERE seq = ?",
+                    [(self.IN_PROGRESS, seq) for seq, _ in rows],
+                )
+            if not rows:
+                return
+            last_seq = rows[-1][0]
+            for _, yt_id in rows:
+                yield yt_id
+
+    def finish(self, yt_id, tgt_type, keyword=None):
+        """
+        Mark an ID as done, or as failed with `keyword`.
+        """
+        state = self.DONE if keyword is None else self.FAILED
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET state = ?, keyword = ? WHERE yt_id = ? AND tgt_type = ?",
+                (state, keyword, yt_id, tgt_type),
+            )
+
+    def counts(self, tgt_type=None):
+        """
+        Count the IDs by state.
+
+        Returns:
+            dict: {state: count}.
+        """
+        sql = "SELECT state, COUNT(*) FROM queue"
+        params = ()
+        if tgt_type is not None:
+            sql += " WHERE tgt_type = ?"
+            params = (tgt_type,)
+        with self._lock:
+            return dict(self._conn.execute(sql + " GROUP BY state", params).fetchall())
+
+    def compact(self):
+        """
+        Checkpoint the write-ahead log into the database and reclaim free pages.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
 
 
 def _get_save_dir(yt_id, db_root):
     return db_root / yt_id[0] / yt_id[1] / yt_id[2] / yt_id
 
 
+def _get_match_filter(min_duration=None, max_duration=None, filter=None):
+    """
+    Combine the duration limits and a yt-dlp match filter, e.g. "view_count > 100", into one
+    filter. Items without a duration pass the duration limits, except live streams, which fail
+    `max_duration` since they have no end.
+
+    Returns:
+        str: The filter, or None if there are no conditions.
+    """
+    conditions = []
+    if min_duration is not None:
+        conditions.append(f"duration >=? {min_duration:g}")
+    if max_duration is not None:
+        conditions.append(f"duration <=? {max_duration:g} & !is_live")
+    if filter:
+        conditions.append(filter)
+    return " & ".join(conditions) if conditions else None
+
+
 def _get_download_cmd(
-    tgt_type, yt_id, tmp_dir, cookies_file=None, request_interval=1, download_interval=1
+    tgt_type,
+    yt_id,
+    tmp_dir,
+    cookies_file=None,
+    request_interval=1,
+    download_interval=1,
+    match_filter=None,
 ):
     if tgt_type == "audio":
         cmd = [
@@ -240,10 +1008,193 @@ def _get_download_cmd(
 
     if cookies_file:
         cmd += ["--cookies", str(cookies_file)]
+    if match_filter:
+        # the filter is checked on the extracted metadata before the media is downloaded, and
+        # a rejected item makes yt-dlp exit with YT_DLP_FILTERED_EXIT_CODE
+        cmd += ["--break-match-filters", match_filter]
 
     return cmd
 
 
+def _run_yt_dlp(
+    yt_id,
+    tgt_type,
+    tmp_dir,
+    verbose=False,
+    cookies_file=None,
+    request_interval=1,
+    download_interval=1,
+    match_filter=None,
+):
+    cmd = _get_download_cmd(
+        tgt_type,
+        yt_id,
+        tmp_dir,
+        cookies_file=cookies_file,
+        request_interval=request_interval,
+        download_interval=download_interval,
+        match_filter=match_filter,
+    )
+    try:
+        subprocess.run(
+            cmd,
+            check=True,
+            stdout=subprocess.PIPE if not verbose else None,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except subprocess.CalledProcessError as e:
+        if verbose:
+            print(e)
+
+            if len(e.stderr) > 0:
+                print(f"[{yt_id}] stderr:")
+                print(e.stderr)
+
+        if match_filter and e.returncode == YT_DLP_FILTERED_EXIT_CODE:
+            raise DownloadFailedFiltered(yt_id) from None
+        raise _classify_failure(yt_id, e.stderr) from None
+
+
+def _classify_failure(yt_id, message):
+    """Map an error message of yt-dlp to a `DownloadFailed*` exception."""
+    if any(pattern in message.lower() for pattern in _RATE_LIMIT_MESSAGES):
+        return DownloadFailedRateLimited(yt_id)
+
+    last_line = message.strip().splitlines()[-1].lower() if message.strip() else ""
+    if "private" in last_line:
+        return DownloadFailedPrivate(yt_id)
+    elif "unavailable" in last_line or "available" in last_line:
+        return DownloadFailedUnavailable(yt_id)
+    elif "removed" in last_line:
+        return DownloadFailedRemoved(yt_id)
+    elif "copyright" in last_line:
+        return DownloadFailedCopyright(yt_id)
+    elif "unsupported" in last_line:
+        return DownloadFailedUnsupported(yt_id)
+    else:
+        return DownloadFailedOther(yt_id)
+
+
+class YtDlpBackend:
+    """
+    Download with `yt_dlp.YoutubeDL` in this process instead of a `yt-dlp` process per ID.
+
+    Each worker thread reuses its own `YoutubeDL`, so the interpreter start-up and the extractor
+    initialization are paid once per thread. Failures are classified from the exceptions of
+    yt-dlp rather than from its stderr.
+
+    Args:
+        cookies_file (Path, optional): Path to the cookies file. Defaults to None.
+        request_interval (float, optional): Interval between the requests of a download in
+            seconds. Defaults to 1.
+        verbose (bool, optional): Print the output of yt-dlp. Defaults to False.
+        match_filter (str, optional): yt-dlp match filter, see `_get_match_filter`. Items that
+            don't pass it fail with `DownloadFailedFiltered`. Defaults to None.
+    """
+
+    def __init__(self, cookies_file=None, request_interval=1, verbose=False, match_filter=None):
+        # fail early if yt-dlp isn't installed
+        _import_yt_dlp()
+
+        self.cookies_file = cookies_file
+        self.request_interval = request_interval
+        self.verbose = verbose
+        self.match_filter = match_filter
+        self._local = threading.local()
+
+    def _get_ydl(self, tgt_type):
+        ydls = getattr(self._local, "ydls", None)
+        if ydls is None:
+            ydls = self._local.ydls = {}
+        if tgt_type not in ydls:
+            from yt_dlp import YoutubeDL
+
+            params = {
+                "outtmpl": {"default": f"{tgt_type}.%(ext)s"},
+                "writeinfojson": True,
+                "sleep_interval_requests": self.request_interval,
+                "quiet": not self.verbose,
+                "no_warnings": not self.verbose,
+                "noprogress": not self.verbose,
+            }
+            if tgt_type == "audio":
+                params["format"] = "bestaudio"
+            elif tgt_type != "video":
+                raise ValueError(f"Invalid target type: {tgt_type}")
+            if self.cookies_file:
+                params["cookiefile"] = str(self.cookies_file)
+            if self.match_filter:
+                from yt_dlp.utils import match_filter_func
+
+                # raises RejectedVideoReached instead of skipping the item silently
+                params["match_filter"] = match_filter_func(None, [self.match_filter])
+            if not self.verbose:
+                # errors are reported through the raised exceptions
+                params["logger"] = _SilentLogger()
+            ydls[tgt_type] = YoutubeDL(params)
+        return ydls[tgt_type]
+
+    def download(self, yt_id, tgt_type, tmp_dir):
+        from yt_dlp.utils import DownloadError, RejectedVideoReached
+
+        ydl = self._get_ydl(tgt_type)
+        # output paths are read on every download, so the instance can be reused
+        ydl.params["paths"] = {"home": str(tmp_dir)}
+        try:
+            ydl.download([f"https://www.youtube.com/watch?v={yt_id}"])
+        except RejectedVideoReached:
+            raise DownloadFailedFiltered(yt_id) from None
+        except DownloadError as e:
+            raise _classify_yt_dlp_error(yt_id, e) from None
+
+
+class _SilentLogger:
+    def debug(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def error(self, message):
+        pass
+
+
+def _import_yt_dlp():
+    try:
+        import yt_dlp
+    except ImportError:
+        raise ImportError(
+            "yt_dlp is required for the embedded backend: pip install yt-dlp"
+        ) from None
+    return yt_dlp
+
+
+def _classify_yt_dlp_error(yt_id, error):
+    """Map a `yt_dlp.utils.DownloadError` to a `DownloadFailed*` exception."""
+    from yt_dlp.networking.exceptions import HTTPError
+    from yt_dlp.utils import ExtractorError, GeoRestrictedError, UnsupportedError
+
+    cause = error.exc_info[1] if error.exc_info else None
+    # follow the chain of causes, e.g. an ExtractorError caused by an HTTPError
+    seen = set()
+    message = str(error)
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        if isinstance(cause, HTTPError) and cause.status == 429:
+            return DownloadFailedRateLimited(yt_id)
+        if isinstance(cause, UnsupportedError):
+            return DownloadFailedUnsupported(yt_id)
+        if isinstance(cause, GeoRestrictedError):
+            return DownloadFailedUnavailable(yt_id)
+        if isinstance(cause, ExtractorError):
+            message = cause.orig_msg
+            cause = cause.cause or cause.__cause__ or cause.__context__
+        else:
+            cause = cause.__cause__ or cause.__context__
+    return _classify_failure(yt_id, message)
+
+
 def _download(
     yt_id,
     tgt_type,
@@ -252,6 +1203,12 @@ def _download(
     cookies_file=None,
     request_interval=1,
     download_interval=1,
+    index=None,
+    backend=None,
+    ingest=None,
+    info_fields=None,
+    compress_info=False,
+    match_filter=None,
 ):
     if len(yt_id) < 4:
         raise DownloadFailedInvalidId(yt_id)
@@ -260,30 +1217,29 @@ def _download(
     tmp_dir = tempfile.TemporaryDirectory()
     manifest_file = save_dir / "manifest.json"
 
-    manifest = {"files": {}}
-    if manifest_file.exists():
-        manifest = json.loads(manifest_file.read_text())
+    manifest = index.get_manifest(yt_id) if index is not None else None
+    if manifest is None:
+        manifest = {"files": {}}
+        if manifest_file.exists():
+            manifest = json.loads(manifest_file.read_text())
 
     try:
         if tgt_type in manifest["files"]:
             return yt_id
 
-        cmd = _get_download_cmd(
-            tgt_type,
-            yt_id,
-            tmp_dir,
-            cookies_file=cookies_file,
-            request_interval=request_interval,
-            download_interval=download_interval,
-        )
-
-        subprocess.run(
-            cmd,
-            check=True,
-            stdout=subprocess.PIPE if not verbose else None,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+        if backend is None:
+            _run_yt_dlp(
+                yt_id,
+                tgt_type,
+                tmp_dir,
+                verbose,
+                cookies_file=cookies_file,
+                request_interval=request_interval,
+                download_interval=download_interval,
+                match_filter=match_filter,
+            )
+        else:
+            backend.download(yt_id, tgt_type, Path(tmp_dir.name))
 
         files = list(Path(tmp_dir.name).glob("*"))
         assert len(files) == 2, str(files)
@@ -293,56 +1249,384 @@ def _download(
 
         save_dir.mkdir(exist_ok=True, parents=True)
         save_tgt_file = save_dir / f"{tgt_type}{tgt_file.suffix}"
-        save_info_file = save_dir / f"{tgt_type}_info.json"
 
         # clean existing files before moiving new files
         for existing_file in save_dir.glob(f"{tgt_type}*"):
             existing_file.unlink()
         shutil.move(tgt_file, save_tgt_file)
-        shutil.move(info_file, save_info_file)
+        save_info_file = _save_info(
+            info_file, save_dir, tgt_type, output_root_dir, info_fields, compress_info
+        )
 
         manifest["files"][tgt_type] = save_tgt_file.name
         manifest["files"][f"{tgt_type}_info"] = save_info_file.name
 
+        if ingest is not None and tgt_type == "audio":
+            try:
+                _ingest_audio(save_dir, manifest, tgt_type, *ingest)
+            except Exception as e:
+                # the download is kept, `ytdb ingest` can retry
+                print(f"[{yt_id}] Ingest failed: {type(e).__name__}: {e}", file=sys.stderr)
+
         _safely_write_manifest(manifest_file, manifest)
+        if index is not None:
+            index.update_item(yt_id, manifest, save_dir)
 
         return yt_id
 
-    except subprocess.CalledProcessError as e:
+    except BaseException as e:  # include non-typical exceptions like KeyboardInterrupt
         _clean_save_dir(save_dir)
+        raise e
 
-        if verbose:
-            print(e)
 
-            if len(e.stderr) > 0:
-                print(f"[{yt_id}] stderr:")
-                print(e.stderr)
+def _ingest_audio(item_dir, manifest, tgt_type="audio", fmt="flac", sr=22050):
+    """
+    Write a mono copy of the downloaded audio at `sr` in a format that is fast to decode, and
+    record it in the manifest as `<tgt_type>_<sr>`.
+
+    "flac" is 16-bit FLAC, and "npy" is float16 that `load_ingested_audio` memory-maps. The
+    source is decoded and resampled block by block.
+
+    Returns:
+        str: The manifest entry of the written file.
+    """
+    import numpy as np
+    import soundfile as sf
+
+    from .utils import stream_audio
 
-        last_line = e.stderr.strip().splitlines()[-1].lower()
-        if "private" in last_line:
-            raise DownloadFailedPrivate(yt_id)
-        elif "unavailable" in last_line or "available" in last_line:
-            raise DownloadFailedUnavailable(yt_id)
-        elif "removed" in last_line:
-            raise DownloadFailedRemoved(yt_id)
-        elif "copyright" in last_line:
-            raise DownloadFailedCopyright(yt_id)
-        elif "unsupported" in last_line:
-            raise DownloadFailedUnsupported(yt_id)
+    assert fmt in INGEST_FORMATS, f"Invalid ingest format: {fmt}"
+    name = f"{tgt_type}_{sr}"
+    file = item_dir / f"{name}.{fmt}"
+    tmp_file = item_dir / f".{name}.tmp.{fmt}"
+    blocks = stream_audio(item_dir / manifest["files"][tgt_type], sr=sr, mono=True)
+    try:
+        if fmt == "flac":
+            with sf.SoundFile(
+                tmp_file, "w", samplerate=sr, channels=1, format="FLAC", subtype="PCM_16"
+            ) as f:
+                for block, _ in blocks:
+                    f.write(np.clip(block, -1, 1))
         else:
-            raise DownloadFailedOther(yt_id)
+            np.save(tmp_file, np.concatenate([block.astype(np.float16) for block, _ in blocks]))
+        os.replace(tmp_file, file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
 
-    except BaseException as e:  # include non-typical exceptions like KeyboardInterrupt
-        _clean_save_dir(save_dir)
-        raise e
+    manifest["files"][name] = file.name
+    manifest.setdefault("ingest", {})[name] = {"sr": sr, "channels": 1, "format": fmt}
+    return name
+
+
+def load_ingested_audio(item_dir, name="audio_22050", manifest=None):
+    """
+    Load audio written by the ingest stage of `ytdb download --ingest` or `ytdb ingest`.
+
+    Args:
+        item_dir (Path): Directory of the item.
+        name (str, optional): Manifest entry, `<tgt_type>_<sr>`. Defaults to "audio_22050".
+        manifest (dict, optional): Manifest of the item. Defaults to None (read from the item).
+
+    Returns:
+        tuple: The waveform of shape (samples,), float32 for FLAC and a read-only float16 memory
+            map for npy, and the sample rate.
+    """
+    import numpy as np
+
+    item_dir = Path(item_dir)
+    if manifest is None:
+        manifest = json.loads((item_dir / "manifest.json").read_text())
+    file = item_dir / manifest["files"][name]
+    sr = manifest["ingest"][name]["sr"]
+    if file.suffix == ".npy":
+        return np.load(file, mmap_mode="r"), sr
+
+    import soundfile as sf
+
+    waveform, _ = sf.read(file, dtype="float32")
+    return waveform, sr
+
+
+def cmd_ingest(args):
+    count = _ingest_store(
+        args.root_dir, fmt=args.format, sr=args.sr, tgt_type=args.type, workers=args.workers
+    )
+    print(f"Ingested {count} items.")
+
+
+def _ingest_store(root_dir, fmt="flac", sr=22050, tgt_type="audio", workers=4):
+    """Ingest the downloaded items of a store that don't have `<tgt_type>_<sr>` yet."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = StoreIndex.open(root_dir)
+    name = f"{tgt_type}_{sr}"
+
+    def ingest_item(item_dir):
+        manifest_file = item_dir / "manifest.json"
+        try:
+            manifest = json.loads(manifest_file.read_text())
+        except (OSError, ValueError):
+            return False
+        if tgt_type not in manifest["files"] or name in manifest["files"]:
+            return False
+        try:
+            _ingest_audio(item_dir, manifest, tgt_type, fmt, sr)
+        except Exception as e:
+            print(f"[{item_dir.name}] Ingest failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return False
+        _safely_write_manifest(manifest_file, manifest)
+        if index is not None:
+            index.update_item(item_dir.name, manifest, item_dir)
+        return True
+
+    count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm() as pbar:
+            item_dirs = _iter_item_dirs(root_dir)
+            for future in _iter_completed(executor, ingest_item, item_dirs, 2 * workers):
+                count += future.result()
+                pbar.update(1)
+    finally:
+        if index is not None:
+            index.close()
+    return count
+
+
+def _save_info(info_file, item_dir, tgt_type, db_root, fields=None, compress=False):
+    """
+    Save the info JSON of a download as `<tgt_type>_info.json`, trimmed to `fields` if given, or
+    as `<tgt_type>_info.json.zst` if `compress`, see `load_info`.
+
+    Returns:
+        Path: The saved file.
+    """
+    save_file = item_dir / f"{tgt_type}_info.json"
+    if fields is None and not compress:
+        shutil.move(info_file, save_file)
+        return save_file
+
+    info = _trim_info(json.loads(Path(info_file).read_text()), fields)
+    data = json.dumps(info, separators=(",", ":")).encode()
+    if compress:
+        save_file = item_dir / f"{tgt_type}_info.json.zst"
+        data = _compress_info(data, db_root)
+    _safely_write_bytes(save_file, data)
+    return save_file
+
+
+def _trim_info(info, fields=None):
+    if fields is None:
+        return info
+    return {field: info[field] for field in fields if field in info}
+
+
+def load_info(item_dir, tgt_type="audio", manifest=None):
+    """
+    Load the yt-dlp info JSON of an item, plain or zstd-compressed.
+
+    Args:
+        item_dir (Path): Directory of the item.
+        tgt_type (str, optional): Type of the download. Defaults to "audio".
+        manifest (dict, optional): Manifest of the item. Defaults to None (read from the item).
+
+    Returns:
+        dict: The info, trimmed to the fields it was saved with.
+    """
+    item_dir = Path(item_dir)
+    if manifest is None:
+        manifest = json.loads((item_dir / "manifest.json").read_text())
+    info_file = item_dir / manifest["files"][f"{tgt_type}_info"]
+    data = info_file.read_bytes()
+    if info_file.suffix == ".zst":
+        # items are stored under `<db_root>/a/b/c/<yt_id>`
+        data = _decompress_info(data, item_dir.parents[3])
+    return json.loads(data)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstandard is required for zstd-compressed info files: pip install zstandard"
+        ) from None
+    return zstandard
+
+
+def _compress_info(data, db_root):
+    zstandard = _import_zstandard()
+
+    return zstandard.ZstdCompressor(
+        level=INFO_ZSTD_LEVEL, dict_data=_get_info_dict(db_root)
+    ).compress(data)
+
+
+def _decompress_info(data, db_root):
+    zstandard = _import_zstandard()
+
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    zdict = _load_info_dict(Path(db_root), dict_id) if dict_id else None
+    return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+
+
+def _get_info_dict(db_root):
+    """Get the dictionary trained by `ytdb info train`, or None."""
+    current_file = Path(db_root) / INFO_DICT_DIR / "current"
+    if not current_file.exists():
+        return None
+    return _load_info_dict(Path(db_root), int(current_file.read_text()))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_info_dict(db_root, dict_id):
+    zstandard = _import_zstandard()
+
+    data = (db_root / INFO_DICT_DIR / f"{dict_id}.zdict").read_bytes()
+    zdict = zstandard.ZstdCompressionDict(data)
+    zdict.precompute_compress(level=INFO_ZSTD_LEVEL)
+    return zdict
+
+
+def _train_info_dict(db_root, fields=None, num_samples=10000, dict_size=112640):
+    """
+    Train a zstd dictionary on the info JSON of up to `num_samples` items and make it the one new
+    info files are compressed with. Files compressed with earlier dictionaries remain readable.
+
+    Returns:
+        int: ID of the dictionary.
+    """
+    zstandard = _import_zstandard()
+
+    samples = []
+    for item_dir in _iter_item_dirs(db_root):
+        try:
+            manifest = json.loads((item_dir / "manifest.json").read_text())
+            for tgt_type in ["audio", "video"]:
+                if f"{tgt_type}_info" in manifest["files"]:
+                    info = _trim_info(load_info(item_dir, tgt_type, manifest), fields)
+                    samples.append(json.dumps(info, separators=(",", ":")).encode())
+        except (OSError, ValueError, KeyError):
+            continue
+        if len(samples) >= num_samples:
+            break
+    assert samples, f"No info files found in {db_root}"
+
+    zdict = zstandard.train_dictionary(dict_size, samples, level=INFO_ZSTD_LEVEL)
+    dict_dir = Path(db_root) / INFO_DICT_DIR
+    dict_dir.mkdir(exist_ok=True)
+    _safely_write_bytes(dict_dir / f"{zdict.dict_id()}.zdict", zdict.as_bytes())
+    _safely_write_text(dict_dir / "current", str(zdict.dict_id()))
+    return zdict.dict_id()
+
+
+def _compress_store_info(db_root, fields=None, workers=4):
+    """
+    Compress the plain info JSON of the items of a store, trimmed to `fields` if given.
+
+    Returns:
+        int: Number of compressed files.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = StoreIndex.open(db_root)
+
+    def compress_item(item_dir):
+        manifest_file = item_dir / "manifest.json"
+        try:
+            manifest = json.loads(manifest_file.read_text())
+        except (OSError, ValueError):
+            return 0
+        info_files = {}
+        for tgt_type in ["audio", "video"]:
+            file_name = manifest["files"].get(f"{tgt_type}_info")
+            if file_name is not None and file_name.endswith(".json"):
+                info_file = item_dir / file_name
+                save_file = _save_info(info_file, item_dir, tgt_type, db_root, fields, True)
+                manifest["files"][f"{tgt_type}_info"] = save_file.name
+                info_files[tgt_type] = info_file
+        if not info_files:
+            return 0
+        # record the compressed files before the plain ones are removed
+        _safely_write_manifest(manifest_file, manifest)
+        for info_file in info_files.values():
+            info_file.unlink()
+        if index is not None:
+            index.update_item(item_dir.name, manifest, item_dir)
+        return len(info_files)
+
+    count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm() as pbar:
+            item_dirs = _iter_item_dirs(db_root)
+            for future in _iter_completed(executor, compress_item, item_dirs, 2 * workers):
+                count += future.result()
+                pbar.update(1)
+    finally:
+        if index is not None:
+            index.close()
+    return count
+
+
+def _extract_metadata(item_dir, manifest):
+    """Read the `METADATA_FIELDS` of an item from its info JSON, or return None."""
+    for tgt_type in ["audio", "video"]:
+        if f"{tgt_type}_info" in manifest["files"]:
+            try:
+                info = load_info(item_dir, tgt_type, manifest)
+            except Exception:
+                return None  # broken items are reported by `sanity_check`
+            return tuple(info.get(field) for field in METADATA_FIELDS)
+    return None
+
+
+def _parse_info_fields(text):
+    if text is None:
+        return None
+    if text == "default":
+        return INFO_FIELDS
+    return text.split(",")
+
+
+def cmd_info_train(args):
+    dict_id = _train_info_dict(
+        args.root_dir,
+        fields=_parse_info_fields(args.fields),
+        num_samples=args.samples,
+        dict_size=args.dict_size,
+    )
+    print(f"Trained dictionary {dict_id}.")
+
+
+def cmd_info_compress(args):
+    count = _compress_store_info(
+        args.root_dir, fields=_parse_info_fields(args.fields), workers=args.workers
+    )
+    print(f"Compressed {count} info files.")
+
+
+def cmd_info_show(args):
+    item_dir = _get_save_dir(args.yt_id, args.root_dir)
+    print(json.dumps(load_info(item_dir, args.type), indent=2, ensure_ascii=False))
 
 
 def _safely_write_manifest(manifest_file, manifest, indent=2):
-    tmp_file = manifest_file.parent / f"{manifest_file.name}.tmp"
-    tmp_file.write_text(json.dumps(manifest, indent=indent))
-    if manifest_file.exists():
-        manifest_file.unlink()
-    shutil.move(tmp_file, manifest_file)
+    _safely_write_text(manifest_file, json.dumps(manifest, indent=indent))
+
+
+def _safely_write_text(file, text):
+    _safely_write_bytes(file, text.encode())
+
+
+def _safely_write_bytes(file, data):
+    # write to a temporary file first and atomically replace the target, so a crash never
+    # leaves a truncated file behind
+    tmp_file = file.parent / f"{file.name}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, file)
 
 
 def _clean_save_dir(save_dir):
@@ -366,71 +1650,844 @@ def _clean_save_dir(save_dir):
             file.unlink()
 
 
-def _check_download_dependencies():
+class StoreIndex:
+    """
+    SQLite index of a ytdb store, saved as `index.sqlite` at the store root.
+
+    It records the manifest, file sizes and mtimes of every item, the `METADATA_FIELDS` of its
+    info JSON and the failure status of failed downloads, so lookups don't need to walk the
+    directory tree or decompress the info files.
+    """
+
+    FILE_NAME = "index.sqlite"
+
+    def __init__(self, db_root):
+        import sqlite3
+
+        self.db_root = Path(db_root)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.db_root / self.FILE_NAME, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                yt_id TEXT PRIMARY KEY,
+                manifest TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                yt_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (yt_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS failures (
+                yt_id TEXT PRIMARY KEY,
+                keyword TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS metadata (
+                yt_id TEXT PRIMARY KEY,
+                title TEXT,
+                channel TEXT,
+                channel_id TEXT,
+                duration REAL,
+                upload_date TEXT,
+                view_count INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS metadata_duration ON metadata (duration);
+            CREATE INDEX IF NOT EXISTS metadata_channel ON metadata (channel);
+            """
+        )
+
+    @classmethod
+    def open(cls, db_root):
+        """Open the index of `db_root` if it exists, otherwise return None."""
+        if not (Path(db_root) / cls.FILE_NAME).exists():
+            return None
+        return cls(db_root)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_manifest(self, yt_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT manifest FROM items WHERE yt_id = ?", (yt_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_metadata(self, yt_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(METADATA_FIELDS)} FROM metadata WHERE yt_id = ?", (yt_id,)
+            ).fetchone()
+        return dict(zip(METADATA_FIELDS, row)) if row is not None else None
+
+    def update_item(self, yt_id, manifest, item_dir):
+        manifest_stat = (item_dir / "manifest.json").stat()
+        file_rows = []
+        for name, file_name in manifest["files"].items():
+            file_stat = (item_dir / file_name).stat()
+            file_rows.append((yt_id, name, file_name, file_stat.st_size, file_stat.st_mtime_ns))
+        metadata = _extract_metadata(item_dir, manifest)
+
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._replace_item(yt_id, manifest, manifest_stat.st_mtime_ns, file_rows, metadata)
+
+    def _replace_item(self, yt_id, manifest, mtime_ns, file_rows, metadata=None):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+            (yt_id, json.dumps(manifest), mtime_ns),
+        )
+        self._conn.execute("DELETE FROM files WHERE yt_id = ?", (yt_id,))
+        self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", file_rows)
+        self._conn.execute("DELETE FROM metadata WHERE yt_id = ?", (yt_id,))
+        if metadata is not None:
+            self._conn.execute(
+                "INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)", (yt_id, *metadata)
+            )
+
+    def set_failure(self, yt_id, keyword):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO failures VALUES (?, ?)", (yt_id, keyword))
+
+    def get_failure(self, yt_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT keyword FROM failures WHERE yt_id = ?", (yt_id,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def rebuild(self, failed_file=None, batch_size=10000):
+        """
+        Rebuild the index from the directory tree of the store.
+
+        Args:
+            failed_file (Path, optional): File of failed downloads to import. Defaults to None.
+            batch_size (int, optional): Number of items committed per transaction. Defaults to 10000.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM items")
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM failures")
+            self._conn.execute("DELETE FROM metadata")
+
+        count = 0
+        batch = []
+        for item_dir in tqdm(_iter_item_dirs(self.db_root), desc="Indexing"):
+            manifest_file = item_dir / "manifest.json"
+            try:
+                manifest = json.loads(manifest_file.read_text())
+                file_rows = []
+                for name, file_name in manifest["files"].items():
+                    file_stat = (item_dir / file_name).stat()
+                    file_rows.append(
+                        (item_dir.name, name, file_name, file_stat.st_size, file_stat.st_mtime_ns)
+                    )
+                mtime_ns = manifest_file.stat().st_mtime_ns
+            except (OSError, ValueError, KeyError):
+                continue  # broken items are reported by `sanity_check`
+            metadata = _extract_metadata(item_dir, manifest)
+            batch.append((item_dir.name, manifest, mtime_ns, file_rows, metadata))
+            if len(batch) >= batch_size:
+                count += self._insert_items(batch)
+                batch = []
+        count += self._insert_items(batch)
+
+        if failed_file is not None and failed_file.exists():
+            rows = [line.split() for line in failed_file.read_text().strip().splitlines()]
+            with self._lock, self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT OR REPLACE INTO failures VALUES (?, ?)", rows)
+
+        return count
+
+    def _insert_items(self, batch):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for yt_id, manifest, mtime_ns, file_rows, metadata in batch:
+                self._replace_item(yt_id, manifest, mtime_ns, file_rows, metadata)
+        return len(batch)
+
+    def query(
+        self,
+        yt_ids=None,
+        tgt_type=None,
+        failed=None,
+        min_duration=None,
+        max_duration=None,
+        channel=None,
+    ):
+        """
+        Query indexed items.
+
+        Args:
+            yt_ids (list, optional): Only return these IDs. Defaults to None.
+            tgt_type (str, optional): Only return items that have this type downloaded. Defaults to None.
+            failed (str, optional): Only return failed IDs with this keyword ("any" for all). Defaults to None.
+            min_duration (float, optional): Only return items at least this long in seconds. Defaults to None.
+            max_duration (float, optional): Only return items at most this long in seconds. Defaults to None.
+            channel (str, optional): Only return items of this channel. Defaults to None.
+
+        Returns:
+            generator: Dictionaries with keys "yt_id", "files", "failed" and "metadata".
+        """
+        if failed is not None:
+            sql = "SELECT failures.yt_id FROM failures"
+            conds, params = [], []
+            if failed != "any":
+                conds.append("keyword = ?")
+                params.append(failed)
+        else:
+            sql = "SELECT items.yt_id FROM items"
+            conds, params = [], []
+            if tgt_type is not None:
+                sql += " JOIN files ON files.yt_id = items.yt_id AND files.name = ?"
+                params.append(tgt_type)
+            if min_duration is not None or max_duration is not None or channel is not None:
+                sql += " JOIN metadata ON metadata.yt_id = items.yt_id"
+                if min_duration is not None:
+                    conds.append("duration >= ?")
+                    params.append(min_duration)
+                if max_duration is not None:
+                    conds.append("duration <= ?")
+                    params.append(max_duration)
+                if channel is not None:
+                    conds.append("channel = ?")
+                    params.append(channel)
+        if yt_ids:
+            table = "failures" if failed is not None else "items"
+            conds.append(f"{table}.yt_id IN ({','.join('?' * len(yt_ids))})")
+            params.extend(yt_ids)
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+
+        with self._lock:
+            found = [row[0] for row in self._conn.execute(sql, params)]
+        for yt_id in found:
+            yield {
+                "yt_id": yt_id,
+                "files": self.get_files(yt_id),
+                "failed": self.get_failure(yt_id),
+                "metadata": self.get_metadata(yt_id),
+            }
+
+    def get_files(self, yt_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, file_name, size, mtime_ns FROM files WHERE yt_id = ?", (yt_id,)
+            ).fetchall()
+        return {
+            name: {"file": file_name, "size": size, "mtime_ns": mtime_ns}
+            for name, file_name, size, mtime_ns in rows
+        }
+
+    def iter_files(self):
+        with self._lock:
+            yield from self._conn.execute(
+                "SELECT yt_id, file_name, size, mtime_ns FROM files ORDER BY yt_id"
+            )
+
+    def remove_item(self, yt_id):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM items WHERE yt_id = ?", (yt_id,))
+            self._conn.execute("DELETE FROM files WHERE yt_id = ?", (yt_id,))
+            self._conn.execute("DELETE FROM metadata WHERE yt_id = ?", (yt_id,))
+
+
+class PackedStore:
+    """
+    Items of a ytdb store packed into large append-only tar shards, read sequentially or by ID.
+
+    Each item is stored as consecutive members `<yt_id>.<file name>` of a shard, its manifest
+    included (the WebDataset layout). `pack.sqlite` next to the shards records the offset and size
+    of every member, and the length of each shard up to its last committed item. A shard is
+    truncated to that length before new items are appended, so an interrupted `ytdb pack` leaves
+    no partial items behind.
+
+    Args:
+        pack_dir (Path): Directory of the shards, `.packed` under the store root by default.
+        shard_size (int, optional): Size in bytes after which a new shard is started. Defaults to
+            1 GiB.
+    """
+
+    INDEX_NAME = "pack.sqlite"
+    DIR_NAME = ".packed"
+
+    def __init__(self, pack_dir, shard_size=DEFAULT_SHARD_SIZE):
+        import sqlite3
+
+        self.pack_dir = Path(pack_dir)
+        self.pack_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.pack_dir / self.INDEX_NAME, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS shards (
+                shard INTEGER PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                yt_id TEXT PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                manifest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                yt_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (yt_id, name)
+            );
+            """
+        )
+        self._fds = {}
+        self._writer = None  # (shard, file, TarFile)
+        self._pending = []
+
+    @classmethod
+    def open(cls, db_root):
+        """Open the packed store of `db_root` if it exists, otherwise return None."""
+        pack_dir = Path(db_root) / cls.DIR_NAME
+        if not (pack_dir / cls.INDEX_NAME).exists():
+            return None
+        return cls(pack_dir)
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+            self._conn.close()
+
+    def __contains__(self, yt_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM items WHERE yt_id = ?", (yt_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def get_manifest(self, yt_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT manifest FROM items WHERE yt_id = ?", (yt_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def locate(self, yt_id, name):
+        """
+        Find a file of an item, e.g. to memory-map it.
+
+        Args:
+            yt_id (str): YouTube ID.
+            name (str): Manifest entry of the file, e.g. "audio", or "manifest".
+
+        Returns:
+            tuple: Path of the shard, offset and size of the file in bytes.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT shards.file_name, offset, size FROM members"
+                " JOIN shards ON members.shard = shards.shard"
+                " WHERE yt_id = ? AND name = ?",
+                (yt_id, name),
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"{yt_id} has no packed file {name}")
+        return self.pack_dir / row[0], row[1], row[2]
+
+    def read(self, yt_id, name):
+        """
+        Read a file of an item, see `locate`.
+
+        Returns:
+            bytes: Content of the file.
+        """
+        shard_file, offset, size = self.locate(yt_id, name)
+        with self._lock:
+            fd = self._fds.get(shard_file)
+            if fd is None:
+                fd = self._fds[shard_file] = os.open(shard_file, os.O_RDONLY)
+        return os.pread(fd, size, offset)
+
+    def iter_items(self):
+        """
+        Read all items in the order they are stored.
+
+        Yields:
+            tuple: YouTube ID, manifest, and {name: bytes} of the files of each item.
+        """
+        with self._lock:
+            shards = self._conn.execute("SELECT shard, file_name FROM shards ORDER BY shard")
+            shards = shards.fetchall()
+        for shard, file_name in shards:
+            with self._lock:
+                # members of items that were never committed are skipped
+                rows = self._conn.execute(
+                    "SELECT members.yt_id, name, offset, size FROM members"
+                    " JOIN items ON items.yt_id = members.yt_id AND items.shard = members.shard"
+                    " WHERE members.shard = ? ORDER BY offset",
+                    (shard,),
+                ).fetchall()
+            with open(self.pack_dir / file_name, "rb") as f:
+                yt_id, files = None, {}
+                for member_id, name, offset, size in rows:
+                    if member_id != yt_id and yt_id is not None:
+                        yield yt_id, json.loads(files.pop("manifest")), files
+                        files = {}
+                    yt_id = member_id
+                    f.seek(offset)
+                    files[name] = f.read(size)
+                if yt_id is not None:
+                    yield yt_id, json.loads(files.pop("manifest")), files
+
+    def add(self, yt_id, item_dir, manifest):
+        """
+        Append an item directory to the last shard. The item is visible after `flush`.
+
+        Every file of the item is checked before anything is written, and a failed write is
+        rolled back, so a broken item leaves no members behind.
+        """
+        import tarfile
+
+        # raises before anything is written if a file is missing
+        members = [("manifest", "manifest.json", json.dumps(manifest).encode(), None)]
+        for name, file_name in manifest["files"].items():
+            path = Path(item_dir) / file_name
+            members.append((name, file_name, path, path.stat()))
+
+        with self._lock:
+            shard, f, tar = self._get_writer()
+            start, num_pending = tar.offset, len(self._pending)
+            try:
+                for name, file_name, data, stat in members:
+                    info = tarfile.TarInfo(f"{yt_id}.{file_name}")
+                    if stat is not None:
+                        info.size = stat.st_size
+                        info.mtime = int(stat.st_mtime)
+                        with open(data, "rb") as file:
+                            tar.addfile(info, file)
+                    else:
+                        info.size = len(data)
+                        info.mtime = int(time.time())
+                        tar.addfile(info, io.BytesIO(data))
+                    # members are padded to 512-byte blocks
+                    offset = tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                    self._pending.append(("member", (yt_id, name, shard, offset, info.size)))
+            except BaseException:
+                # e.g. a file that shrank since it was checked
+                del self._pending[num_pending:]
+                f.seek(start)
+                f.truncate(start)
+                tar.offset = start
+                raise
+            self._pending.append(("item", (yt_id, shard, json.dumps(manifest))))
+            if tar.offset >= self.shard_size:
+                self.flush()
+                self._close_writer()
+
+    def flush(self):
+        """
+        Sync the appended items to disk and commit them to the index.
+        """
+        with self._lock:
+            if self._writer is None:
+                return
+            shard, f, tar = self._writer
+            f.flush()
+            os.fsync(f.fileno())
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)",
+                    [row for kind, row in self._pending if kind == "member"],
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+                    [row for kind, row in self._pending if kind == "item"],
+                )
+                self._conn.execute(
+                    "UPDATE shards SET length = ? WHERE shard = ?", (tar.offset, shard)
+                )
+            self._pending = []
+
+    def _get_writer(self):
+        import tarfile
+
+        if self._writer is not None:
+            return self._writer
+        row = self._conn.execute(
+            "SELECT shard, file_name, length FROM shards ORDER BY shard DESC LIMIT 1"
+        ).fetchone()
+        if row is None or row[2] >= self.shard_size:
+            shard = 0 if row is None else row[0] + 1
+            file_name, length = f"shard-{shard:06d}.tar", 0
+            self._conn.execute("INSERT INTO shards VALUES (?, ?, ?)", (shard, file_name, length))
+        else:
+            shard, file_name, length = row
+
+        shard_file = self.pack_dir / file_name
+        shard_file.touch(exist_ok=True)
+        # kept open until `_close_writer`
+        f = open(shard_file, "r+b")  # noqa: SIM115
+        # drop the end-of-archive blocks and anything not committed
+        f.truncate(length)
+        f.seek(length)
+        tar = tarfile.open(fileobj=f, mode="w", format=tarfile.PAX_FORMAT)  # noqa: SIM115
+        self._writer = (shard, f, tar)
+        return self._writer
+
+    def _close_writer(self):
+        if self._writer is None:
+            return
+        self.flush()
+        _, f, tar = self._writer
+        tar.close()  # appends the end-of-archive blocks, so the shard is a valid tar file
+        f.close()
+        self._writer = None
+
+
+def _pack_store(
+    root_dir, pack_dir=None, shard_size=DEFAULT_SHARD_SIZE, delete=False, batch_size=1000
+):
+    """
+    Pack the items of a store that aren't packed yet.
+
+    Args:
+        root_dir (Path): Root of the store.
+        pack_dir (Path, optional): Directory of the shards. Defaults to `.packed` under `root_dir`.
+        shard_size (int, optional): Size in bytes after which a new shard is started.
+        delete (bool, optional): Delete the item directories once they are packed. Defaults to False.
+        batch_size (int, optional): Number of items synced and committed at once. Defaults to 1000.
+
+    Returns:
+        int: Number of packed items.
+    """
+    if pack_dir is None:
+        pack_dir = Path(root_dir) / PackedStore.DIR_NAME
+    store = PackedStore(pack_dir, shard_size=shard_size)
+    index = StoreIndex.open(root_dir)
+    packed = []
+
+    def commit():
+        store.flush()
+        if delete:
+            for item_dir in packed:
+                shutil.rmtree(item_dir)
+                if index is not None:
+                    index.remove_item(item_dir.name)
+        packed.clear()
+
+    count = 0
+    try:
+        for item_dir in tqdm(_iter_item_dirs(root_dir), desc="Packing"):
+            if item_dir.name in store:
+                if delete:  # packed by an earlier run
+                    packed.append(item_dir)
+                continue
+            try:
+                manifest = json.loads((item_dir / "manifest.json").read_text())
+                store.add(item_dir.name, item_dir, manifest)
+            except (OSError, ValueError, KeyError) as e:
+                # broken items are reported by `sanity_check`
+                print(f"[{item_dir.name}] Not packed: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            packed.append(item_dir)
+            count += 1
+            if len(packed) >= batch_size:
+                commit()
+        commit()
+    finally:
+        store.close()
+        if index is not None:
+            index.close()
+    return count
+
+
+def cmd_pack(args):
+    count = _pack_store(
+        args.root_dir,
+        pack_dir=args.pack_dir,
+        shard_size=int(args.shard_size_mb * 2**20),
+        delete=args.delete,
+    )
+    print(f"Packed {count} items.")
+
+
+def _check_download_dependencies(backend="subprocess", compress_info=False):
     # check yt-dlp is installed
     try:
         print("Checking yt-dlp version ... ", end="")
-        subprocess.run("yt-dlp --version", shell=True, check=True, stdout=subprocess.PIPE)
+        if backend == "embedded":
+            _import_yt_dlp()
+        else:
+            subprocess.run(["yt-dlp", "--version"], check=True, stdout=subprocess.PIPE)
         print("Done.")
-    except subprocess.CalledProcessError:
-        print("yt-dlp is not installed. Please install it first.")
+    except (OSError, ImportError, subprocess.CalledProcessError):
+        print("yt-dlp is not installed. Please install it first: pip install yt-dlp")
         exit(1)
 
+    if compress_info:
+        try:
+            _import_zstandard()
+        except ImportError as e:
+            print(e)
+            exit(1)
+
     # check ffmpeg is installed
     try:
         print("Checking ffmpeg version ... ", end="")
-        subprocess.run("ffmpeg -version", shell=True, check=True, stdout=subprocess.PIPE)
+        subprocess.run(["ffmpeg", "-version"], check=True, stdout=subprocess.PIPE)
         print("Done.")
-    except subprocess.CalledProcessError:
+    except (OSError, subprocess.CalledProcessError):
         print("ffmpeg is not installed. Please install it first.")
         exit(1)
 
 
 def cmd_sanity_check(args):
-    _sanity_check(args.root_dir)
+    if args.index:
+        _sanity_check_index(args.root_dir, output_file=args.output)
+    else:
+        _sanity_check(
+            args.root_dir,
+            output_file=args.output,
+            workers=args.workers,
+            checkpoint_file=args.checkpoint,
+            full=args.full,
+        )
 
 
-def _sanity_check(root_dir):
-    weird_yt_ids = []
-    item_dirs = []
+def _iter_item_dirs(root_dir):
+    for shard_dir in _iter_shard_dirs(root_dir):
+        with os.scandir(shard_dir) as it:
+            for entry in it:
+                yield Path(entry.path)
+
+
+def _iter_shard_dirs(root_dir):
+    """Yield the `yt_id[0]/yt_id[1]/yt_id[2]` directories of the store."""
+    with os.scandir(root_dir) as l1_it:
+        for l1_entry in l1_it:
+            # skip files and hidden directories at the store root, e.g. the index and the shards
+            if not l1_entry.is_dir() or l1_entry.name.startswith("."):
+                continue
+            with os.scandir(l1_entry.path) as l2_it:
+                for l2_entry in l2_it:
+                    with os.scandir(l2_entry.path) as l3_it:
+                        for l3_entry in l3_it:
+                            yield l3_entry.path
+
+
+def _sanity_check(
+    root_dir,
+    output_file=Path("weird_yt_ids.txt"),
+    workers=None,
+    checkpoint_file=None,
+    checkpoint_interval=1000,
+    full=False,
+):
+    """
+    Check every item of the store across a process pool.
+
+    The mtime signature and the weird IDs of each shard are saved to `checkpoint_file`, so the
+    shards that haven't changed since the last run are not checked again.
+
+    Args:
+        root_dir (Path): Root of the store.
+        output_file (Path, optional): File to write the weird IDs to. Defaults to "weird_yt_ids.txt".
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        checkpoint_file (Path, optional): Checkpoint file. Defaults to ".sanity_check.json" under `root_dir`.
+        checkpoint_interval (int, optional): Number of checked shards between checkpoints. Defaults to 1000.
+        full (bool, optional): Ignore the checkpoint and check every shard. Defaults to False.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if checkpoint_file is None:
+        checkpoint_file = root_dir / ".sanity_check.json"
+
+    shards = {}
+    if checkpoint_file.exists() and not full:
+        shards = json.loads(checkpoint_file.read_text())["shards"]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    checked = {}
+    num_skipped = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(unit="shard") as pbar:
+        shard_args = (
+            (shard_dir, shards.get(os.path.relpath(shard_dir, root_dir)))
+            for shard_dir in _iter_shard_dirs(root_dir)
+        )
+        for future in _iter_completed(executor, _check_shard, shard_args, 4 * workers):
+            shard_dir, state, skipped = future.result()
+            checked[os.path.relpath(shard_dir, root_dir)] = state
+            num_skipped += skipped
+            pbar.update(1)
+            if len(checked) % checkpoint_interval == 0:
+                _safely_write_text(checkpoint_file, json.dumps({"shards": {**shards, **checked}}))
+
+    # shards removed since the last run are dropped here
+    _safely_write_text(checkpoint_file, json.dumps({"shards": checked}))
+
+    weird_yt_ids = sorted(yt_id for state in checked.values() for yt_id in state["weird"])
+    if len(weird_yt_ids) > 0:
+        _safely_write_text(output_file, "\n".join(weird_yt_ids))
+    print(f"Checked {len(checked) - num_skipped} shards, {num_skipped} unchanged shards skipped.")
+    print(f"Found {len(weird_yt_ids)} weird yt_ids.")
 
-    for l1_dir in root_dir.iterdir():
-        for l2_dir in l1_dir.iterdir():
-            for l3_dir in l2_dir.iterdir():
-                for item_dir in l3_dir.iterdir():
-                    item_dirs.append(item_dir)
 
-    for item_dir in tqdm(item_dirs):
-        manifest_file = item_dir / "manifest.json"
-        yt_id = item_dir.name
+def _check_shard(args):
+    shard_dir, prev_state = args
 
+    # Adding or removing an item touches the shard directory, and rewriting a manifest or any
+    # file of an item touches the item directory, so together they tell if anything changed.
+    signature = os.stat(shard_dir).st_mtime_ns
+    item_entries = []
+    with os.scandir(shard_dir) as it:
+        for entry in it:
+            signature = max(signature, entry.stat(follow_symlinks=False).st_mtime_ns)
+            item_entries.append(entry)
+
+    if prev_state is not None and prev_state["signature"] == signature:
+        return shard_dir, prev_state, True
+
+    weird_yt_ids = []
+    for entry in item_entries:
         try:
-            # 1. Check if manifest.json exists
-            if not manifest_file.exists():
-                raise WeirdYtIdException(yt_id)
+            _check_item_dir(entry)
+        except WeirdYtIdException as e:
+            weird_yt_ids.append(e.yt_id)
+    return shard_dir, {"signature": signature, "weird": weird_yt_ids}, False
 
-            manifest = json.loads(manifest_file.read_text())
 
-            # 2. Check if files exist
-            for file in manifest["files"]:
-                if not (item_dir / manifest["files"][file]).exists():
-                    raise WeirdYtIdException(yt_id)
+def _check_item_dir(entry):
+    yt_id = entry.name
+    if not entry.is_dir(follow_symlinks=False):
+        raise WeirdYtIdException(yt_id)
 
-            # 3. Check all files are in manifest.json
-            for file in item_dir.iterdir():
-                if file == manifest_file:
-                    continue
-                if file.name not in manifest["files"].values():
-                    raise WeirdYtIdException(yt_id)
+    try:
+        with os.scandir(entry.path) as it:
+            file_names = {file_entry.name for file_entry in it}
+    except OSError:
+        raise WeirdYtIdException(yt_id)
 
-        except WeirdYtIdException as e:
-            weird_yt_ids.append(e.yt_id)
+    # 1. Check if manifest.json exists
+    if "manifest.json" not in file_names:
+        raise WeirdYtIdException(yt_id)
+
+    # a manifest that can't be read or isn't shaped as {"files": {name: file}} is weird too
+    try:
+        with open(os.path.join(entry.path, "manifest.json")) as f:
+            recorded_files = set(json.load(f)["files"].values())
+    except (OSError, ValueError, KeyError, AttributeError, TypeError):
+        raise WeirdYtIdException(yt_id)
+
+    # 2. Check if files exist
+    if not recorded_files <= file_names:
+        raise WeirdYtIdException(yt_id)
+
+    # 3. Check all files are in manifest.json
+    if file_names - recorded_files - {"manifest.json"}:
+        raise WeirdYtIdException(yt_id)
+
+
+def _sanity_check_index(root_dir, output_file=Path("weird_yt_ids.txt")):
+    """Check the indexed files against their recorded sizes and mtimes without walking the store."""
+    index = StoreIndex.open(root_dir)
+    assert index is not None, f"Index not found in {root_dir}. Run `ytdb index rebuild` first."
+
+    weird_yt_ids = []
+    try:
+        for yt_id, file_name, size, mtime_ns in tqdm(index.iter_files()):
+            if weird_yt_ids and weird_yt_ids[-1] == yt_id:
+                continue
+            try:
+                file_stat = (_get_save_dir(yt_id, root_dir) / file_name).stat()
+            except FileNotFoundError:
+                weird_yt_ids.append(yt_id)
+                continue
+            if file_stat.st_size != size or file_stat.st_mtime_ns != mtime_ns:
+                weird_yt_ids.append(yt_id)
+    finally:
+        index.close()
 
     if len(weird_yt_ids) > 0:
-        Path("weird_yt_ids.txt").write_text("\n".join(weird_yt_ids))
+        _safely_write_text(output_file, "\n".join(weird_yt_ids))
     print(f"Found {len(weird_yt_ids)} weird yt_ids.")
 
 
+def cmd_index_rebuild(args):
+    index = StoreIndex(args.root_dir)
+    try:
+        count = index.rebuild(failed_file=args.failed_file)
+    finally:
+        index.close()
+    print(f"Indexed {count} items.")
+
+
+def cmd_index_query(args):
+    index = StoreIndex.open(args.root_dir)
+    assert index is not None, f"Index not found in {args.root_dir}. Run `ytdb index rebuild` first."
+    try:
+        results = index.query(
+            yt_ids=args.ids,
+            tgt_type=args.type,
+            failed=args.failed,
+            min_duration=args.min_duration,
+            max_duration=args.max_duration,
+            channel=args.channel,
+        )
+        if args.count:
+            print(sum(1 for _ in results))
+        else:
+            for result in results:
+                print(json.dumps(result))
+    finally:
+        index.close()
+
+
+def cmd_queue_status(args):
+    queue = DownloadQueue(args.queue_file)
+    try:
+        counts = queue.counts(args.type)
+    finally:
+        queue.close()
+    for state in [
+        DownloadQueue.PENDING,
+        DownloadQueue.IN_PROGRESS,
+        DownloadQueue.DONE,
+        DownloadQueue.FAILED,
+    ]:
+        print(f"{state}: {counts.get(state, 0)}")
+
+
+def cmd_queue_compact(args):
+    queue = DownloadQueue(args.queue_file)
+    try:
+        queue.compact()
+    finally:
+        queue.close()
+    if args.failed_file is not None:
+        FailureLog(args.failed_file).compact()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="YouTube Database Utility",
@@ -466,11 +2523,12 @@ def main():
     download_parser.add_argument(
         "--failed_skip_type",
         type=str,
-        default=(  # default: "private,removed,unavailable,unsupported"
+        default=(  # default: "private,removed,unavailable,unsupported,filtered"
             f"{DownloadFailedPrivate.keyword},"
             f"{DownloadFailedRemoved.keyword},"
             f"{DownloadFailedUnavailable.keyword},"
-            f"{DownloadFailedUnsupported.keyword}"
+            f"{DownloadFailedUnsupported.keyword},"
+            f"{DownloadFailedFiltered.keyword}"
         ),
         help="Type of failed downloads to skip. Separated by comma(,)",
     )
@@ -480,7 +2538,68 @@ def main():
         "--request_interval", type=int, default=1, help="Request interval in seconds"
     )
     download_parser.add_argument(
-        "--download_interval", type=int, default=1, help="Download interval in seconds"
+        "--download_interval",
+        type=float,
+        default=1,
+        help="Initial interval between the downloads of each job in seconds. 0 starts unlimited. "
+        "The rate is adapted to throttling",
+    )
+    download_parser.add_argument(
+        "--max_rate", type=float, help="Maximum number of downloads started per second"
+    )
+    download_parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries of rate-limited and other failures, with exponential backoff",
+    )
+    download_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of concurrent downloads. The request interval is applied to each job",
+    )
+    download_parser.add_argument(
+        "--backend",
+        choices=["subprocess", "embedded"],
+        default="subprocess",
+        help="Run a yt-dlp process per ID, or reuse yt_dlp.YoutubeDL in process for each job",
+    )
+    download_parser.add_argument(
+        "--ingest",
+        choices=INGEST_FORMATS,
+        help="Also save the audio as mono FLAC or float16 npy at --ingest_sr, see `ytdb ingest`",
+    )
+    download_parser.add_argument(
+        "--ingest_sr", type=int, default=22050, help="Sample rate of the ingested audio"
+    )
+    download_parser.add_argument(
+        "--min_duration", type=float, help="Skip items shorter than this in seconds"
+    )
+    download_parser.add_argument(
+        "--max_duration",
+        type=float,
+        help="Skip items longer than this in seconds, and live streams. Items without a "
+        "duration are downloaded",
+    )
+    download_parser.add_argument(
+        "--filter",
+        type=str,
+        help='yt-dlp match filter on the metadata, e.g. "!is_live & view_count >? 1000". Items '
+        'are checked before the media is downloaded, and skipped ones are recorded as "filtered" '
+        "in the failed file. Remove filtered from --failed_skip_type to check them again",
+    )
+    download_parser.add_argument("--info_fields", type=str, help=INFO_FIELDS_HELP)
+    download_parser.add_argument(
+        "--compress_info",
+        action="store_true",
+        help="Save the info JSON compressed with zstd, see `ytdb info train`",
+    )
+    download_parser.add_argument(
+        "--queue",
+        type=Path,
+        help="SQLite queue of download states. A killed download resumes from it",
     )
 
     # Sanity check subcommand
@@ -491,6 +2610,187 @@ def main():
     )
     sanity_check_parser.set_defaults(func=cmd_sanity_check)
     sanity_check_parser.add_argument("root_dir", type=Path, help="Path to the directory to check")
+    sanity_check_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("weird_yt_ids.txt"),
+        help="File to write the weird IDs to",
+    )
+    sanity_check_parser.add_argument(
+        "-j", "--workers", type=int, help="Number of worker processes. Defaults to the CPU count"
+    )
+    sanity_check_parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="Checkpoint file of checked shards. Defaults to .sanity_check.json under root_dir",
+    )
+    sanity_check_parser.add_argument(
+        "--full", action="store_true", help="Ignore the checkpoint and check every shard"
+    )
+    sanity_check_parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Check the files recorded in the store index instead of walking the directory",
+    )
+
+    # Ingest subcommand
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help="Save the downloaded audio as mono FLAC or float16 npy for fast loading",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ingest_parser.set_defaults(func=cmd_ingest)
+    ingest_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    ingest_parser.add_argument(
+        "-f", "--format", choices=INGEST_FORMATS, default="flac", help="Format of the copy"
+    )
+    ingest_parser.add_argument("--sr", type=int, default=22050, help="Sample rate of the copy")
+    ingest_parser.add_argument(
+        "-t", "--type", choices=["audio"], default="audio", help="Type of the download to ingest"
+    )
+    ingest_parser.add_argument(
+        "-j", "--workers", type=int, default=4, help="Number of decoding threads"
+    )
+
+    # Pack subcommand
+    pack_parser = subparsers.add_parser(
+        "pack",
+        help="Pack the items of a saved directory into tar shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    pack_parser.set_defaults(func=cmd_pack)
+    pack_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    pack_parser.add_argument(
+        "--pack_dir", type=Path, help="Directory of the shards. Defaults to .packed under root_dir"
+    )
+    pack_parser.add_argument(
+        "--shard_size_mb", type=float, default=1024, help="Size of each shard in MiB"
+    )
+    pack_parser.add_argument(
+        "--delete", action="store_true", help="Delete the item directories once they are packed"
+    )
+
+    # Index subcommand
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Manage the SQLite index of a saved directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    index_subparsers = index_parser.add_subparsers(dest="index_command", required=True)
+
+    index_rebuild_parser = index_subparsers.add_parser(
+        "rebuild",
+        help="Rebuild the index from the directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    index_rebuild_parser.set_defaults(func=cmd_index_rebuild)
+    index_rebuild_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    index_rebuild_parser.add_argument(
+        "--failed_file", type=Path, help="File of failed downloads to import into the index"
+    )
+
+    index_query_parser = index_subparsers.add_parser(
+        "query",
+        help="Query the index",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    index_query_parser.set_defaults(func=cmd_index_query)
+    index_query_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    index_query_parser.add_argument("ids", nargs="*", help="YouTube IDs to look up")
+    index_query_parser.add_argument(
+        "-t", "--type", choices=["audio", "video"], help="Only items with this type downloaded"
+    )
+    index_query_parser.add_argument(
+        "--failed", type=str, help='Only failed IDs with this keyword ("any" for all failures)'
+    )
+    index_query_parser.add_argument(
+        "--min_duration", type=float, help="Only items at least this long in seconds"
+    )
+    index_query_parser.add_argument(
+        "--max_duration", type=float, help="Only items at most this long in seconds"
+    )
+    index_query_parser.add_argument("--channel", type=str, help="Only items of this channel")
+    index_query_parser.add_argument(
+        "--count", action="store_true", help="Print the number of results only"
+    )
+
+    # Info subcommand
+    info_parser = subparsers.add_parser(
+        "info",
+        help="Manage the yt-dlp info JSON of a saved directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    info_subparsers = info_parser.add_subparsers(dest="info_command", required=True)
+
+    info_train_parser = info_subparsers.add_parser(
+        "train",
+        help="Train the zstd dictionary new info files are compressed with",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    info_train_parser.set_defaults(func=cmd_info_train)
+    info_train_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    info_train_parser.add_argument("--fields", type=str, help=INFO_FIELDS_HELP)
+    info_train_parser.add_argument(
+        "--samples", type=int, default=10000, help="Number of info files to train on"
+    )
+    info_train_parser.add_argument(
+        "--dict_size", type=int, default=112640, help="Size of the dictionary in bytes"
+    )
+
+    info_compress_parser = info_subparsers.add_parser(
+        "compress",
+        help="Compress the plain info files with the current dictionary",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    info_compress_parser.set_defaults(func=cmd_info_compress)
+    info_compress_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    info_compress_parser.add_argument("--fields", type=str, help=INFO_FIELDS_HELP)
+    info_compress_parser.add_argument(
+        "-j", "--workers", type=int, default=4, help="Number of compression threads"
+    )
+
+    info_show_parser = info_subparsers.add_parser(
+        "show",
+        help="Print the info of an item",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    info_show_parser.set_defaults(func=cmd_info_show)
+    info_show_parser.add_argument("root_dir", type=Path, help="Path to the saved directory")
+    info_show_parser.add_argument("yt_id", type=str, help="YouTube ID of the item")
+    info_show_parser.add_argument(
+        "-t", "--type", choices=["audio", "video"], default="audio", help="Type of the download"
+    )
+
+    # Queue subcommand
+    queue_parser = subparsers.add_parser(
+        "queue",
+        help="Manage the download queue",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    queue_subparsers = queue_parser.add_subparsers(dest="queue_command", required=True)
+
+    queue_status_parser = queue_subparsers.add_parser(
+        "status",
+        help="Count the queued IDs by state",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    queue_status_parser.set_defaults(func=cmd_queue_status)
+    queue_status_parser.add_argument("queue_file", type=Path, help="Path to the queue")
+    queue_status_parser.add_argument(
+        "-t", "--type", choices=["audio", "video"], help="Only IDs queued for this type"
+    )
+
+    queue_compact_parser = queue_subparsers.add_parser(
+        "compact",
+        help="Compact the queue and the failed file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    queue_compact_parser.set_defaults(func=cmd_queue_compact)
+    queue_compact_parser.add_argument("queue_file", type=Path, help="Path to the queue")
+    queue_compact_parser.add_argument(
+        "--failed_file", type=Path, help="File of failed downloads to compact as well"
+    )
 
     args = parser.parse_args()
 
@@ -512,6 +2812,8 @@ def main():
             print("Invalid input type")
             exit(1)
         args.func(args)
+    elif args.command in ["sanity_check", "index", "queue", "ingest", "pack", "info"]:
+        args.func(args)
     else:
         print("Invalid command")
         print(parser.print_help())
@@ -45,6 +45,29 @@ def test_array():
     _write_beat_demo(test_audio, (beats, downbeats), TEST_OUTPUT_AUDIO)
 
 
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="requires python3.10 or higher")
+def test_batch():
+    test_audio_file = _get_test_audio()
+    beat_tracker = BeatThis()
+    results = beat_tracker.batch([test_audio_file] * 3, batch_size=4, num_workers=2)
+    assert len(results) == 3
+    beats, downbeats = beat_tracker(test_audio_file)
+    for batch_beats, batch_downbeats in results:
+        assert isinstance(batch_beats, np.ndarray) and isinstance(batch_downbeats, np.ndarray)
+        assert len(batch_beats) == len(beats) and len(batch_downbeats) == len(downbeats)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="requires python3.10 or higher")
+def test_dbn_cache():
+    test_audio_file = _get_test_audio()
+    beat_tracker = BeatThis()
+    beat_tracker(test_audio_file, min_bpm=60.0)
+    info = BeatThis.dbn_cache_info()
+    BeatThis()(test_audio_file, min_bpm=60.0)
+    assert BeatThis.dbn_cache_info().hits == info.hits + 1
+    assert BeatThis.dbn_cache_info().misses == info.misses
+
+
 def _get_test_audio():
     TEST_AUDIO.parent.mkdir(exist_ok=True, parents=True)
     if not TEST_AUDIO.exists():
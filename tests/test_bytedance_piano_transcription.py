@@ -30,6 +30,16 @@ def test_array():
     _ = transcriptor(audio, TEST_OUTPUT_MIDI, sr=sr)
 
 
+def test_transcribe_many():
+    if not TEST_AUDIO.exists():
+        utils.download(TEST_AUDIO_URL, TEST_AUDIO)
+    transcriptor = ByteDancePianoTranscription(cuda=False)
+    midi_files = transcriptor.transcribe_many(
+        [TEST_AUDIO], TEST_OUTPUT_MIDI.parent / "many", workers=2, torch_threads=1
+    )
+    assert all(midi_file.exists() for midi_file in midi_files)
+
+
 if __name__ == "__main__":
     test_functions = [obj for name, obj in locals().items() if name.startswith("test_")]
     for test_func in test_functions:
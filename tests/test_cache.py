@@ -0,0 +1,111 @@
+import errno
+import logging
+import math
+
+import numpy as np
+
+from mirtoolkit import cache as cache_module
+from mirtoolkit.cache import (
+    PRUNE_TARGET,
+    FeatureStore,
+    ResultCache,
+    audio_hash,
+    get_feature_store,
+    get_result_cache,
+)
+
+
+class _Wrapper:
+    pass
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    audio = np.random.rand(16000).astype(np.float32)
+    key = cache.make_key(audio, _Wrapper(), "model", {"param": 1}, sr=16000)
+    assert key == cache.make_key(audio.copy(), _Wrapper(), "model", {"param": 1}, sr=16000)
+    assert key != cache.make_key(audio, _Wrapper(), "model", {"param": 2}, sr=16000)
+    assert key != cache.make_key(audio, _Wrapper(), "model", {"param": 1}, sr=22050)
+    assert cache.get(key) is None
+
+    # arrays in the parameters are keyed by content, not by their abbreviated repr
+    beats = np.arange(2000.0)
+    other_beats = beats.copy()
+    other_beats[1000] = -1
+    assert cache.make_key(audio, _Wrapper(), "model", {"beats": beats}) != cache.make_key(
+        audio, _Wrapper(), "model", {"beats": other_beats}
+    )
+
+    midi_file = tmp_path / "output.mid"
+    midi_file.write_bytes(b"MThd")
+    cache.put(
+        key,
+        arrays={"beats": np.arange(4.0)},
+        data={"events": [{"onset_time": np.float32(0.5)}]},
+        files={"output.mid": midi_file},
+    )
+    entry = cache.get(key)
+    assert np.array_equal(entry["arrays"]["beats"], np.arange(4.0))
+    assert entry["data"] == {"events": [{"onset_time": 0.5}]}
+    assert entry["files"]["output.mid"].read_bytes() == b"MThd"
+    assert entry["objects"] is None
+
+
+def test_file_hash(tmp_path):
+    audio_file = tmp_path / "audio.wav"
+    audio_file.write_bytes(b"RIFF")
+    digest = audio_hash(audio_file)
+    assert digest == audio_hash(str(audio_file))
+    audio_file.write_bytes(b"RIFF!")
+    assert digest != audio_hash(audio_file)
+
+
+def test_prune(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    keys = [f"{i:02d}" * 32 for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, arrays={"x": np.zeros(100)})
+    # three entries fit below the pruning target
+    cache.max_size = math.ceil(cache.size() / PRUNE_TARGET) + 1
+    cache.get(keys[0])  # keys[1] becomes the least recently used entry
+    cache.put(keys[3], arrays={"x": np.zeros(100)})
+
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in [keys[0], keys[2], keys[3]])
+    assert cache.size() <= cache.max_size * PRUNE_TARGET
+
+    assert cache.clear() == 3
+    assert cache.entries() == []
+
+
+def test_put_error(monkeypatch, tmp_path, caplog):
+    cache = ResultCache(tmp_path / "cache")
+
+    def savez(*args, **kwargs):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(cache_module.np, "savez", savez)
+    with caplog.at_level(logging.WARNING, logger="mirtoolkit.cache"):
+        cache.put("00" * 32, arrays={"x": np.zeros(100)})
+    assert "No space left on device" in caplog.text
+    assert cache.get("00" * 32) is None
+    assert cache.entries() == []
+
+
+def test_get_result_cache(tmp_path):
+    assert get_result_cache(None) is None
+    assert get_result_cache(False) is None
+    cache = ResultCache(tmp_path)
+    assert get_result_cache(cache) is cache
+    assert get_result_cache(tmp_path).cache_dir == tmp_path
+
+
+def test_feature_store(tmp_path):
+    store = get_feature_store(tmp_path / "features")
+    assert isinstance(store, FeatureStore)
+    key = store.make_key(np.zeros(16000), _Wrapper(), "model", {"segment": [0, 10]}, sr=16000)
+    store.put(key, arrays={"hidden.0000": np.ones((8, 4)), "hidden.0001": np.zeros((2, 4))})
+    arrays = store.get(key)["arrays"]
+    assert sorted(arrays) == ["hidden.0000", "hidden.0001"]
+    assert isinstance(arrays["hidden.0000"], np.memmap)
+    assert np.array_equal(arrays["hidden.0000"], np.ones((8, 4)))
@@ -1,3 +1,8 @@
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
 from mirtoolkit import config, utils
 from mirtoolkit.demucs import Demucs
 
@@ -23,6 +28,56 @@ def test_separate():
         demucs.save_audio(stem, TEST_OUTPUT_DIR.joinpath(f"{name}.wav"), out["sr"])
 
 
+def test_array():
+    if not TEST_AUDIO.exists():
+        utils.download(TEST_AUDIO_URL, TEST_AUDIO)
+
+    audio, sr = utils.load_audio(TEST_AUDIO, channels_first=True)
+    demucs = Demucs()
+    out = demucs(audio, sr=sr)
+    assert len(out["separated"]) == 4
+
+
+def test_stream():
+    if not TEST_AUDIO.exists():
+        utils.download(TEST_AUDIO_URL, TEST_AUDIO)
+
+    demucs = Demucs()
+    full = demucs(TEST_AUDIO)
+    chunks = list(demucs.stream(TEST_AUDIO, chunk_seconds=10.0, overlap_seconds=1.0))
+    assert len(chunks) > 1
+    length = sum(chunk["origin"].shape[-1] for chunk in chunks)
+    assert abs(length - full["origin"].shape[-1]) <= len(chunks)
+    for name in full["separated"]:
+        stem = torch.cat([chunk["separated"][name] for chunk in chunks], dim=-1)
+        demucs.save_audio(stem, TEST_OUTPUT_DIR.joinpath(f"{name}_stream.wav"), full["sr"])
+
+
+class _StubSeparator:
+    samplerate = 100
+    audio_channels = 2
+
+    def separate_tensor(self, wav):
+        return wav, {"vocals": wav * 0.5, "other": wav * 0.5}
+
+
+@pytest.mark.parametrize("seconds", [60.0, 60.5, 61.0, 62.0, 75.0])
+def test_stream_length(monkeypatch, tmp_path, seconds):
+    monkeypatch.setattr(Demucs, "_convert", lambda self, audio, sr: torch.as_tensor(audio))
+    demucs = Demucs.__new__(Demucs)
+    demucs.separator = _StubSeparator()
+
+    audio = np.random.default_rng(0).standard_normal((2, int(seconds * 100))).astype("float32")
+    file = tmp_path / "input.wav"
+    sf.write(file, audio.T, 100, subtype="FLOAT")
+    for file_or_array in [audio, file]:
+        chunks = list(demucs.stream(file_or_array, sr=100, chunk_seconds=30.0, overlap_seconds=2.0))
+        origin = torch.cat([chunk["origin"] for chunk in chunks], dim=-1)
+        assert origin.shape[-1] == audio.shape[-1]
+        # the stub separator is the identity, so the cross-fades must give back the input
+        assert torch.allclose(origin, torch.from_numpy(audio), atol=1e-5)
+
+
 if __name__ == "__main__":
     test_functions = [obj for name, obj in locals().items() if name.startswith("test_")]
     for test_func in test_functions:
@@ -0,0 +1,50 @@
+import sys
+
+import pytest
+
+from mirtoolkit import config
+from mirtoolkit.lead_sheet import to_beat_information
+from mirtoolkit.utils import download
+
+if sys.version_info >= (3, 10) and sys.version_info < (3, 12):
+    from mirtoolkit.lead_sheet import LeadSheet
+
+TEST_NAME = "lead_sheet"
+TEST_AUDIO_URL = "https://www.dropbox.com/scl/fi/zj68yghtn0cwtwnqj7vrx/pop.00000.wav?rlkey=bejuh89wehbc8psl9ujmqa73u&st=im68h2jp&dl=0"
+TEST_AUDIO = config.CACHE_DIR.joinpath(f"test_input/{TEST_NAME}/input.mp3")
+
+TEST_AUDIO.parent.mkdir(exist_ok=True, parents=True)
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 10) or sys.version_info >= (3, 12),
+    reason="BeatThis requires python3.10 or higher, SheetSage is incompatible with python3.12",
+)
+def test_lead_sheet():
+    if not TEST_AUDIO.exists():
+        download(TEST_AUDIO_URL, TEST_AUDIO)
+    lead_sheet = LeadSheet()
+    output = lead_sheet(audio_path=TEST_AUDIO)
+    beat_information = lead_sheet.beats(TEST_AUDIO)
+    assert len(beat_information[2]) > 0
+
+    # the beats are tracked once per track
+    lead_sheet.beat_tracker.audio2beats = None
+    rerun = lead_sheet(audio_path=TEST_AUDIO, melody_threshold=0.5)
+    assert rerun["segment_beats"] == output["segment_beats"]
+
+
+def test_to_beat_information():
+    beats = [0.5 * i for i in range(14)]
+    # pickup of two beats, then 3/4 measures, with a downbeat off the beat grid by rounding
+    downbeats = [1.0, 2.5, 4.0001, 5.5]
+    assert to_beat_information(beats, downbeats) == (2, 3, beats)
+    assert to_beat_information(beats, [1.0]) == (2, 4, beats)
+    assert to_beat_information(beats, []) == (0, 4, beats)
+    assert to_beat_information([], []) == (0, 4, [])
+
+
+if __name__ == "__main__":
+    test_functions = [obj for name, obj in locals().items() if name.startswith("test_")]
+    for test_func in test_functions:
+        test_func()
@@ -0,0 +1,55 @@
+import pytest
+import torch
+
+from mirtoolkit import models
+
+
+class Wrapper:
+    def __init__(self, cuda, size=4):
+        self.cuda = cuda
+        self.model = torch.nn.Linear(size, size)
+
+
+@pytest.fixture
+def registry():
+    registry = models.ModelRegistry(idle_timeout=None)
+    registry.register("linear", lambda device, **kwargs: Wrapper(device == "cuda", **kwargs))
+    return registry
+
+
+def test_get_release(registry):
+    model = registry.get("linear", "cpu")
+    assert registry.get("linear", "cpu") is model
+    assert registry.get("linear", "cpu", size=8) is not model
+    assert [info[3] for info in registry.info()] == [2, 1]
+
+    registry.release(model)
+    registry.release(model)
+    with pytest.raises(AssertionError):
+        registry.release(model)
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+    # only unreferenced models are evicted
+    assert registry.clear() == 1
+    assert [info[2] for info in registry.info()] == [{"size": 8}]
+
+
+def test_idle_eviction(registry):
+    registry.idle_timeout = 60.0
+    with registry.use("linear", "cpu") as model:
+        assert registry.evict_idle(0) == 0
+    assert registry.evict_idle() == 0
+    assert registry.get("linear", "cpu") is model
+
+    registry.release(model)
+    assert registry.evict_idle(0) == 1
+    assert registry.get("linear", "cpu") is not model
+
+
+def test_share_memory(registry):
+    registry.preload("linear", "cpu")
+    model = registry.get("linear", "cpu")
+    assert not model.model.weight.is_shared()
+    registry.share_memory()
+    assert model.model.weight.is_shared()
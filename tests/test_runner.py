@@ -0,0 +1,87 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from mirtoolkit import models, runner, utils, ytdb
+
+
+class _RmsTask(runner._Task):
+    name = "rms"
+    model = "rms"
+    sr = 8000
+    mono = True
+
+    def __call__(self, model, audio, sr, item_dir):
+        if len(audio) == 0:
+            raise ValueError("Empty audio")
+        file = item_dir / f"{self.name}.npy"
+        np.save(runner._tmp_path(file), model(audio))
+        return {self.name: file}, {"sr": sr}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setitem(runner.TASKS, "rms", _RmsTask())
+    monkeypatch.setattr(models, "_default_registry", models.ModelRegistry())
+    models.get_registry().register("rms", lambda device: lambda audio: np.sqrt(np.mean(audio**2)))
+
+    db_root = tmp_path / "store"
+    for yt_id, num_frames in [("aaaaaaaaaaa", 16000), ("bbbbbbbbbbb", 16000), ("ccccccccccc", 0)]:
+        item_dir = ytdb._get_save_dir(yt_id, db_root)
+        item_dir.mkdir(parents=True)
+        sf.write(item_dir / "audio.wav", np.full(num_frames, 0.5, dtype=np.float32), 16000)
+        manifest = {"files": {"audio": "audio.wav"}}
+        ytdb._safely_write_manifest(item_dir / "manifest.json", manifest)
+    return db_root
+
+
+def test_run(store):
+    assert runner.run(store, "rms", workers=2, limit=1) == (1, 0)
+    assert runner.run(store, "rms", workers=2) == (1, 1)
+
+    item_dir = ytdb._get_save_dir("aaaaaaaaaaa", store)
+    manifest = json.loads((item_dir / "manifest.json").read_text())
+    assert manifest["files"]["rms"] == "rms.npy"
+    assert json.loads((item_dir / "rms_info.json").read_text()) == {"sr": 8000}
+    assert np.isclose(np.load(item_dir / "rms.npy"), 0.5, atol=1e-3)
+    for item_dir in ytdb._iter_item_dirs(store):
+        with os.scandir(item_dir.parent) as it:
+            for entry in it:
+                ytdb._check_item_dir(entry)
+
+    # processed items are skipped, failed items are retried
+    assert runner.run(store, "rms", workers=2) == (0, 1)
+
+
+def test_resume(store):
+    # outputs moved in place by an interrupted run, but not recorded in the manifest
+    item_dir = ytdb._get_save_dir("aaaaaaaaaaa", store)
+    (item_dir / "rms.npy").write_bytes(b"partial")
+    (item_dir / ".rms_info.json.tmp.json").write_text("{")
+
+    assert runner.run(store, "rms") == (2, 1)
+    assert np.isclose(np.load(item_dir / "rms.npy"), 0.5, atol=1e-3)
+    assert sorted(os.listdir(item_dir)) == [
+        "audio.wav",
+        "manifest.json",
+        "rms.npy",
+        "rms_info.json",
+    ]
+
+
+def test_run_ingested(store, monkeypatch):
+    assert ytdb._ingest_store(store, fmt="npy", sr=8000, workers=2) == 2
+
+    # ingested items are read from the npy files without decoding
+    def stream_audio(path, *args, **kwargs):
+        assert path.name != "audio.wav" or path.parent.name == "ccccccccccc"
+        return utils_stream_audio(path, *args, **kwargs)
+
+    utils_stream_audio = utils.stream_audio
+    monkeypatch.setattr(utils, "stream_audio", stream_audio)
+    assert runner.run(store, "rms", workers=2) == (2, 1)
+    item_dir = ytdb._get_save_dir("bbbbbbbbbbb", store)
+    assert np.isclose(np.load(item_dir / "rms.npy"), 0.5, atol=1e-3)
@@ -1,7 +1,9 @@
 import json
 import logging
 import sys
+import types
 
+import numpy as np
 import pytest
 
 from mirtoolkit import config, utils
@@ -32,6 +34,97 @@ def test_sheetsage():
     )
 
 
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="Skip due to compatibility issues")
+def test_sheetsage_array():
+    audio_file, beat_info_file = _get_test_inputs()
+    beat_info = json.loads(beat_info_file.read_text())
+    audio, sr = utils.load_audio(audio_file)
+    sheetsage = SheetSage()
+    from_array = sheetsage(audio_array=audio, sr=sr, beat_information=beat_info)
+    from_file = sheetsage(audio_path=audio_file, beat_information=beat_info, in_memory=False)
+    assert from_array["segment_beats"] == from_file["segment_beats"]
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="Skip due to compatibility issues")
+def test_sheetsage_features(tmp_path):
+    audio_file, beat_info_file = _get_test_inputs()
+    beat_info = json.loads(beat_info_file.read_text())
+    sheetsage = SheetSage(feature_store=tmp_path / "features")
+    sheetsage(audio_path=audio_file, beat_information=beat_info)
+    features = sheetsage.features(audio_path=audio_file, beat_information=beat_info)
+    assert len(features["melody_logits"]) == len(features["chunks_tertiaries"])
+
+
+def test_sheetsage_thresholds(tmp_path, monkeypatch):
+    calls = _stub_sheetsage(monkeypatch)
+    from mirtoolkit.sheetsage import SheetSage
+
+    audio = np.zeros(16000, dtype=np.float32)
+    sheetsage = SheetSage(cache=tmp_path / "results", feature_store=tmp_path / "features")
+    low = sheetsage(audio_array=audio, sr=16000, melody_threshold=0.1)
+    high = sheetsage(audio_array=audio, sr=16000, melody_threshold=0.9)
+    assert len(calls) == 1 and calls[0]["return_intermediaries"]
+    assert low["melody_logits"] is None and high["melody_logits"] is None
+    assert [e[1:] for e in low["lead_sheet"]["melody"]] == [(1, 2), (4, 1), (5, 2)]
+    assert [e[1:] for e in high["lead_sheet"]["melody"]] == [(4, 1)]
+    assert low["lead_sheet"]["melody"][1][0] == pytest.approx(2.0)
+
+    with_intermediaries = sheetsage(
+        audio_array=audio, sr=16000, melody_threshold=0.5, return_intermediaries=True
+    )
+    assert len(with_intermediaries["melody_logits"]) == 2
+    assert len(calls) == 1
+
+
+def test_sheetsage_features_warm_cache(tmp_path, monkeypatch):
+    calls = _stub_sheetsage(monkeypatch)
+    from mirtoolkit.sheetsage import SheetSage
+
+    audio = np.zeros(16000, dtype=np.float32)
+    SheetSage(cache=tmp_path / "results")(audio_array=audio, sr=16000)
+    assert not calls[0]["return_intermediaries"]
+
+    # the result cache hit has no intermediaries, so the features are computed again
+    sheetsage = SheetSage(cache=tmp_path / "results", feature_store=tmp_path / "features")
+    features = sheetsage.features(audio_array=audio, sr=16000)
+    assert len(calls) == 2 and calls[1]["return_intermediaries"]
+    assert len(features["melody_logits"]) == len(features["chunks_tertiaries"])
+
+
+def _stub_sheetsage(monkeypatch):
+    """Replace `sheetsage.infer` with a model of 2 chunks of 4 tertiaries, 1 beat each."""
+    calls = []
+
+    def sheetsage_infer(audio_path_bytes_or_url, return_intermediaries=False, **kwargs):
+        calls.append(dict(kwargs, return_intermediaries=return_intermediaries))
+        melody_logits = [
+            np.log([[0.9, 0.05, 0.05], [0.4, 0.2, 0.4], [0.95, 0.03, 0.02], [0.95, 0.03, 0.02]]),
+            np.log([[0.02, 0.96, 0.02], [0.3, 0.3, 0.4], [0.95, 0.03, 0.02], [0.95, 0.03, 0.02]]),
+        ]
+        output = {
+            "lead_sheet": "lead sheet",
+            "segment_beats": [0, 1],
+            "segment_beats_times": [0.0, 2.0],
+            "chunks_tertiaries": [np.arange(0, 4), np.arange(4, 8)],
+            "melody_logits": None,
+            "harmony_logits": None,
+            "melody_last_hidden_state": None,
+            "harmony_last_hidden_state": None,
+        }
+        if return_intermediaries:
+            output["melody_logits"] = melody_logits
+            output["melody_last_hidden_state"] = [np.zeros((4, 8)), np.zeros((4, 8))]
+        return output
+
+    infer = types.ModuleType("sheetsage.infer")
+    infer.sheetsage = sheetsage_infer
+    package = types.ModuleType("sheetsage")
+    package.infer = infer
+    monkeypatch.setitem(sys.modules, "sheetsage", package)
+    monkeypatch.setitem(sys.modules, "sheetsage.infer", infer)
+    return calls
+
+
 def _get_test_inputs():
     if not TEST_AUDIO.exists():
         utils.download(TEST_AUDIO_URL, TEST_AUDIO)
@@ -0,0 +1,99 @@
+import warnings
+
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
+from mirtoolkit import utils
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    rng = np.random.default_rng(0)
+    audio = 0.1 * rng.standard_normal((44100 * 5 + 123, 2)).astype(np.float32)
+    file = tmp_path / "audio.wav"
+    sf.write(file, audio, 44100)
+    return file
+
+
+@pytest.mark.parametrize("sr", [None, 16000, 48000])
+def test_stream_audio(audio_file, sr):
+    audio, audio_sr = utils.load_audio(audio_file, sr=sr, mono=True)
+    streamed, streamed_sr = utils.read_stream(
+        utils.stream_audio(audio_file, block_seconds=1.3, sr=sr, mono=True)
+    )
+    assert streamed_sr == audio_sr
+    assert streamed.shape == audio.shape
+    assert np.allclose(streamed, audio, atol=1e-6)
+
+
+def test_stream_audio_hop(audio_file):
+    blocks = list(utils.stream_audio(audio_file, block_seconds=2.0, hop=1.0, sr=16000))
+    assert [len(block) for block, _ in blocks] == [32000] * 4 + [16000 * 5 + 45 - 4 * 16000]
+    assert all(block.shape[1] == 2 for block, _ in blocks)
+    assert np.array_equal(blocks[0][0][16000:], blocks[1][0][:16000])
+
+
+def test_load_mono_prefetch(audio_file):
+    from concurrent.futures import ThreadPoolExecutor
+
+    audio, _ = utils.load_audio(audio_file, sr=16000, mono=True)
+    assert np.allclose(utils.load_mono(audio_file, 16000), audio, atol=1e-6)
+    with ThreadPoolExecutor(2) as executor:
+        assert list(utils.prefetch(executor, lambda x: x * 2, range(10), 3)) == list(
+            range(0, 20, 2)
+        )
+
+
+def test_resample():
+    waveform = torch.randn(2, 44100)
+    assert utils.resample(waveform, 44100, 44100) is waveform
+    assert utils.resample(waveform, 44100, 16000).shape == (2, 16000)
+    assert utils.get_resampler(44100, 16000) is utils.get_resampler(44100, 16000)
+    assert utils.get_resampler(44100, 16000, torch.float64) is not utils.get_resampler(44100, 16000)
+
+
+def test_load_audio_resample_channels_last(audio_file):
+    audio, sr = utils.load_audio(audio_file, sr=16000)
+    assert sr == 16000
+    assert audio.shape == (16000 * 5 + 45, 2)
+
+
+def test_load_audio_mono(audio_file):
+    audio, sr = utils.load_audio(audio_file)
+    mono, mono_sr = utils.load_audio(audio_file, mono=True)
+    assert mono_sr == sr == 44100
+    assert mono.dtype == np.float32 and mono.shape == (len(audio),)
+    assert np.allclose(mono, audio.mean(-1), atol=1e-7)
+
+    mono64, _ = utils.load_audio(audio_file, dtype="float64", mono=True)
+    assert mono64.dtype == np.float64
+    assert np.allclose(mono64, mono, atol=1e-7)
+
+
+def test_load_audio_mono_channels_first(audio_file):
+    mono, _ = utils.load_audio(audio_file, mono=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        array, _ = utils.load_audio(audio_file, mono=True, channels_first=True)
+        tensor, _ = utils.load_audio(audio_file, mono=True, channels_first=True, return_tensor=True)
+    assert array.shape == tensor.shape == mono.shape
+    assert np.array_equal(array, mono) and np.array_equal(tensor.numpy(), mono)
+
+
+def test_load_audio_out(audio_file):
+    buffer = np.empty((44100 * 6, 2), dtype=np.float32)
+    audio, _ = utils.load_audio(audio_file, out=buffer)
+    assert np.shares_memory(audio, buffer)
+    assert audio.shape == (44100 * 5 + 123, 2)
+
+    tensor, _ = utils.load_audio(audio_file, out=buffer, return_tensor=True, channels_first=True)
+    assert tensor.shape == (2, 44100 * 5 + 123)
+    assert np.shares_memory(tensor.numpy(), buffer)
+
+    pool = utils.AudioBufferPool()
+    first, _ = utils.load_audio(audio_file, mono=True, out=pool)
+    second, _ = utils.load_audio(audio_file, mono=True, out=pool)
+    assert np.shares_memory(first, second)
+    assert np.array_equal(second, audio.mean(-1).astype(np.float32))
@@ -1,7 +1,11 @@
 import argparse
 import json
+import os
 import shutil
+import subprocess
 import sys
+import tarfile
+from pathlib import Path
 
 import pytest
 
@@ -41,6 +45,643 @@ def test_download():
     _test_download_file(args)
 
 
+def test_download_jobs(monkeypatch, tmp_path):
+    failed_file = tmp_path / "download_failed.txt"
+    failed_file.write_text("id_removed unavailable\n")
+    yt_ids = [f"id_{i:04d}" for i in range(64)] + ["id_removed"]
+
+    def fake_download(yt_id, *args, **kwargs):
+        if yt_id == "id_removed":
+            raise ytdb.DownloadFailedRemoved(yt_id)
+        if int(yt_id[-4:]) % 2 == 1:
+            raise ytdb.DownloadFailedPrivate(yt_id)
+        return yt_id
+
+    monkeypatch.setattr(ytdb, "_download", fake_download)
+    ytdb._download_wrapper(
+        yt_ids=yt_ids,
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=failed_file,
+        failed_skip_type={"private"},
+        download_interval=0,
+        jobs=8,
+    )
+
+    failed = dict(line.split() for line in failed_file.read_text().splitlines())
+    assert failed["id_removed"] == "removed"
+    assert sorted(k for k, v in failed.items() if v == "private") == yt_ids[1:64:2]
+
+
+def test_download_queue(monkeypatch, tmp_path):
+    failed_file = tmp_path / "download_failed.txt"
+    queue_file = tmp_path / "queue.sqlite"
+    yt_ids = [f"id_{i:04d}" for i in range(32)]
+    downloaded = []
+
+    def fake_download(yt_id, *args, **kwargs):
+        if yt_id == "id_0010":
+            raise KeyboardInterrupt
+        if int(yt_id[-4:]) % 4 == 1:
+            raise ytdb.DownloadFailedPrivate(yt_id)
+        if int(yt_id[-4:]) % 4 == 3:
+            raise ytdb.DownloadFailedOther(yt_id)
+        downloaded.append(yt_id)
+
+    kwargs = {
+        "tgt_type": "audio",
+        "output_dir_root": tmp_path,
+        "failed_file": failed_file,
+        "failed_skip_type": {"private"},
+        "download_interval": 0,
+        "queue_file": queue_file,
+        "max_retries": 0,
+    }
+    monkeypatch.setattr(ytdb, "_download", fake_download)
+    with pytest.raises(KeyboardInterrupt):
+        ytdb._download_wrapper(yt_ids=yt_ids, **kwargs)
+    queue = ytdb.DownloadQueue(queue_file)
+    assert queue.counts("audio") == {"in_progress": 22, "done": 5, "failed": 5}
+    queue.close()
+
+    # the resumed run retries the claimed IDs and the failures that aren't skipped
+    downloaded.clear()
+    monkeypatch.setattr(ytdb, "_download", lambda yt_id, *a, **kw: downloaded.append(yt_id))
+    ytdb._download_wrapper(yt_ids=yt_ids, **kwargs)
+    assert downloaded == ["id_0003", "id_0007"] + yt_ids[10:]
+    queue = ytdb.DownloadQueue(queue_file)
+    assert queue.counts("audio") == {"done": 29, "failed": 3}
+    queue.close()
+
+
+def test_download_retries(monkeypatch, tmp_path):
+    failed_file = tmp_path / "download_failed.txt"
+    yt_ids = [f"id_{i:04d}" for i in range(8)]
+    calls = []
+
+    def fake_download(yt_id, *args, **kwargs):
+        calls.append(yt_id)
+        if yt_id == "id_0003" or (yt_id == "id_0005" and calls.count(yt_id) == 1):
+            raise ytdb.DownloadFailedOther(yt_id)
+
+    monkeypatch.setattr(ytdb, "_download", fake_download)
+    monkeypatch.setattr(ytdb, "RETRY_DELAYS", {"other": 0.0})
+    ytdb._download_wrapper(
+        yt_ids=yt_ids,
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=failed_file,
+        failed_skip_type=set(),
+        download_interval=0,
+        jobs=2,
+        max_retries=2,
+    )
+    assert calls.count("id_0003") == 3
+    assert calls.count("id_0005") == 2
+    assert failed_file.read_text() == "id_0003 other\n"
+
+
+def test_download_skips_downloaded(monkeypatch, tmp_path):
+    yt_ids = [f"aaaa{i:07d}" for i in range(6)]
+    for yt_id in yt_ids:
+        _make_item(yt_id, tmp_path)
+    calls = []
+    monkeypatch.setattr(ytdb, "_download", lambda yt_id, *args, **kwargs: calls.append(yt_id))
+    monkeypatch.setattr(ytdb.RateLimiter, "acquire", lambda self: calls.append("acquire"))
+    monkeypatch.setattr(ytdb.RateLimiter, "record", lambda self, keyword: calls.append("record"))
+    ytdb._download_wrapper(
+        yt_ids=yt_ids + ["bbbb0000000"],
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=tmp_path / "download_failed.txt",
+        failed_skip_type=set(),
+    )
+    assert calls == ["acquire", "bbbb0000000", "record"]
+
+
+def test_download_filter(monkeypatch, tmp_path):
+    match_filter = ytdb._get_match_filter(max_duration=600, filter="view_count >? 100")
+    assert match_filter == "duration <=? 600 & !is_live & view_count >? 100"
+    assert ytdb._get_match_filter() is None
+    cmd = ytdb._get_download_cmd("audio", "aaaa0000000", tmp_path, match_filter=match_filter)
+    assert cmd[cmd.index("--break-match-filters") + 1] == match_filter
+
+    def fake_run(cmd, **kwargs):
+        # yt-dlp rejects the item after extracting its metadata
+        raise subprocess.CalledProcessError(ytdb.YT_DLP_FILTERED_EXIT_CODE, cmd, "", "")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    failed_file = tmp_path / "download_failed.txt"
+    kwargs = dict(
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=failed_file,
+        failed_skip_type={"filtered"},
+        download_interval=0,
+        match_filter=match_filter,
+    )
+    ytdb._download_wrapper(yt_ids=["aaaa0000000"], **kwargs)
+    assert failed_file.read_text() == "aaaa0000000 filtered\n"
+
+    # filtered IDs are skipped by later runs without running yt-dlp
+    monkeypatch.setattr(subprocess, "run", None)
+    ytdb._download_wrapper(yt_ids=["aaaa0000000"], **kwargs)
+
+    pytest.importorskip("yt_dlp")
+    from yt_dlp.utils import RejectedVideoReached
+
+    ydl = ytdb.YtDlpBackend(match_filter=match_filter)._get_ydl("audio")
+    # items without a duration pass, unless they're live
+    for info in [{"duration": 300, "is_live": False}, {"is_live": False}, {}]:
+        assert ydl.params["match_filter"](info) is None
+    for info in [{"duration": 3600, "is_live": False}, {"is_live": True}, {"view_count": 10}]:
+        with pytest.raises(RejectedVideoReached):
+            ydl.params["match_filter"](info)
+
+    ydl = ytdb.YtDlpBackend(match_filter=ytdb._get_match_filter(min_duration=30))._get_ydl("audio")
+    assert ydl.params["match_filter"]({}) is None
+    with pytest.raises(RejectedVideoReached):
+        ydl.params["match_filter"]({"duration": 10})
+
+
+def test_rate_limiter():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    limiter = ytdb.RateLimiter(rate=2.0, cooldown=60.0, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        limiter.acquire()
+    assert now[0] == pytest.approx(2.0)
+
+    limiter.record(None)
+    assert limiter.rate == pytest.approx(2.1)
+    limiter.record(ytdb.DownloadFailedRateLimited.keyword)
+    assert limiter.rate == pytest.approx(1.05)
+    limiter.acquire()
+    assert now[0] == pytest.approx(62.0 + 1 / 1.05)
+
+    # probing near the rate that was throttled is slower
+    limiter.record(None)
+    assert limiter.rate == pytest.approx(1.05 * 1.05)
+    limiter.rate = 2.0
+    limiter.record(None)
+    assert limiter.rate == pytest.approx(2.01)
+
+    # "other" failures in half of the recent downloads throttle as well
+    for keyword in [None, "other"] * 5:
+        limiter.record(keyword)
+    assert limiter.rate < 2.0
+
+    # without an initial rate, the throughput before the first throttling is the reference
+    limiter = ytdb.RateLimiter(clock=lambda: now[0], sleep=sleep)
+    start = now[0]
+    for _ in range(5):
+        limiter.acquire()
+        now[0] += 0.25
+    assert now[0] == pytest.approx(start + 1.25)
+    limiter.record(ytdb.DownloadFailedRateLimited.keyword)
+    assert limiter.rate == pytest.approx(2.0)
+
+
+def test_retry_queue():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    retries = ytdb.RetryQueue({"other": 10.0}, max_retries=2, clock=lambda: now[0], sleep=sleep)
+    assert not retries.push("id_0000", "private")
+    assert retries.push("id_0000", "other")
+    assert list(retries.merge(["id_0001"])) == ["id_0001"]
+    now[0] = 15.0
+    assert list(retries.merge(["id_0002"])) == ["id_0000", "id_0002"]
+
+    # the backoff doubles with each retry
+    assert retries.push("id_0000", "other")
+    assert list(retries.iter_waiting()) == ["id_0000"]
+    assert 25.0 <= now[0] <= 45.0
+    assert not retries.push("id_0000", "other")
+    assert len(retries) == 0
+
+
+def test_failure_log(tmp_path):
+    failed_file = tmp_path / "download_failed.txt"
+    failure_log = ytdb.FailureLog(failed_file, min_compact_lines=4)
+    for keyword in ["other", "other", "unavailable", "private"]:
+        failure_log.record("id_0000", keyword)
+    failure_log.record("id_0001", "removed")
+    assert failed_file.read_text().splitlines() == [
+        "id_0000 other",
+        "id_0000 unavailable",
+        "id_0000 private",
+        "id_0001 removed",
+    ]
+    assert ytdb.FailureLog(failed_file).get("id_0000") == "private"
+
+    # superseded lines are dropped once they outnumber the IDs
+    failure_log.record("id_0001", "private")
+    assert failed_file.read_text().splitlines() == ["id_0000 private", "id_0001 private"]
+
+
+def test_parse_ids(tmp_path):
+    yt_ids = [f"id_{i:08d}" for i in range(1000)]
+    json_file = tmp_path / "ids.json"
+    entries = [f"https://www.youtube.com/watch?v={yt_id}" for yt_id in yt_ids]
+    json_file.write_text(json.dumps(entries, indent=1))
+    assert list(ytdb._parse_ids_file(json_file)) == yt_ids
+    # elements cut across chunk boundaries
+    assert list(ytdb._iter_json_array(json_file, chunk_size=7)) == entries
+    json_file.write_text('[1, 23, "a"')
+    with pytest.raises(ValueError):
+        list(ytdb._iter_json_array(json_file, chunk_size=3))
+
+    txt_file = tmp_path / "ids.txt"
+    txt_file.write_text("\n".join(f"{a} {b}" for a, b in zip(yt_ids[::2], yt_ids[1::2])))
+    assert list(ytdb._parse_ids_file(txt_file)) == yt_ids
+
+
+def test_dedup_ids():
+    yt_ids = [f"id_{i:08d}" for i in range(2000)]
+    stream = yt_ids[:1000] + yt_ids[990:]
+    assert list(ytdb._dedup_ids(iter(stream))) == yt_ids
+
+    # an overfull filter keeps the new IDs and drops the repeats that are already downloaded
+    downloaded = []
+    known = set()
+    for yt_id in ytdb._dedup_ids(stream, is_known=known.__contains__, capacity=10, window=5):
+        downloaded.append(yt_id)
+        known.add(yt_id)
+    assert downloaded == yt_ids
+
+    bloom = ytdb.BloomFilter(capacity=1000, error_rate=0.01)
+    for yt_id in yt_ids[:1000]:
+        bloom.add(yt_id)
+    assert all(yt_id in bloom for yt_id in yt_ids[:1000])
+    assert sum(yt_id in bloom for yt_id in yt_ids[1000:]) < 50
+
+
+def test_dedup_failed_ids(monkeypatch, tmp_path):
+    failed_file = tmp_path / "download_failed.txt"
+    failed_file.write_text("aaaa0000000 other\nbbbb0000000 private\n")
+    calls = []
+    monkeypatch.setattr(ytdb, "_download", lambda yt_id, *args, **kwargs: calls.append(yt_id))
+    # every ID is a Bloom filter false positive, so only the confirmation decides
+    monkeypatch.setattr(ytdb.BloomFilter, "add", lambda self, item: True)
+    ytdb._download_wrapper(
+        yt_ids=["aaaa0000000", "bbbb0000000"],
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=failed_file,
+        failed_skip_type={"private"},
+        download_interval=0,
+    )
+    assert calls == ["aaaa0000000"]
+
+
+def test_download_backend(tmp_path):
+    class FakeBackend:
+        def download(self, yt_id, tgt_type, tmp_dir):
+            (tmp_dir / f"{tgt_type}.webm").write_bytes(b"audio")
+            (tmp_dir / f"{tgt_type}.info.json").write_text(json.dumps({"id": yt_id}))
+
+    assert ytdb._download(TEST_ID, "audio", tmp_path, backend=FakeBackend()) == TEST_ID
+    item_dir = ytdb._get_save_dir(TEST_ID, tmp_path)
+    manifest = json.loads((item_dir / "manifest.json").read_text())
+    assert manifest["files"] == {"audio": "audio.webm", "audio_info": "audio_info.json"}
+    assert (item_dir / "audio.webm").read_bytes() == b"audio"
+
+
+@pytest.mark.parametrize("fmt", ["flac", "npy"])
+def test_ingest(tmp_path, fmt):
+    np = pytest.importorskip("numpy")
+    sf = pytest.importorskip("soundfile")
+
+    t = np.arange(32000) / 32000
+    stereo = np.stack([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 440 * t)], axis=1) * 0.5
+    for yt_id in ["aaaa0000000", "bbbb0000000"]:
+        _make_item(yt_id, tmp_path)
+        item_dir = ytdb._get_save_dir(yt_id, tmp_path)
+        (item_dir / "audio.webm").unlink()
+        sf.write(item_dir / "audio.wav", stereo, 32000)
+        manifest = json.loads((item_dir / "manifest.json").read_text())
+        manifest["files"]["audio"] = "audio.wav"
+        ytdb._safely_write_manifest(item_dir / "manifest.json", manifest)
+
+    assert ytdb._ingest_store(tmp_path, fmt=fmt, sr=16000, workers=2) == 2
+    assert ytdb._ingest_store(tmp_path, fmt=fmt, sr=16000, workers=2) == 0
+
+    item_dir = ytdb._get_save_dir("aaaa0000000", tmp_path)
+    manifest = json.loads((item_dir / "manifest.json").read_text())
+    assert manifest["files"]["audio_16000"] == f"audio_16000.{fmt}"
+    assert manifest["ingest"]["audio_16000"] == {"sr": 16000, "channels": 1, "format": fmt}
+    waveform, sr = ytdb.load_ingested_audio(item_dir, "audio_16000")
+    assert sr == 16000
+    assert waveform.shape == (16000,)
+    assert np.allclose(waveform[100:-100], stereo[200:-200:2, 0], atol=1e-2)
+    assert isinstance(waveform, np.memmap) == (fmt == "npy")
+    with os.scandir(item_dir.parent) as it:
+        for entry in it:
+            ytdb._check_item_dir(entry)
+
+
+def test_check_item_dir(tmp_path):
+    manifests = {
+        "aaaa0000000": {"files": {"audio": "audio.webm"}},
+        "bbbb0000000": [],
+        "cccc0000000": {"files": ["audio.webm"]},
+        "dddd0000000": {"files": {"audio": ["audio.webm"]}},
+    }
+    for yt_id, manifest in manifests.items():
+        (tmp_path / yt_id).mkdir()
+        (tmp_path / yt_id / "audio.webm").write_bytes(b"")
+        (tmp_path / yt_id / "manifest.json").write_text(json.dumps(manifest))
+    (tmp_path / "eeee0000000").mkdir()
+    (tmp_path / "eeee0000000" / "manifest.json").mkdir()
+
+    weird_yt_ids = []
+    with os.scandir(tmp_path) as it:
+        for entry in it:
+            try:
+                ytdb._check_item_dir(entry)
+            except ytdb.WeirdYtIdException as e:
+                weird_yt_ids.append(e.yt_id)
+    assert sorted(weird_yt_ids) == ["bbbb0000000", "cccc0000000", "dddd0000000", "eeee0000000"]
+
+
+def test_pack(monkeypatch, tmp_path):
+    yt_ids = [f"{c * 4}0000000" for c in "abcdef"]
+    for yt_id in yt_ids:
+        _make_item(yt_id, tmp_path)
+        (ytdb._get_save_dir(yt_id, tmp_path) / "audio.webm").write_bytes(yt_id.encode() * 100)
+    ytdb.StoreIndex(tmp_path).rebuild()
+
+    # a shard holds 2 items of 1 KiB members
+    assert ytdb._pack_store(tmp_path, shard_size=5000, batch_size=4) == 6
+    store = ytdb.PackedStore.open(tmp_path)
+    assert len(store) == 6
+    assert store.read("cccc0000000", "audio") == b"cccc0000000" * 100
+    assert store.get_manifest("cccc0000000")["files"]["audio"] == "audio.webm"
+    shard_file, offset, size = store.locate("aaaa0000000", "audio_info")
+    assert shard_file.read_bytes()[offset : offset + size] == b"{}"
+    items = list(store.iter_items())
+    assert sorted(yt_id for yt_id, _, _ in items) == yt_ids
+    assert all(files["audio"] == yt_id.encode() * 100 for yt_id, _, files in items)
+    store.close()
+
+    shard_files = sorted((tmp_path / ".packed").glob("shard-*.tar"))
+    assert len(shard_files) == 3
+    with tarfile.open(shard_files[0]) as tar:
+        names = tar.getnames()
+    assert len(names) == 6
+    assert names[0].endswith(".manifest.json")
+
+    # the shards don't break directory walks
+    assert len(list(ytdb._iter_item_dirs(tmp_path))) == 6
+
+    # uncommitted appends are dropped, and packed items are not packed again
+    with open(shard_files[-1], "ab") as f:
+        f.write(b"partial")
+    _make_item("gggg0000000", tmp_path)
+    assert ytdb._pack_store(tmp_path, shard_size=5000, delete=True) == 1
+    assert not ytdb._get_save_dir("aaaa0000000", tmp_path).exists()
+    index = ytdb.StoreIndex.open(tmp_path)
+    assert index.get_manifest("aaaa0000000") is None
+    index.close()
+    with tarfile.open(max((tmp_path / ".packed").glob("shard-*.tar"))) as tar:
+        assert [name.split(".")[0] for name in tar.getnames()][-1] == "gggg0000000"
+
+    # packed items are not downloaded again
+    def fake_download(yt_id, *args, **kwargs):
+        raise AssertionError(yt_id)
+
+    monkeypatch.setattr(ytdb, "_download", fake_download)
+    ytdb._download_wrapper(
+        yt_ids=yt_ids,
+        tgt_type="audio",
+        output_dir_root=tmp_path,
+        failed_file=tmp_path / "download_failed.txt",
+        failed_skip_type=set(),
+        download_interval=0,
+    )
+
+
+def test_pack_broken_item(monkeypatch, tmp_path):
+    for yt_id in ["aaaa0000000", "bbbb0000000", "cccc0000000", "dddd0000000"]:
+        _make_item(yt_id, tmp_path)
+    (ytdb._get_save_dir("bbbb0000000", tmp_path) / "audio.webm").unlink()
+
+    # a write of cccc fails after its first members have been written
+    addfile = tarfile.TarFile.addfile
+
+    def failing_addfile(self, info, fileobj=None):
+        if info.name == "cccc0000000.audio_info.json":
+            raise OSError("write failed")
+        return addfile(self, info, fileobj)
+
+    monkeypatch.setattr(tarfile.TarFile, "addfile", failing_addfile)
+    assert ytdb._pack_store(tmp_path) == 2
+
+    store = ytdb.PackedStore.open(tmp_path)
+    assert "bbbb0000000" not in store and "cccc0000000" not in store
+    assert [yt_id for yt_id, _, _ in store.iter_items()] == ["aaaa0000000", "dddd0000000"]
+    assert store.read("dddd0000000", "audio") == b"audio"
+    store.close()
+    with tarfile.open(tmp_path / ".packed" / "shard-000000.tar") as tar:
+        assert {name.split(".")[0] for name in tar.getnames()} == {"aaaa0000000", "dddd0000000"}
+
+
+def test_yt_dlp_backend_missing(monkeypatch):
+    monkeypatch.setitem(sys.modules, "yt_dlp", None)
+    with pytest.raises(ImportError, match="pip install yt-dlp"):
+        ytdb.YtDlpBackend()
+
+
+def test_classify_yt_dlp_error():
+    pytest.importorskip("yt_dlp")
+    import io
+    import sys
+
+    from yt_dlp.networking import Response
+    from yt_dlp.networking.exceptions import HTTPError
+    from yt_dlp.utils import DownloadError, ExtractorError, UnsupportedError
+
+    def download_error(make_cause):
+        try:
+            try:
+                make_cause()
+            except Exception as e:
+                raise ExtractorError("Unable to download webpage", cause=e) from e
+        except ExtractorError as e:
+            return DownloadError(f"ERROR: {e}", sys.exc_info())
+
+    def raise_private():
+        raise ExtractorError("Private video. Sign in if you've been granted access", expected=True)
+
+    def raise_429():
+        raise HTTPError(Response(io.BytesIO(), "https://www.youtube.com", {}, status=429))
+
+    def raise_unsupported():
+        raise UnsupportedError("https://example.com")
+
+    classify = ytdb._classify_yt_dlp_error
+    assert isinstance(classify(TEST_ID, download_error(raise_429)), ytdb.DownloadFailedRateLimited)
+    assert isinstance(
+        classify(TEST_ID, download_error(raise_unsupported)), ytdb.DownloadFailedUnsupported
+    )
+    try:
+        raise_private()
+    except ExtractorError:
+        error = DownloadError("ERROR: [youtube] Private video", sys.exc_info())
+    assert isinstance(classify(TEST_ID, error), ytdb.DownloadFailedPrivate)
+    assert isinstance(classify(TEST_ID, DownloadError("ERROR: ???")), ytdb.DownloadFailedOther)
+
+
+def test_save_info(tmp_path):
+    info = {"id": "aaaa0000000", "title": "title", "formats": [{"url": "x" * 1000}]}
+    for name, fields in [("plain", None), ("trimmed", ytdb.INFO_FIELDS)]:
+        info_file = tmp_path / f"{name}.info.json"
+        info_file.write_text(json.dumps(info))
+        item_dir = tmp_path / name
+        item_dir.mkdir()
+        save_file = ytdb._save_info(info_file, item_dir, "audio", tmp_path, fields)
+        assert save_file == item_dir / "audio_info.json"
+        manifest = {"files": {"audio_info": save_file.name}}
+        loaded = ytdb.load_info(item_dir, manifest=manifest)
+        assert loaded == (info if fields is None else {"id": "aaaa0000000", "title": "title"})
+
+
+def test_compress_info(tmp_path):
+    pytest.importorskip("zstandard")
+    infos = {}
+    for i in range(200):
+        yt_id = f"aa{i:03d}000000"
+        infos[yt_id] = {"id": yt_id, "title": f"song {i}", "duration": i, "tags": ["a", "b"]}
+        _make_item(yt_id, tmp_path, infos[yt_id])
+    ytdb.StoreIndex(tmp_path).rebuild()
+
+    # without a dictionary, then with one: both stay readable
+    item_dir = ytdb._get_save_dir("aa000000000", tmp_path)
+    info_file = tmp_path / "x.info.json"
+    info_file.write_text(json.dumps(infos["aa000000000"]))
+    save_file = ytdb._save_info(info_file, tmp_path, "video", tmp_path, compress=True)
+    assert save_file.name == "video_info.json.zst"
+
+    dict_id = ytdb._train_info_dict(tmp_path, dict_size=4096)
+    assert (tmp_path / ytdb.INFO_DICT_DIR / "current").read_text() == str(dict_id)
+    assert ytdb._compress_store_info(tmp_path, fields=["id", "duration"], workers=2) == 200
+    assert ytdb._compress_store_info(tmp_path) == 0
+
+    manifest = json.loads((item_dir / "manifest.json").read_text())
+    assert manifest["files"]["audio_info"] == "audio_info.json.zst"
+    assert not (item_dir / "audio_info.json").exists()
+    assert ytdb.load_info(item_dir) == {"id": "aa000000000", "duration": 0}
+    assert (
+        json.loads(ytdb._decompress_info(save_file.read_bytes(), tmp_path)) == infos["aa000000000"]
+    )
+
+    index = ytdb.StoreIndex(tmp_path)
+    assert index.get_files("aa199000000")["audio_info"]["file"] == "audio_info.json.zst"
+    assert len(list(index.query(min_duration=100))) == 100
+    index.close()
+
+
+def test_compress_info_missing_zstandard(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    info_file = tmp_path / "x.info.json"
+    info_file.write_text(json.dumps({"id": "aaaa0000000"}))
+    with pytest.raises(ImportError, match="pip install zstandard"):
+        ytdb._save_info(info_file, tmp_path, "audio", tmp_path, compress=True)
+
+
+def test_index(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    for yt_id, duration in [("aaaa0000000", 30), ("bbbb0000000", 600)]:
+        _make_item(yt_id, tmp_path, {"id": yt_id, "channel": "ch", "duration": duration})
+    failed_file = tmp_path / "download_failed.txt"
+    failed_file.write_text("cccc0000000 private\n")
+
+    index = ytdb.StoreIndex(tmp_path)
+    assert index.rebuild(failed_file=failed_file) == 2
+    assert index.get_manifest("aaaa0000000")["files"]["audio"] == "audio.webm"
+    assert index.get_manifest("cccc0000000") is None
+    assert index.get_files("bbbb0000000")["audio"]["size"] == len(b"audio")
+    assert [r["yt_id"] for r in index.query(failed="private")] == ["cccc0000000"]
+    assert len(list(index.query(tgt_type="audio"))) == 2
+    assert len(list(index.query(tgt_type="video"))) == 0
+    assert index.get_metadata("aaaa0000000")["duration"] == 30
+    results = list(index.query(tgt_type="audio", min_duration=60, channel="ch"))
+    assert [r["yt_id"] for r in results] == ["bbbb0000000"]
+    assert results[0]["metadata"]["channel"] == "ch"
+    assert len(list(index.query(max_duration=600, channel="other"))) == 0
+    index.close()
+
+    # the index file at the store root must not break directory walks
+    assert len(list(ytdb._iter_item_dirs(tmp_path))) == 2
+
+    (ytdb._get_save_dir("bbbb0000000", tmp_path) / "audio.webm").unlink()
+    ytdb._sanity_check_index(tmp_path)
+    assert Path("weird_yt_ids.txt").read_text().split() == ["bbbb0000000"]
+
+
+def test_sanity_check(tmp_path):
+    store = tmp_path / "store"
+    for yt_id in ["aaaa0000000", "aaab0000000", "bbbb0000000", "bbbc0000000"]:
+        _make_item(yt_id, store)
+    (ytdb._get_save_dir("aaab0000000", store) / "manifest.json").unlink()
+    output_file = tmp_path / "weird_yt_ids.txt"
+    checkpoint_file = store / ".sanity_check.json"
+
+    ytdb._sanity_check(store, output_file=output_file, workers=2)
+    assert output_file.read_text().split() == ["aaab0000000"]
+    shards = json.loads(checkpoint_file.read_text())["shards"]
+    assert set(shards) == {"a/a/a", "b/b/b"}
+
+    # unchanged shards reuse the checkpoint
+    shard_dir = str(store / "a" / "a" / "a")
+    state = dict(shards["a/a/a"], weird=["cached"])
+    assert ytdb._check_shard((shard_dir, state)) == (shard_dir, state, True)
+
+    (ytdb._get_save_dir("bbbc0000000", store) / "extra.txt").write_text("")
+    ytdb._sanity_check(store, output_file=output_file, workers=2)
+    assert output_file.read_text().split() == ["aaab0000000", "bbbc0000000"]
+
+
+def test_import_time():
+    # guards the cold start of `ytdb`, see scripts/bench_import_time.py for the wall time
+    code = (
+        "import sys; sys.argv = ['ytdb', '--help']\n"
+        "import mirtoolkit, mirtoolkit.ytdb\n"
+        "print(' '.join(sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    modules = set(result.stdout.split())
+    assert "mirtoolkit.ytdb" in modules
+    for heavy in ["torch", "torchaudio", "numpy", "tqdm", "sqlite3", "concurrent.futures"]:
+        assert heavy not in modules, f"{heavy} is imported by `ytdb --help`"
+    assert "mirtoolkit.config" not in modules
+
+    result = subprocess.run(
+        [sys.executable, "-m", "mirtoolkit.ytdb", "--help"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert "download" in result.stdout
+
+
+def _make_item(yt_id, db_root, info=None):
+    item_dir = ytdb._get_save_dir(yt_id, db_root)
+    item_dir.mkdir(parents=True)
+    (item_dir / "audio.webm").write_bytes(b"audio")
+    (item_dir / "audio_info.json").write_text(json.dumps(info or {}))
+    manifest = {"files": {"audio": "audio.webm", "audio_info": "audio_info.json"}}
+    ytdb._safely_write_manifest(item_dir / "manifest.json", manifest)
+
+
 def _test_download_file(args):
     ytdb.cmd_download(args)
 